@@ -0,0 +1,136 @@
+"""
+Linha do tempo de acompanhamento de incidentes e riscos.
+
+Cada nota é uma linha em `acompanhamentos` (autor, data, texto): adicionar
+uma nota é um INSERT, sem regravar o registro. As leituras são paginadas
+por chave (id decrescente, ?antes=<id>) e as listas mostram só a última
+nota de cada registro, com uma consulta para a página inteira.
+
+O texto antigo de incidentes.acompanhamento/riscos.acompanhamento vira a
+primeira nota do registro na migração (migrar_existentes); a coluna fica
+como estava, só para leitura e como fonte da migração. A busca do projeto
+indexa o texto das notas (busca.py): adicionar() reindexa o registro.
+Excluir o registro pelo ORM apaga as notas no mesmo flush.
+
+Não faz commit: o chamador controla a transação.
+"""
+
+from sqlalchemy import delete, event, func, insert, literal, select, tuple_
+from sqlalchemy.orm import Session
+
+import busca
+from models import db, Acompanhamento, Incidente, Risco, User
+
+ENTIDADES = {"incidente": Incidente, "risco": Risco}
+ENTIDADE_DO_MODELO = {modelo: entidade for entidade, modelo in ENTIDADES.items()}
+
+POR_PAGINA = 20
+POR_PAGINA_MAX = 100
+TAMANHO_MAX = 10000
+RESUMO = 80
+
+
+class NotaInvalida(ValueError):
+    pass
+
+
+def _dicionario(id, criado_em, texto, username):
+    return {
+        "id": id,
+        "criado_em": criado_em.isoformat(timespec="seconds"),
+        "autor": username,
+        "texto": texto,
+    }
+
+
+def adicionar(entidade, registro, texto, user_id):
+    """Nova nota em `registro` (Incidente/Risco já carregado). Devolve o Acompanhamento"""
+    texto = (texto or "").strip()
+    if not texto:
+        raise NotaInvalida("Escreva o acompanhamento")
+    if len(texto) > TAMANHO_MAX:
+        raise NotaInvalida(f"Acompanhamento com mais de {TAMANHO_MAX} caracteres")
+    if registro.id is None:
+        db.session.flush()
+    nota = Acompanhamento(
+        projeto_id=registro.projeto_id, entidade=entidade, registro_id=registro.id, user_id=user_id, texto=texto
+    )
+    db.session.add(nota)
+    db.session.flush()
+    busca.reindexar(entidade, [registro.id])
+    return nota
+
+
+def listar(projeto_id, entidade, registro_id, antes=None, limite=POR_PAGINA):
+    """Notas do registro, da mais nova para a mais antiga. Devolve (notas, id para ?antes= ou None)"""
+    A = Acompanhamento
+    consulta = (
+        select(A.id, A.criado_em, A.texto, User.username)
+        .outerjoin(User, User.id == A.user_id)
+        .where(A.projeto_id == projeto_id, A.entidade == entidade, A.registro_id == registro_id)
+        .order_by(A.id.desc())
+        .limit(limite + 1)
+    )
+    if antes is not None:
+        consulta = consulta.where(A.id < antes)
+    linhas = db.session.execute(consulta).all()
+    notas = [_dicionario(*linha) for linha in linhas[:limite]]
+    return notas, (notas[-1]["id"] if len(linhas) > limite else None)
+
+
+def ultimas(projeto_id, entidade):
+    """{registro_id: nota mais recente, com o texto resumido} dos registros do projeto"""
+    A = Acompanhamento
+    ultima = (
+        select(func.max(A.id))
+        .where(A.projeto_id == projeto_id, A.entidade == entidade)
+        .group_by(A.registro_id)
+    )
+    linhas = db.session.execute(
+        select(A.registro_id, A.id, A.criado_em, func.substr(A.texto, 1, RESUMO + 1), User.username)
+        .outerjoin(User, User.id == A.user_id)
+        .where(A.id.in_(ultima))
+    )
+    resultado = {}
+    for registro_id, *nota in linhas:
+        resultado[registro_id] = _dicionario(*nota)
+        texto = resultado[registro_id]["texto"]
+        if len(texto) > RESUMO:
+            resultado[registro_id]["texto"] = texto[:RESUMO] + "..."
+    return resultado
+
+
+@event.listens_for(Session, "after_flush")
+def _acompanhamentos_apos_flush(session, flush_context):
+    excluidos = [
+        (ENTIDADE_DO_MODELO[type(obj)], obj.id) for obj in session.deleted if type(obj) in ENTIDADE_DO_MODELO
+    ]
+    if excluidos:
+        session.connection().execute(
+            delete(Acompanhamento.__table__).where(
+                tuple_(Acompanhamento.entidade, Acompanhamento.registro_id).in_(excluidos)
+            )
+        )
+
+
+def migrar_existentes():
+    """Primeira nota com o texto de acompanhamento antigo dos registros sem notas. Devolve quantas criou"""
+    A = Acompanhamento.__table__
+    criadas = 0
+    for entidade, modelo in ENTIDADES.items():
+        T = modelo.__table__
+        datas = [T.c[coluna] for coluna in ("data_ultima_modificacao", "data_criacao") if coluna in T.c]
+        sem_notas = ~select(A.c.id).where(
+            A.c.projeto_id == T.c.projeto_id, A.c.entidade == entidade, A.c.registro_id == T.c.id
+        ).exists()
+        criadas += db.session.execute(
+            insert(A).from_select(
+                ["projeto_id", "entidade", "registro_id", "criado_em", "texto"],
+                select(
+                    T.c.projeto_id, literal(entidade), T.c.id,
+                    func.coalesce(*datas, func.now()),
+                    T.c.acompanhamento,
+                ).where(func.trim(func.coalesce(T.c.acompanhamento, "")) != "", sem_notas),
+            )
+        ).rowcount
+    return criadas
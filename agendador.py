@@ -0,0 +1,350 @@
+"""
+Tarefas periódicas (lembretes, varreduras, resumos) fora das requisições.
+
+Cada tarefa registrada com @tarefa tem uma linha em tarefas_agendadas com a
+próxima execução e o resultado da última. executar_pendentes() roda as que
+venceram; várias instâncias do Cloud Run podem chamá-la ao mesmo tempo:
+
+- PostgreSQL: cada tarefa roda numa transação que segura
+  pg_try_advisory_xact_lock(chave da tarefa). Quem não consegue o lock pula
+  a tarefa; quem consegue relê o estado (outra instância pode ter acabado de
+  rodar) e grava a próxima execução no mesmo commit que solta o lock.
+- SQLite (desenvolvimento): sem lock entre processos; use uma instância só.
+
+O trabalho da tarefa fica num SAVEPOINT: se falhar, só ele é desfeito e o
+erro é gravado no estado (a tarefa tenta de novo no próximo intervalo).
+As tarefas processam no máximo LOTE registros por execução, com uma
+consulta e um UPDATE por lote; o restante fica para a execução seguinte.
+
+Como rodar:
+    python agendador.py             laço contínuo (processo separado)
+    python agendador.py --uma-vez   roda as vencidas e sai (Cloud Scheduler + Cloud Run Job)
+    python agendador.py --status    estado das tarefas
+    AGENDADOR_INTERNO=true          uma thread por worker do Gunicorn (gunicorn.conf.py);
+                                    no Cloud Run exige CPU sempre alocada
+
+Variáveis de ambiente:
+    AGENDADOR_INTERVALO   segundos entre verificações (padrão 60)
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, or_, select, update
+
+import auditoria
+import metrics
+import notificacoes
+from models import db, Incidente, Risco, TarefaAgendada, User
+
+logger = logging.getLogger("imsis.agendador")
+
+Tarefa = namedtuple("Tarefa", "nome intervalo funcao")
+TAREFAS = {}
+
+LOTE = 500
+INTERVALO_PADRAO = 60
+STATUS_INCIDENTE_CONCLUIDO = "Concluído"
+STATUS_RISCO_CONCLUIDO = "Concluido"
+ANTECEDENCIA_ACAO_RISCO = timedelta(days=3)
+PRAZO_RESUMOS = timedelta(minutes=5)
+
+_INSTANCIA = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def tarefa(nome, intervalo):
+    """Registra `funcao(agora)` como tarefa periódica; ela devolve quantos registros processou"""
+    def registrar(funcao):
+        TAREFAS[nome] = Tarefa(nome, intervalo, funcao)
+        return funcao
+    return registrar
+
+
+# ------------------------------------------------------------------------------
+# EXECUÇÃO
+# ------------------------------------------------------------------------------
+def _chave_lock(nome):
+    """Chave de 64 bits (com sinal) do advisory lock da tarefa"""
+    digest = hashlib.blake2b(f"imsis.agendador.{nome}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def _adquirir_lock(nome):
+    if db.engine.dialect.name != "postgresql":
+        return True
+    return db.session.scalar(select(func.pg_try_advisory_xact_lock(_chave_lock(nome))))
+
+
+def _vencida(estado, agora):
+    return estado is None or estado.proxima_execucao is None or estado.proxima_execucao <= agora
+
+
+def _executar(definicao, agora):
+    """Roda a tarefa se estiver vencida e o lock for nosso. Devolve o resultado ou None se pulou"""
+    if not _vencida(db.session.get(TarefaAgendada, definicao.nome), agora):
+        db.session.rollback()
+        return None
+    if not _adquirir_lock(definicao.nome):
+        db.session.rollback()
+        return None
+    # Com o lock: relê, outra instância pode ter acabado de rodar
+    estado = db.session.get(TarefaAgendada, definicao.nome, populate_existing=True)
+    if not _vencida(estado, agora):
+        db.session.rollback()
+        return None
+    if estado is None:
+        estado = TarefaAgendada(nome=definicao.nome, processados=0, execucoes=0)
+        db.session.add(estado)
+
+    inicio = time.perf_counter()
+    try:
+        with db.session.begin_nested():
+            processados = definicao.funcao(agora)
+        estado.ultimo_resultado, estado.ultimo_erro = "ok", None
+        estado.processados = processados
+    except Exception as e:
+        logger.exception("Erro na tarefa agendada", extra={"tarefa": definicao.nome})
+        estado.ultimo_resultado, estado.ultimo_erro = "erro", str(e)[:2000]
+        estado.processados = 0
+    estado.ultima_execucao = agora
+    estado.ultima_duracao_ms = int((time.perf_counter() - inicio) * 1000)
+    estado.proxima_execucao = agora + definicao.intervalo
+    estado.execucoes = (estado.execucoes or 0) + 1
+    estado.instancia = _INSTANCIA
+    db.session.commit()
+
+    metrics.JOB_RUNS.inc(definicao.nome, estado.ultimo_resultado)
+    logger.info(
+        "Tarefa agendada executada",
+        extra={
+            "tarefa": definicao.nome,
+            "resultado": estado.ultimo_resultado,
+            "processados": estado.processados,
+            "duracao_ms": estado.ultima_duracao_ms,
+        },
+    )
+    return estado.ultimo_resultado
+
+
+def executar_pendentes(agora=None):
+    """Roda as tarefas vencidas. Devolve {nome: "ok" | "erro"} das que rodaram aqui"""
+    agora = agora or datetime.utcnow()
+    executadas = {}
+    for definicao in TAREFAS.values():
+        resultado = _executar(definicao, agora)
+        if resultado:
+            executadas[definicao.nome] = resultado
+    return executadas
+
+
+def executar_continuamente(app, parar, intervalo=None):
+    """Laço do agendador até `parar` (threading.Event) ser sinalizado"""
+    intervalo = intervalo or int(os.environ.get("AGENDADOR_INTERVALO", INTERVALO_PADRAO))
+    # Espalha as instâncias que sobem juntas
+    espera = random.uniform(0, intervalo)
+    while not parar.wait(espera):
+        with app.app_context():
+            try:
+                executar_pendentes()
+            except Exception:
+                db.session.rollback()
+                logger.exception("Erro no laco do agendador")
+            finally:
+                db.session.remove()
+        espera = intervalo
+
+
+_thread = None
+_parar = threading.Event()
+
+
+def iniciar(app):
+    """Sobe a thread do agendador neste processo (uma vez)"""
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return _thread
+    _parar.clear()
+    _thread = threading.Thread(target=executar_continuamente, args=(app, _parar), name="agendador", daemon=True)
+    _thread.start()
+    logger.info("Agendador interno iniciado", extra={"tarefas": sorted(TAREFAS)})
+    return _thread
+
+
+def parar():
+    _parar.set()
+
+
+# ------------------------------------------------------------------------------
+# TAREFAS
+# ------------------------------------------------------------------------------
+@tarefa("incidentes_atrasados", timedelta(hours=1))
+def avisar_incidentes_atrasados(agora):
+    """Incidentes abertos com prazo vencido: uma notificação ao responsável por prazo"""
+    prazo = func.coalesce(Incidente.previsao_revisada, Incidente.previsao_original)
+    linhas = db.session.execute(
+        select(Incidente.id, Incidente.projeto_id, Incidente.responsavel_id, Incidente.descricao, prazo.label("prazo"))
+        .where(
+            prazo < agora,
+            Incidente.responsavel_id.isnot(None),
+            func.coalesce(Incidente.status, "") != STATUS_INCIDENTE_CONCLUIDO,
+            Incidente.conclusao.is_(None),
+            or_(Incidente.alerta_atraso_para.is_(None), Incidente.alerta_atraso_para != prazo),
+        )
+        .order_by(Incidente.id)
+        .limit(LOTE)
+    ).all()
+    if not linhas:
+        return 0
+
+    notificacoes.registrar(
+        [
+            {
+                "user_id": linha.responsavel_id,
+                "projeto_id": linha.projeto_id,
+                "tipo": "incidente_atrasado",
+                "registro_id": linha.id,
+                "texto": f"#{linha.id} {linha.descricao} (prazo {linha.prazo:%d/%m/%Y})",
+            }
+            for linha in linhas
+        ],
+        agora,
+    )
+    db.session.execute(
+        update(Incidente)
+        .where(Incidente.id.in_([linha.id for linha in linhas]))
+        # Marca o prazo avisado sem contar como modificação do incidente
+        .values(alerta_atraso_para=prazo, data_ultima_modificacao=Incidente.data_ultima_modificacao),
+        execution_options={"synchronize_session": False},
+    )
+    return len(linhas)
+
+
+@tarefa("acoes_de_risco", timedelta(hours=1))
+def avisar_acoes_de_risco(agora):
+    """Riscos abertos com próxima ação em até ANTECEDENCIA_ACAO_RISCO (ou vencida): uma notificação por data"""
+    linhas = db.session.execute(
+        select(Risco.id, Risco.projeto_id, Risco.responsavel_id, Risco.risco, Risco.data_proxima_acao, Risco.score)
+        .where(
+            Risco.data_proxima_acao <= agora + ANTECEDENCIA_ACAO_RISCO,
+            Risco.responsavel_id.isnot(None),
+            func.coalesce(Risco.status, "") != STATUS_RISCO_CONCLUIDO,
+            or_(Risco.alerta_acao_para.is_(None), Risco.alerta_acao_para != Risco.data_proxima_acao),
+        )
+        .order_by(Risco.id)
+        .limit(LOTE)
+    ).all()
+    if not linhas:
+        return 0
+
+    def descrever(linha):
+        situacao = "vencida em" if linha.data_proxima_acao < agora else "em"
+        score = f", score {linha.score}" if linha.score else ""
+        return f"#{linha.id} {linha.risco} (proxima acao {situacao} {linha.data_proxima_acao:%d/%m/%Y}{score})"
+
+    notificacoes.registrar(
+        [
+            {
+                "user_id": linha.responsavel_id,
+                "projeto_id": linha.projeto_id,
+                "tipo": "acao_de_risco",
+                "registro_id": linha.id,
+                "texto": descrever(linha),
+            }
+            for linha in linhas
+        ],
+        agora,
+    )
+    db.session.execute(
+        update(Risco)
+        .where(Risco.id.in_([linha.id for linha in linhas]))
+        .values(alerta_acao_para=Risco.data_proxima_acao),
+        execution_options={"synchronize_session": False},
+    )
+    return len(linhas)
+
+
+@tarefa("resumo_diario", timedelta(days=1))
+def enviar_resumo_diario(agora):
+    """
+    Um e-mail por usuário com as notificações pendentes (notificacoes.py),
+    lote após lote até acabarem ou até passar PRAZO_RESUMOS
+    """
+    if not current_app.config.get("SMTP_HOST"):
+        logger.warning("SMTP_HOST nao configurado: resumos adiados")
+        return 0
+    prazo = time.monotonic() + PRAZO_RESUMOS.total_seconds()
+    falhas, enviados = set(), 0
+    while time.monotonic() < prazo:
+        antes = len(falhas)
+        lote = notificacoes.enviar_resumos(agora, ignorar=falhas)
+        enviados += lote
+        if not lote and len(falhas) == antes:
+            break
+    return enviados
+
+
+@tarefa("particoes_auditoria", timedelta(days=1))
+def criar_particoes_auditoria(agora):
+    """Partições mensais da trilha de auditoria antes do mês começar (PostgreSQL)"""
+    return auditoria.garantir_particoes(agora)
+
+
+@tarefa("tokens_expirados", timedelta(days=1))
+def limpar_tokens_expirados(agora):
+    """Apaga hashes de confirmação de e-mail e de redefinição de senha vencidos"""
+    confirmacao = db.session.execute(
+        update(User)
+        .where(User.email_verification_expires_at < agora)
+        .values(email_verification_token_hash=None, email_verification_expires_at=None),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    redefinicao = db.session.execute(
+        update(User)
+        .where(User.password_reset_expires_at < agora)
+        .values(password_reset_token_hash=None, password_reset_expires_at=None),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    return confirmacao + redefinicao
+
+
+if __name__ == "__main__":
+    from app import create_app
+    from app_logging import configure_logging
+
+    parser = argparse.ArgumentParser(description="Agendador de tarefas do IMSIS")
+    parser.add_argument("--uma-vez", action="store_true", help="roda as tarefas vencidas e sai")
+    parser.add_argument("--status", action="store_true", help="mostra o estado das tarefas e sai")
+    args = parser.parse_args()
+
+    configure_logging()
+    app = create_app({"BOOTSTRAP_DB": False})
+    if args.status:
+        with app.app_context():
+            estados = {e.nome: e for e in TarefaAgendada.query.all()}
+            for nome in TAREFAS:
+                estado = estados.get(nome)
+                if estado is None:
+                    print(f"{nome}: nunca executada")
+                else:
+                    print(
+                        f"{nome}: {estado.ultimo_resultado} em {estado.ultima_execucao:%Y-%m-%d %H:%M} "
+                        f"({estado.processados} processados, {estado.ultima_duracao_ms} ms), "
+                        f"proxima {estado.proxima_execucao:%Y-%m-%d %H:%M}"
+                    )
+    elif args.uma_vez:
+        with app.app_context():
+            executar_pendentes()
+    else:
+        try:
+            executar_continuamente(app, threading.Event())
+        except KeyboardInterrupt:
+            pass
@@ -1,382 +1,116 @@
+import logging
 import os
 import secrets
 import smtplib
 import ssl
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from email.message import EmailMessage
-from urllib.parse import quote_plus
 
 from flask import Flask, render_template, request, redirect, url_for, flash, abort
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import (
     LoginManager,
-    UserMixin,
     login_user,
     login_required,
     logout_user,
     current_user,
 )
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import text, inspect
-
-# Carregar secrets do Google Secret Manager (se em produção no GCP)
-try:
-    from load_secrets import load_secrets
-    load_secrets()
-except ImportError:
-    pass  # load_secrets.py não disponível (dev local)
-except Exception as e:
-    print(f"[WARN] Erro ao carregar secrets: {e}")
-
-# Se ainda não houver DB_PASS, tentar ler arquivo de secret do Cloud Run
-if not os.environ.get("DB_PASS"):
-    try:
-        secret_path = "/var/run/secrets/cloud.google.com/secret/db-pass/latest"
-        if os.path.exists(secret_path):
-            with open(secret_path, "r") as f:
-                db_pass_value = f.read().strip()
-                if db_pass_value:
-                    os.environ["DB_PASS"] = db_pass_value
-                    print("[OK] DB_PASS carregado de arquivo de secret")
-    except Exception as e:
-        print(f"[WARN] Erro ao carregar DB_PASS de arquivo: {e}")
+from sqlalchemy import Integer, func, text, inspect
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.orm import defer, joinedload
+from sqlalchemy.orm.exc import StaleDataError
+
+import acompanhamentos
+import auditoria
+import busca
+import clonagem
+import contadores
+import cronograma
+import deletion
+import dependencias
+import edicao
+import sequencia
+import similares
+import sla
+import metrics
+import permissoes
+from app_logging import configure_logging, init_request_logging
+from config import config_from_env, env_truthy, load_environment
+from models import (
+    db,
+    User,
+    Projeto,
+    ProjetoMembro,
+    Fase,
+    Atividade,
+    TesteTabela1,
+    Cenario,
+    LicaoAprendida,
+    SolicitacaoMudanca,
+    Incidente,
+    Risco,
+    Perfil,
+    MembroPerfil,
+    DependenciaAtividade,
+    PERMISSOES,
+    RESPONSAVEIS,
+)
 
-# Se ainda não houver SECRET_KEY, tentar ler arquivo de secret do Cloud Run
-if not os.environ.get("SECRET_KEY"):
-    try:
-        secret_path = "/var/run/secrets/cloud.google.com/secret/secret-key/latest"
-        if os.path.exists(secret_path):
-            with open(secret_path, "r") as f:
-                secret_key_value = f.read().strip()
-                if secret_key_value:
-                    os.environ["SECRET_KEY"] = secret_key_value
-                    print("[OK] SECRET_KEY carregado de arquivo de secret")
-    except Exception as e:
-        print(f"[WARN] Erro ao carregar SECRET_KEY de arquivo: {e}")
+logger = logging.getLogger("imsis")
 
-# Criar app Flask ANTES de usar variáveis de ambiente
+# O import deste módulo só cria o objeto Flask e registra as rotas.
+# Secrets, configuração, extensões e DDL rodam em create_app().
 app = Flask(__name__)
-app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "chave-secreta-dev")
-
-
-def get_secret_or_env(key, default=""):
-    """Obtém secret de variável de ambiente ou padrão"""
-    value = os.environ.get(key, "").strip()
-    if value:
-        print(f"[DEBUG get_secret_or_env] {key}={value[:20]}..." if len(value) > 20 else f"[DEBUG get_secret_or_env] {key}={value}")
-        return value
-    print(f"[WARN get_secret_or_env] {key} nao encontrado, usando default")
-    return default
-
-
-def env_truthy(value):
-    return str(value).strip().lower() in {"1", "true", "yes", "on"}
-
-
-app.config["APP_BASE_URL"] = get_secret_or_env("APP_BASE_URL", "").rstrip("/")
-app.config["SMTP_HOST"] = get_secret_or_env("SMTP_HOST")
-app.config["SMTP_PORT"] = get_secret_or_env("SMTP_PORT", "")
-app.config["SMTP_USER"] = get_secret_or_env("SMTP_USER")
-app.config["SMTP_PASS"] = get_secret_or_env("SMTP_PASS")
-app.config["SMTP_FROM"] = get_secret_or_env("SMTP_FROM")
-
-# Auto-detect SSL/TLS based on port
-smtp_port = app.config["SMTP_PORT"]
-if smtp_port == "465":
-    # Port 465 requires SMTP_SSL (implicit SSL)
-    app.config["SMTP_USE_SSL"] = True
-    app.config["SMTP_USE_TLS"] = False
-    print("[INFO] Porta 465 detectada - usando SSL=True, TLS=False")
-elif smtp_port == "587":
-    # Port 587 requires STARTTLS
-    app.config["SMTP_USE_SSL"] = False
-    app.config["SMTP_USE_TLS"] = True
-    print("[INFO] Porta 587 detectada - usando SSL=False, TLS=True")
-else:
-    # Use manual configuration or defaults
-    app.config["SMTP_USE_TLS"] = env_truthy(get_secret_or_env("SMTP_USE_TLS", "false"))
-    app.config["SMTP_USE_SSL"] = env_truthy(get_secret_or_env("SMTP_USE_SSL", "false"))
-
-app.config["EMAIL_CONFIRM_MINUTES"] = int(get_secret_or_env("EMAIL_CONFIRM_MINUTES", "60"))
-
-# Debug: Show SMTP configuration loaded
-if app.config.get("SMTP_HOST"):
-    print(f"[OK] SMTP_HOST={app.config.get('SMTP_HOST')}")
-    print(f"[OK] SMTP_PORT={app.config.get('SMTP_PORT')}")
-    print(f"[OK] SMTP_USER={app.config.get('SMTP_USER')}")
-    print(f"[OK] SMTP_USE_SSL={app.config.get('SMTP_USE_SSL')}")
-else:
-    print("[WARN] SMTP_HOST nao configurado em app.config")
-
-# Tentar carregar variáveis de ambiente com valores padrão
-db_user = get_secret_or_env("DB_USER", "")
-db_pass = get_secret_or_env("DB_PASS", "")
-db_name = get_secret_or_env("DB_NAME", "")
-cloud_sql_connection_name = get_secret_or_env("CLOUD_SQL_CONNECTION_NAME", "")
-
-# DEBUG: Log das variáveis (remover em produção)
-if db_user:
-    print(f"[OK] DB_USER={db_user}")
-if db_name:
-    print(f"[OK] DB_NAME={db_name}")
-if cloud_sql_connection_name:
-    print(f"[OK] CLOUD_SQL_CONNECTION_NAME={cloud_sql_connection_name}")
-if db_pass:
-    print(f"[OK] DB_PASS carregado ({len(db_pass)} caracteres)")
-else:
-    print("[WARN] DB_PASS está vazio!")
-
-# DATABASE CONFIG
-if os.environ.get("DATABASE_URL"):
-    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
-    print("[OK] Usando DATABASE_URL")
-elif db_user and db_pass and db_name and cloud_sql_connection_name:
-    db_pass_encoded = quote_plus(db_pass)  # URL-encode the password
-    app.config["SQLALCHEMY_DATABASE_URI"] = f"postgresql+psycopg2://{db_user}:{db_pass_encoded}@/{db_name}?host=/cloudsql/{cloud_sql_connection_name}"
-    print("[OK] Conectando ao Cloud SQL")
-else:
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///dev.db"
-    print("[OK] Usando SQLite local")
-
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
-# ------------------------------------------------------------------------------
-# EXTENSIONS
-# ------------------------------------------------------------------------------
-db = SQLAlchemy(app)
 
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = "login"
 
+
 # ------------------------------------------------------------------------------
-# MODELS
+# APP FACTORY
 # ------------------------------------------------------------------------------
-class User(UserMixin, db.Model):
-    __tablename__ = "users"
-
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(100), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(200), nullable=False)
-    email_verified = db.Column(db.Boolean, default=False, nullable=False)
-    email_verification_token_hash = db.Column(db.String(255))
-    email_verification_expires_at = db.Column(db.DateTime)
-    password_reset_token_hash = db.Column(db.String(255))
-    password_reset_expires_at = db.Column(db.DateTime)
-
-
-class Projeto(db.Model):
-    __tablename__ = "projetos"
-
-    id = db.Column(db.Integer, primary_key=True)
-    nome = db.Column(db.String(200), nullable=False)
-    membros = db.relationship(
-        "ProjetoMembro",
-        backref="projeto",
-        lazy=True,
-        cascade="all, delete-orphan",
-    )
+def create_app(config=None):
+    """
+    Configura e devolve a aplicação. Fases, na ordem:
+
+    1. logging estruturado
+    2. secrets (Secret Manager / arquivos do Cloud Run), se LOAD_SECRETS
+    3. configuração: variáveis de ambiente + `config` (dict) por cima
+    4. extensões (db, login, métricas, request_id), uma única vez por processo
+    5. DDL/migração de colunas, se BOOTSTRAP_DB
 
+    Ex.: create_app({"SQLALCHEMY_DATABASE_URI": "sqlite://", "LOAD_SECRETS": False})
+    """
+    overrides = dict(config or {})
+    configure_logging()
+
+    if overrides.get("LOAD_SECRETS", env_truthy(os.environ.get("LOAD_SECRETS", "true"))):
+        load_environment()
 
-class ProjetoMembro(db.Model):
-    __tablename__ = "projeto_membros"
+    if "sqlalchemy" not in app.extensions:
+        app.config.from_mapping(config_from_env())
+        app.config.from_mapping(overrides)
+        init_extensions(app)
+    else:
+        app.config.from_mapping(overrides)
 
-    id = db.Column(db.Integer, primary_key=True)
-    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id"), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
-    user = db.relationship("User", backref=db.backref("projeto_membros", lazy=True))
+    if app.config.get("BOOTSTRAP_DB"):
+        bootstrap_database(app)
+    return app
 
-    __table_args__ = (
-        db.UniqueConstraint("projeto_id", "user_id", name="uq_projeto_membro"),
-    )
 
+def init_extensions(app):
+    db.init_app(app)
+    login_manager.init_app(app)
+    init_request_logging(app)
+    metrics.init_app(app, db)
 
-class Fase(db.Model):
-    __tablename__ = "fases"
-
-    id = db.Column(db.Integer, primary_key=True)
-    nome = db.Column(db.String(200), nullable=False)
-    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id"), nullable=False)
-    projeto = db.relationship("Projeto", backref=db.backref("fases", lazy=True))
-
-
-class Atividade(db.Model):
-    __tablename__ = "atividades"
-
-    id = db.Column(db.Integer, primary_key=True)
-    numero_sequencial = db.Column(db.Integer, nullable=False)
-    descricao = db.Column(db.String(200), nullable=False)
-    responsavel = db.Column(db.String(100), nullable=False)
-    data_liberacao = db.Column(db.DateTime)
-    data_conclusao = db.Column(db.DateTime)
-    # Relacionamento com Cenario (opcional)
-    cenario_id = db.Column(db.Integer, db.ForeignKey("cenarios.id"), nullable=True)
-    cenario = db.relationship("Cenario", backref=db.backref("atividades", lazy=True))
-
-
-class TesteTabela1(db.Model):
-    __tablename__ = "teste_tabela_1"
-
-    id = db.Column(db.Integer, primary_key=True)
-    nome = db.Column(db.Text, nullable=False)
-
-
-class Cenario(db.Model):
-    __tablename__ = "cenarios"
-
-    id = db.Column(db.Integer, primary_key=True)
-    cenario = db.Column(db.String(200), nullable=False)
-    fase_id = db.Column(db.Integer, db.ForeignKey("fases.id"), nullable=True)
-    fase = db.relationship("Fase", backref=db.backref("cenarios", lazy=True))
-
-
-class LicaoAprendida(db.Model):
-    __tablename__ = "licoes_aprendidas"
-
-    id = db.Column(db.Integer, primary_key=True)
-    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id"), nullable=False)
-    fase_id = db.Column(db.Integer, db.ForeignKey("fases.id"), nullable=True)
-    categoria = db.Column(db.String(100))  # Ex: Técnica, Gestão, Comunicação
-    tipo = db.Column(db.String(50))  # Ex: Sucesso, Problema, Oportunidade
-    descricao = db.Column(db.Text, nullable=False)
-    causa_raiz = db.Column(db.Text)
-    impacto = db.Column(db.Text)
-    acao_tomada = db.Column(db.Text)
-    recomendacao = db.Column(db.Text)
-    responsavel = db.Column(db.String(100))
-    status = db.Column(db.String(50))  # Ex: Registrada, Em Análise, Aplicada
-    aplicavel_futuros = db.Column(db.Boolean, default=True)
-    data_registro = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    projeto = db.relationship("Projeto", backref=db.backref("licoes_aprendidas", lazy=True))
-    fase = db.relationship("Fase", backref=db.backref("licoes_aprendidas", lazy=True))
-
-
-class SolicitacaoMudanca(db.Model):
-    __tablename__ = "solicitacoes_mudanca"
-
-    id = db.Column(db.Integer, primary_key=True)
-    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id"), nullable=False)
-    data_solicitacao = db.Column(db.DateTime, default=datetime.utcnow)
-    solicitante = db.Column(db.String(100))
-    area_solicitante = db.Column(db.String(100))
-    descricao = db.Column(db.Text, nullable=False)
-    justificativa = db.Column(db.Text)
-    tipo_mudanca = db.Column(db.String(50))  # Escopo, Legal, Técnica, Melhoria, Correção, Integração
-    impacto_prazo = db.Column(db.String(100))
-    impacto_custo = db.Column(db.String(100))
-    impacto_escopo = db.Column(db.String(50))  # Baixo, Médio, Alto
-    impacto_recursos = db.Column(db.String(200))
-    impacto_risco = db.Column(db.String(50))  # Baixo, Médio, Alto
-    prioridade = db.Column(db.String(50))  # Baixa, Média, Alta, Crítica
-    recomendacao_pm = db.Column(db.String(50))  # Aprovar, Rejeitar, Postergar
-    status = db.Column(db.String(50))  # Em análise, Aprovada, Rejeitada, Em implementação, Concluída
-    aprovador = db.Column(db.String(100))
-    data_decisao = db.Column(db.DateTime)
-    data_implementacao = db.Column(db.DateTime)
-    observacoes = db.Column(db.Text)
-    
-    projeto = db.relationship("Projeto", backref=db.backref("solicitacoes_mudanca", lazy=True))
-
-
-class Incidente(db.Model):
-    __tablename__ = "incidentes"
-
-    id = db.Column(db.Integer, primary_key=True)
-    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id"), nullable=False)
-    atividade_id = db.Column(db.Integer, db.ForeignKey("atividades.id"), nullable=True)
-    descricao = db.Column(db.Text, nullable=False)
-    acompanhamento = db.Column(db.Text)
-    responsavel = db.Column(db.String(100))
-    prioridade = db.Column(db.String(50))  # 1 - Muito Alto, 2 - Alto, 3 - Médio, 4 - Baixo, 5 - Muito Baixo
-    status = db.Column(db.String(50))  # Criado, Em andamento, Aguardando Solicitante, Aguardando Externo, Encaminhado Responsavel, Proposta de solução, Concluído
-    previsao_original = db.Column(db.DateTime)
-    previsao_revisada = db.Column(db.DateTime)
-    data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
-    data_ultima_modificacao = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    conclusao = db.Column(db.DateTime)
-    
-    projeto = db.relationship("Projeto", backref=db.backref("incidentes", lazy=True))
-    atividade = db.relationship("Atividade", backref=db.backref("incidentes", lazy=True))
-
-
-class Risco(db.Model):
-    __tablename__ = "riscos"
-
-    id = db.Column(db.Integer, primary_key=True)
-    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id"), nullable=False)
-    area = db.Column(db.String(100))
-    tipo_risco = db.Column(db.String(50))  # Ameaca, Oportunidade
-    risco = db.Column(db.Text, nullable=False)
-    criado_por = db.Column(db.String(100))
-    responsavel = db.Column(db.String(100))
-    gatilho = db.Column(db.Text)
-    impacto_projeto = db.Column(db.Text)
-    consequencia = db.Column(db.Text)
-    impacto = db.Column(db.String(10))  # 1-5
-    probabilidade = db.Column(db.String(10))  # 1-5
-    nivel_risco = db.Column(db.String(50))  # 1 - Muito Alto, 2 - Alto, 3 - Medio, 4 - Baixo, 5 - Muito Baixo
-    estrategia = db.Column(db.String(50))
-    prevencao = db.Column(db.Text)
-    contingencia = db.Column(db.Text)
-    acompanhamento = db.Column(db.Text)
-    status = db.Column(db.String(50))  # Concluido, Planejado, Iniciado, Parado
-    data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
-    data_proxima_acao = db.Column(db.DateTime)
-    data_conclusao = db.Column(db.DateTime)
-
-    projeto = db.relationship("Projeto", backref=db.backref("riscos", lazy=True))
-
-
-class Perfil(db.Model):
-    __tablename__ = "perfis"
-
-    id = db.Column(db.Integer, primary_key=True)
-    nome = db.Column(db.String(100), nullable=False)
-    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id"), nullable=False)
-    projeto = db.relationship("Projeto", backref=db.backref("perfis", lazy=True))
-    
-    # Permissões
-    pode_criar_atividade = db.Column(db.Boolean, default=True)
-    pode_editar_atividade = db.Column(db.Boolean, default=True)
-    pode_excluir_atividade = db.Column(db.Boolean, default=False)
-    pode_concluir_qualquer_atividade = db.Column(db.Boolean, default=False)
-    pode_editar_projeto = db.Column(db.Boolean, default=False)
-    pode_gerenciar_membros = db.Column(db.Boolean, default=False)
-    
-    # Permissões de Lições Aprendidas
-    pode_criar_licao = db.Column(db.Boolean, default=False)
-    pode_editar_licao = db.Column(db.Boolean, default=False)
-    pode_excluir_licao = db.Column(db.Boolean, default=False)
-    
-    # Permissões de Solicitações de Mudança
-    pode_criar_mudanca = db.Column(db.Boolean, default=False)
-    pode_editar_mudanca = db.Column(db.Boolean, default=False)
-    pode_excluir_mudanca = db.Column(db.Boolean, default=False)
-    
-    # Permissões de Incidentes
-    pode_criar_incidente = db.Column(db.Boolean, default=False)
-    pode_editar_incidente = db.Column(db.Boolean, default=False)
-    pode_excluir_incidente = db.Column(db.Boolean, default=False)
-
-    # Permissões de Riscos
-    pode_criar_risco = db.Column(db.Boolean, default=False)
-    pode_editar_risco = db.Column(db.Boolean, default=False)
-    pode_excluir_risco = db.Column(db.Boolean, default=False)
-    
-    is_default = db.Column(db.Boolean, default=False)  # Para perfis padrão
-
-
-class MembroPerfil(db.Model):
-    __tablename__ = "membro_perfis"
-
-    id = db.Column(db.Integer, primary_key=True)
-    projeto_membro_id = db.Column(db.Integer, db.ForeignKey("projeto_membros.id"), nullable=False)
-    perfil_id = db.Column(db.Integer, db.ForeignKey("perfis.id"), nullable=False)
-    
-    projeto_membro = db.relationship("ProjetoMembro", backref=db.backref("perfil_associacao", lazy=True))
-    perfil = db.relationship("Perfil", backref=db.backref("membros", lazy=True))
+
+def bootstrap_database(app):
+    """Cria tabelas e colunas faltantes (idempotente)"""
+    with app.app_context():
+        criar_tabelas()
 
 
 # ------------------------------------------------------------------------------
@@ -396,33 +130,13 @@ def is_project_member(projeto_id, user_id=None):
 
 
 def get_user_permissions(projeto_id, user_id=None):
-    """Retorna as permissões do usuário no projeto"""
-    uid = user_id or current_user.id
-    membro = ProjetoMembro.query.filter_by(projeto_id=projeto_id, user_id=uid).first()
-    
-    if not membro:
-        return None
-    
-    # Buscar perfil do membro
-    perfil_associacao = MembroPerfil.query.filter_by(projeto_membro_id=membro.id).first()
-    
-    if perfil_associacao and perfil_associacao.perfil:
-        return perfil_associacao.perfil
-    
-    return None
+    """Retorna o perfil (permissoes.Definicao) do usuário no projeto"""
+    return permissoes.perfil_do_membro(projeto_id, user_id or current_user.id)
 
 
 def has_permission(projeto_id, permission_name, user_id=None):
     """Verifica se o usuário tem uma permissão específica no projeto"""
-    perfil = get_user_permissions(projeto_id, user_id)
-    
-    if not perfil:
-        return False
-
-    if perfil.nome == "Administrador":
-        return True
-    
-    return getattr(perfil, permission_name, False)
+    return permissoes.tem_permissao(projeto_id, permission_name, user_id or current_user.id)
 
 
 def get_fase_for_cenario_or_none(cenario):
@@ -434,6 +148,64 @@ def get_fase_for_cenario_or_none(cenario):
     return fase
 
 
+def get_atividade_do_projeto_or_404(atividade_id, projeto_id):
+    """Atividade do projeto numa única query indexada por (id, projeto_id)"""
+    return Atividade.query.filter_by(id=atividade_id, projeto_id=projeto_id).first_or_404()
+
+
+def get_atividade_autorizada_or_404(atividade_id):
+    """
+    Carrega a atividade com o seu cenário numa única query e exige que o
+    usuário seja membro do projeto (via projeto_id denormalizado).
+    """
+    atv = (
+        Atividade.query
+        .options(joinedload(Atividade.cenario))
+        .filter_by(id=atividade_id)
+        .first_or_404()
+    )
+    if not atv.projeto_id or not is_project_member(atv.projeto_id):
+        abort(403)
+    return atv
+
+
+def redirect_atividades_cenario(atv):
+    cenario = atv.cenario
+    if cenario and cenario.fase_id:
+        return redirect(
+            url_for(
+                "atividades_por_cenario",
+                projeto_id=atv.projeto_id,
+                fase_id=cenario.fase_id,
+                cenario_id=cenario.id,
+            )
+        )
+    return redirect(url_for("projetos"))
+
+
+MENSAGEM_CONFLITO = "O registro foi alterado por outro usuário. Recarregue a página e edite de novo."
+
+
+def versao_do_form_confere(registro):
+    """
+    Formulários de edição mandam a versão que o usuário abriu (campo `versao`).
+    Se o registro mudou desde então, avisa e não grava. Sem o campo, não confere.
+    """
+    versao = request.form.get("versao", "")
+    if versao.isdigit() and int(versao) != registro.versao:
+        flash(MENSAGEM_CONFLITO, "warning")
+        return False
+    return True
+
+
+@app.errorhandler(StaleDataError)
+def registro_alterado_durante_a_gravacao(e):
+    """Outra gravação venceu entre a leitura e o UPDATE (WHERE versao = ... não achou a linha)"""
+    db.session.rollback()
+    flash(MENSAGEM_CONFLITO, "warning")
+    return redirect(request.path)
+
+
 # ------------------------------------------------------------------------------
 # DB INIT
 # ------------------------------------------------------------------------------
@@ -445,13 +217,39 @@ def criar_tabelas():
     """
     try:
         db.create_all()
-        print("[OK] Banco de dados inicializado com sucesso")
+        logger.info("Banco de dados inicializado com sucesso")
         
         # Verificar e adicionar colunas faltando na tabela perfis (para backward compatibility)
         adicionar_colunas_faltando()
+
+        # Bancos antigos foram criados sem ON DELETE nas FKs do fluxo
+        ajustar_foreign_keys()
+
+        migrar_projeto_id_denormalizado()
+        migrar_responsaveis_usuario()
+        # Tabela atividade_dependencias vem do create_all; falta só o contador
+        adicionar_colunas("atividades", {"predecessoras_pendentes": "INTEGER NOT NULL DEFAULT 0"})
+        adicionar_colunas("projetos", {"versao_fluxo": "INTEGER NOT NULL DEFAULT 0"})
+        # Marcas dos avisos do agendador (tabela tarefas_agendadas vem do create_all)
+        adicionar_colunas("incidentes", {"alerta_atraso_para": "TIMESTAMP"})
+        adicionar_colunas("riscos", {"alerta_acao_para": "TIMESTAMP"})
+        migrar_contadores_progresso()
+        migrar_sequencia_unica()
+        migrar_perfis_globais()
+        migrar_busca()
+        migrar_assinaturas_similaridade()
+        migrar_score_riscos()
+        migrar_auditoria()
+        # Tabelas incidente_transicoes e sla_incidentes vêm do create_all
+        adicionar_colunas("incidentes", {"status_desde": "TIMESTAMP"})
+        migrar_sla_incidentes()
+        migrar_acompanhamentos()
+        # Concorrência otimista da edição (edicao.py)
+        for tabela in ("incidentes", "riscos", "solicitacoes_mudanca", "licoes_aprendidas"):
+            adicionar_colunas(tabela, {"versao": "INTEGER NOT NULL DEFAULT 1"})
         
     except Exception as e:
-        print(f"[WARN] Aviso ao inicializar DB: {e}")
+        logger.warning("Aviso ao inicializar DB: %s", e)
         # Não quebra a aplicação se falhar
 
 
@@ -486,12 +284,12 @@ def adicionar_colunas_faltando():
                 try:
                     db.session.execute(text(sql))
                     db.session.commit()
-                    print(f"[OK] Coluna {coluna} adicionada com sucesso")
+                    logger.info("Coluna %s adicionada com sucesso", coluna)
                 except Exception as e:
                     db.session.rollback()
                     # Coluna pode já existir ou houve outro erro, continua
                     if "duplicate column" not in str(e).lower():
-                        print(f"[WARN] Erro ao adicionar {coluna}: {e}")
+                        logger.warning("Erro ao adicionar %s: %s", coluna, e)
 
         # Colunas de users para confirmacao de e-mail
         colunas_users_existentes = [c["name"] for c in inspector.get_columns("users")]
@@ -522,43 +320,391 @@ def adicionar_colunas_faltando():
                     
                     if coluna == "email_verified":
                         adicionou_email_verified = True
-                    print(f"[OK] Coluna users.{coluna} adicionada com sucesso")
+                    logger.info("Coluna users.%s adicionada com sucesso", coluna)
                 except Exception as e:
                     db.session.rollback()
                     if "duplicate column" not in str(e).lower() and "already exists" not in str(e).lower():
-                        print(f"[WARN] Erro ao adicionar users.{coluna}: {e}")
+                        logger.warning("Erro ao adicionar users.%s: %s", coluna, e)
                     else:
-                        print(f"[OK] Coluna users.{coluna} ja existe")
+                        logger.info("Coluna users.%s ja existe", coluna)
 
         if adicionou_email_verified:
             try:
                 db.session.execute(text("UPDATE users SET email_verified = true"))
                 db.session.commit()
-                print("[OK] Usuarios existentes marcados como verificados")
+                logger.info("Usuarios existentes marcados como verificados")
             except Exception as e:
                 db.session.rollback()
-                print(f"[WARN] Erro ao atualizar email_verified: {e}")
+                logger.warning("Erro ao atualizar email_verified: %s", e)
     except Exception as e:
-        print(f"[WARN] Erro ao verificar colunas: {e}")
+        logger.warning("Erro ao verificar colunas: %s", e)
         # Não quebra a aplicação
 
 
+def adicionar_colunas(tabela, colunas):
+    """
+    Adiciona em `tabela` as colunas de `colunas` ({nome: tipo SQL}) que ainda
+    não existem. Retorna o conjunto de colunas criadas.
+    """
+    existentes = {c["name"] for c in inspect(db.engine).get_columns(tabela)}
+    criadas = set()
+    for coluna, tipo in colunas.items():
+        if coluna in existentes:
+            continue
+        try:
+            db.session.execute(text(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}"))
+            db.session.commit()
+            criadas.add(coluna)
+            logger.info("Coluna %s.%s adicionada com sucesso", tabela, coluna)
+        except Exception as e:
+            db.session.rollback()
+            if "duplicate column" not in str(e).lower() and "already exists" not in str(e).lower():
+                logger.warning("Erro ao adicionar %s.%s: %s", tabela, coluna, e)
+    return criadas
+
+
+def executar_ddl(comandos):
+    """Executa comandos idempotentes (CREATE INDEX IF NOT EXISTS, UPDATEs de backfill)"""
+    for sql in comandos:
+        try:
+            db.session.execute(text(sql))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.warning("Erro ao executar '%s': %s", sql[:80], e)
+
+
+def migrar_projeto_id_denormalizado():
+    """
+    cenarios.projeto_id e atividades.projeto_id: cria as colunas e índices em
+    bancos antigos e preenche linhas sem valor a partir de fase/cenário.
+    Novas linhas são mantidas pelos eventos em models.py.
+    """
+    try:
+        adicionar_colunas("cenarios", {"projeto_id": "INTEGER REFERENCES projetos(id) ON DELETE CASCADE"})
+        adicionar_colunas("atividades", {"projeto_id": "INTEGER REFERENCES projetos(id) ON DELETE CASCADE"})
+        executar_ddl([
+            "CREATE INDEX IF NOT EXISTS ix_cenarios_projeto_id ON cenarios (projeto_id)",
+            "CREATE INDEX IF NOT EXISTS ix_atividades_projeto_id ON atividades (projeto_id)",
+            "UPDATE cenarios SET projeto_id = "
+            "(SELECT fases.projeto_id FROM fases WHERE fases.id = cenarios.fase_id) "
+            "WHERE projeto_id IS NULL AND fase_id IS NOT NULL",
+            "UPDATE atividades SET projeto_id = "
+            "(SELECT cenarios.projeto_id FROM cenarios WHERE cenarios.id = atividades.cenario_id) "
+            "WHERE projeto_id IS NULL AND cenario_id IS NOT NULL",
+        ])
+    except Exception as e:
+        logger.warning("Erro ao migrar projeto_id denormalizado: %s", e)
+
+
+
+def migrar_responsaveis_usuario():
+    """
+    Cria as colunas *_id (FK para users) ao lado dos responsáveis em texto e
+    preenche as linhas antigas casando o texto com users.username. Nomes que
+    não correspondem a nenhum usuário ficam só no texto.
+    """
+    try:
+        ddl = []
+        for modelo, colunas in RESPONSAVEIS.items():
+            tabela = modelo.__tablename__
+            adicionar_colunas(tabela, {
+                coluna_id: "INTEGER REFERENCES users(id) ON DELETE SET NULL" for _, coluna_id in colunas
+            })
+            for coluna_texto, coluna_id in colunas:
+                ddl.append(f"CREATE INDEX IF NOT EXISTS ix_{tabela}_{coluna_id} ON {tabela} ({coluna_id})")
+                ddl.append(
+                    f"UPDATE {tabela} SET {coluna_id} = "
+                    f"(SELECT users.id FROM users WHERE users.username = {tabela}.{coluna_texto}) "
+                    f"WHERE {coluna_id} IS NULL AND {coluna_texto} IS NOT NULL"
+                )
+        executar_ddl(ddl)
+    except Exception as e:
+        logger.warning("Erro ao migrar responsaveis para usuarios: %s", e)
+
+
+def migrar_contadores_progresso():
+    """Cria os contadores de progresso e, se acabaram de ser criados, preenche a partir das atividades"""
+    try:
+        criadas = set()
+        for tabela in ("cenarios", "fases", "projetos"):
+            criadas |= adicionar_colunas(tabela, {campo: "INTEGER NOT NULL DEFAULT 0" for campo in contadores.CAMPOS})
+        if criadas:
+            contadores.recalcular()
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning("Erro ao migrar contadores de progresso: %s", e)
+
+
+def migrar_sequencia_unica():
+    """
+    Cria a unicidade de (cenario_id, numero_sequencial). Cenários antigos com
+    números repetidos são renumerados antes, na ordem em que já apareciam.
+    PostgreSQL: constraint DEFERRABLE INITIALLY DEFERRED (ver sequencia.py);
+    SQLite: índice único.
+    """
+    try:
+        inspector = inspect(db.engine)
+        existentes = {u["name"] for u in inspector.get_unique_constraints("atividades")}
+        existentes |= {i["name"] for i in inspector.get_indexes("atividades")}
+        if "uq_atividade_cenario_seq" in existentes:
+            return
+        corrigidos = sequencia.corrigir_duplicados()
+        if corrigidos:
+            logger.warning("%s cenario(s) com numero_sequencial repetido renumerado(s)", len(corrigidos))
+        if db.engine.dialect.name == "postgresql":
+            db.session.execute(text(
+                "ALTER TABLE atividades ADD CONSTRAINT uq_atividade_cenario_seq "
+                "UNIQUE (cenario_id, numero_sequencial) DEFERRABLE INITIALLY DEFERRED"
+            ))
+        else:
+            db.session.execute(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS uq_atividade_cenario_seq "
+                "ON atividades (cenario_id, numero_sequencial)"
+            ))
+        db.session.commit()
+        logger.info("Unicidade de numero_sequencial por cenario criada")
+    except Exception as e:
+        db.session.rollback()
+        logger.warning("Erro ao criar unicidade de numero_sequencial: %s", e)
+
+def recriar_tabela_sqlite(modelo):
+    """
+    SQLite não altera constraints de coluna (ex.: NOT NULL): recria a tabela a
+    partir do modelo atual e copia as colunas que já existiam.
+    """
+    tabela = modelo.__table__
+    antigas = {c["name"] for c in inspect(db.engine).get_columns(tabela.name)}
+    colunas = ", ".join(c.name for c in tabela.columns if c.name in antigas)
+    ddl = str(CreateTable(tabela).compile(db.engine)).strip()
+    ddl = ddl.replace(f"CREATE TABLE {tabela.name} (", f"CREATE TABLE {tabela.name}_nova (", 1)
+    db.session.execute(text(ddl))
+    db.session.execute(text(f"INSERT INTO {tabela.name}_nova ({colunas}) SELECT {colunas} FROM {tabela.name}"))
+    db.session.execute(text(f"DROP TABLE {tabela.name}"))
+    db.session.execute(text(f"ALTER TABLE {tabela.name}_nova RENAME TO {tabela.name}"))
+    for indice in tabela.indexes:
+        indice.create(db.session.connection(), checkfirst=True)
+
+
+def migrar_perfis_globais():
+    """
+    Perfis padrão viram modelos globais (perfis.projeto_id NULL) e os
+    Administrador/Membro copiados em cada projeto passam a apontar para eles
+    (ver permissoes.migrar_para_modelos).
+    """
+    try:
+        projeto_id = next(c for c in inspect(db.engine).get_columns("perfis") if c["name"] == "projeto_id")
+        if not projeto_id["nullable"]:
+            if db.engine.dialect.name == "postgresql":
+                db.session.execute(text("ALTER TABLE perfis ALTER COLUMN projeto_id DROP NOT NULL"))
+            else:
+                recriar_tabela_sqlite(Perfil)
+            db.session.commit()
+        adicionar_colunas("perfis", {
+            "modelo_id": "INTEGER REFERENCES perfis(id) ON DELETE SET NULL",
+            "acesso_total": "BOOLEAN NOT NULL DEFAULT false",
+        })
+        removidos = permissoes.migrar_para_modelos()
+        db.session.commit()
+        if removidos:
+            logger.info("%s perfis padrao por projeto substituidos pelos modelos globais", removidos)
+    except Exception as e:
+        db.session.rollback()
+        logger.warning("Erro ao migrar perfis para modelos globais: %s", e)
+
+
+def migrar_busca():
+    """
+    Índices de busca textual (ver busca.py): o das lições e o da busca no
+    projeto, preenchido com os registros que ainda não estão em busca_itens.
+    """
+    try:
+        if busca.criar_indice_licoes():
+            db.session.commit()
+            logger.info("Indice de busca das licoes criado")
+        if busca.criar_indice_projeto():
+            db.session.commit()
+            logger.info("Indice da busca no projeto criado")
+        for tipo in busca.REGISTROS:
+            quantidade = busca.indexar_pendentes(tipo)
+            db.session.commit()
+            if quantidade:
+                logger.info("%s registro(s) incluido(s) na busca do projeto (%s)", quantidade, tipo)
+    except Exception as e:
+        db.session.rollback()
+        logger.warning("Erro ao criar indices de busca: %s", e)
+
+
+def migrar_assinaturas_similaridade():
+    """Assinaturas MinHash dos incidentes/lições que ainda não têm (ver similares.py)"""
+    try:
+        for tipo in similares.TIPOS:
+            quantidade = similares.indexar_pendentes(tipo)
+            db.session.commit()
+            if quantidade:
+                logger.info("%s assinatura(s) de similaridade calculada(s) (%s)", quantidade, tipo)
+    except Exception as e:
+        db.session.rollback()
+        logger.warning("Erro ao calcular assinaturas de similaridade: %s", e)
+
+
+def migrar_score_riscos():
+    """
+    riscos.impacto/probabilidade eram texto ("1"-"5"): passam a inteiros e
+    ganham a coluna gerada score (impacto * probabilidade) com índice em
+    (projeto_id, score). Valores fora de 1-5 viram NULL.
+    """
+    try:
+        colunas = {c["name"]: c for c in inspect(db.engine).get_columns("riscos")}
+        if isinstance(colunas["impacto"]["type"], Integer) and "score" in colunas:
+            return
+        notas = ", ".join(f"'{n}'" for n in NOTAS_RISCO)
+        descartados = db.session.scalar(text(
+            "SELECT COUNT(*) FROM riscos WHERE "
+            + " OR ".join(
+                f"(TRIM({coluna}) <> '' AND TRIM({coluna}) NOT IN ({notas}))"
+                for coluna in ("impacto", "probabilidade")
+            )
+        ))
+        if db.engine.dialect.name == "postgresql":
+            for coluna in ("impacto", "probabilidade"):
+                db.session.execute(text(
+                    f"ALTER TABLE riscos ALTER COLUMN {coluna} TYPE INTEGER "
+                    f"USING CASE WHEN TRIM({coluna}) IN ({notas}) THEN CAST(TRIM({coluna}) AS INTEGER) END"
+                ))
+            db.session.execute(text(
+                "ALTER TABLE riscos ADD COLUMN IF NOT EXISTS score INTEGER "
+                "GENERATED ALWAYS AS (impacto * probabilidade) STORED"
+            ))
+            db.session.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_riscos_projeto_score ON riscos (projeto_id, score)"
+            ))
+        else:
+            # Afinidade INTEGER da tabela nova converte os textos já limpos
+            for coluna in ("impacto", "probabilidade"):
+                db.session.execute(text(
+                    f"UPDATE riscos SET {coluna} = "
+                    f"CASE WHEN TRIM({coluna}) IN ({notas}) THEN CAST(TRIM({coluna}) AS INTEGER) END"
+                ))
+            recriar_tabela_sqlite(Risco)
+        db.session.commit()
+        logger.info("Score numerico dos riscos criado")
+        if descartados:
+            logger.warning("%s risco(s) com impacto/probabilidade fora de 1-5 ficaram sem nota", descartados)
+    except Exception as e:
+        db.session.rollback()
+        logger.warning("Erro ao migrar score dos riscos: %s", e)
+
+
+def migrar_auditoria():
+    """
+    Cria a tabela auditoria (particionada por mês no PostgreSQL, fora do
+    create_all) e as partições do mês corrente e dos próximos.
+    """
+    try:
+        if auditoria.criar_tabela():
+            logger.info("Tabela de auditoria criada")
+        particoes = auditoria.garantir_particoes()
+        db.session.commit()
+        if particoes:
+            logger.info("%s particao(oes) de auditoria criada(s)", particoes)
+    except Exception as e:
+        db.session.rollback()
+        logger.warning("Erro ao criar tabela de auditoria: %s", e)
+
+
+def migrar_sla_incidentes():
+    """Histórico de status dos incidentes anteriores a ele e indicadores de SLA (ver sla.py)"""
+    try:
+        registrados = sla.registrar_existentes()
+        if registrados:
+            sla.recalcular()
+        db.session.commit()
+        if registrados:
+            logger.info("%s incidente(s) incluido(s) nos indicadores de SLA", registrados)
+    except Exception as e:
+        db.session.rollback()
+        logger.warning("Erro ao migrar historico de status dos incidentes: %s", e)
+
+
+def migrar_acompanhamentos():
+    """
+    Texto de acompanhamento antigo de incidentes e riscos vira a primeira nota
+    da linha do tempo; registros com notas fora do índice de busca são reindexados.
+    """
+    try:
+        criadas = acompanhamentos.migrar_existentes()
+        db.session.commit()
+        if criadas:
+            logger.info("%s acompanhamento(s) antigo(s) copiado(s) para a linha do tempo", criadas)
+        reindexados = busca.indexar_notas_pendentes()
+        db.session.commit()
+        if reindexados:
+            logger.info("%s registro(s) reindexado(s) com as notas de acompanhamento", reindexados)
+    except Exception as e:
+        db.session.rollback()
+        logger.warning("Erro ao migrar acompanhamentos: %s", e)
+
+# (tabela, coluna, tabela referenciada, ação ON DELETE) - espelha os ForeignKey de models.py
+FOREIGN_KEYS_ON_DELETE = [
+    ("cenarios", "fase_id", "fases", "CASCADE"),
+    ("atividades", "cenario_id", "cenarios", "CASCADE"),
+    ("incidentes", "atividade_id", "atividades", "SET NULL"),
+    ("licoes_aprendidas", "fase_id", "fases", "SET NULL"),
+]
+
+
+def ajustar_foreign_keys():
+    """
+    Recria as FKs do fluxo com a ação ON DELETE correta em bancos PostgreSQL
+    criados antes dela existir. No SQLite alterar uma constraint exige recriar a
+    tabela; lá a exclusão em cascata é feita só pelo deletion.py.
+    """
+    if db.engine.dialect.name != "postgresql":
+        return
+    try:
+        inspector = inspect(db.engine)
+        for tabela, coluna, referencia, acao in FOREIGN_KEYS_ON_DELETE:
+            for fk in inspector.get_foreign_keys(tabela):
+                if fk["constrained_columns"] != [coluna] or fk["referred_table"] != referencia:
+                    continue
+                if (fk.get("options") or {}).get("ondelete", "").upper() == acao:
+                    break
+                try:
+                    db.session.execute(text(
+                        f"ALTER TABLE {tabela} DROP CONSTRAINT {fk['name']}, "
+                        f"ADD CONSTRAINT {fk['name']} FOREIGN KEY ({coluna}) "
+                        f"REFERENCES {referencia}(id) ON DELETE {acao}"
+                    ))
+                    db.session.commit()
+                    logger.info("FK %s.%s ajustada para ON DELETE %s", tabela, coluna, acao)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.warning("Erro ao ajustar FK %s.%s: %s", tabela, coluna, e)
+                break
+    except Exception as e:
+        logger.warning("Erro ao verificar foreign keys: %s", e)
+
+
 def build_external_url(path):
     base_url = app.config.get("APP_BASE_URL") or request.url_root.rstrip("/")
     return f"{base_url}{path}"
 
 
-def send_email(to_email, subject, body):
+@contextmanager
+def smtp_session():
+    """
+    Conexão SMTP aberta e autenticada, para um ou vários envios
+    (smtp.send_message). Sem SMTP_USER/SMTP_PASS não autentica (ex.: sink local).
+    """
     host = app.config.get("SMTP_HOST")
     port_value = app.config.get("SMTP_PORT")
     use_ssl = app.config.get("SMTP_USE_SSL")
     use_tls = app.config.get("SMTP_USE_TLS")
     smtp_user = app.config.get("SMTP_USER")
     smtp_pass = app.config.get("SMTP_PASS")
-    smtp_from = app.config.get("SMTP_FROM")
-    
-    print(f"[DEBUG send_email] HOST={host}, PORT={port_value}, USER={smtp_user}, SSL={use_ssl}, TLS={use_tls}")
-    
+
     if not host:
         raise RuntimeError("SMTP_HOST nao configurado")
 
@@ -566,60 +712,59 @@ def send_email(to_email, subject, body):
         try:
             port = int(port_value)
         except ValueError as e:
-            print(f"[ERROR] SMTP_PORT invalido: {port_value} - {e}")
+            logger.error("SMTP_PORT invalido: %s - %s", port_value, e)
             raise RuntimeError(f"SMTP_PORT nao e inteiro: {port_value}")
     else:
         port = 465 if use_ssl else 587
 
-    smtp_user = app.config.get("SMTP_USER")
-    smtp_pass = app.config.get("SMTP_PASS")
-    smtp_from = app.config.get("SMTP_FROM") or smtp_user
+    if bool(smtp_user) != bool(smtp_pass):
+        raise RuntimeError("SMTP_USER e SMTP_PASS devem ser configurados juntos")
 
+    logger.debug("smtp_session: host=%s port=%s ssl=%s tls=%s", host, port, use_ssl, use_tls)
+
+    if use_ssl:
+        smtp = smtplib.SMTP_SSL(host, port, timeout=10)
+    else:
+        smtp = smtplib.SMTP(host, port, timeout=10)
+    with smtp:
+        if not use_ssl:
+            smtp.ehlo()
+            if use_tls:
+                smtp.starttls(context=ssl.create_default_context())
+                smtp.ehlo()
+        if smtp_user and smtp_pass:
+            smtp.login(smtp_user, smtp_pass)
+        yield smtp
+
+
+def build_email(to_email, subject, body):
+    smtp_from = app.config.get("SMTP_FROM") or app.config.get("SMTP_USER")
     if not smtp_from:
         raise RuntimeError("SMTP_FROM nao configurado")
 
-    if not smtp_user:
-        raise RuntimeError("SMTP_USER nao configurado")
-    
-    if not smtp_pass:
-        raise RuntimeError("SMTP_PASS nao configurado")
-
     message = EmailMessage()
     message["Subject"] = subject
     message["From"] = smtp_from
     message["To"] = to_email
     message.set_content(body)
+    return message
 
-    try:
-        if use_ssl:
-            print(f"[DEBUG] Conectando com SMTP_SSL a {host}:{port}")
-            with smtplib.SMTP_SSL(host, port, timeout=10) as smtp:
-                print(f"[DEBUG] Conectado, fazendo login como {smtp_user}")
-                if smtp_user and smtp_pass:
-                    smtp.login(smtp_user, smtp_pass)
-                print(f"[DEBUG] Login bem-sucedido, enviando mensagem")
-                smtp.send_message(message)
-            print(f"[DEBUG] Email enviado com sucesso para {to_email}")
-            return
 
-        print(f"[DEBUG] Conectand com SMTP a {host}:{port}")
-        with smtplib.SMTP(host, port, timeout=10) as smtp:
-            smtp.ehlo()
-            if use_tls:
-                print(f"[DEBUG] Iniciando STARTTLS")
-                smtp.starttls(context=ssl.create_default_context())
-                smtp.ehlo()
-            if smtp_user and smtp_pass:
-                print(f"[DEBUG] Fazendo login como {smtp_user}")
-                smtp.login(smtp_user, smtp_pass)
-            print(f"[DEBUG] Enviando mensagem para {to_email}")
+def send_email(to_email, subject, body):
+    message = build_email(to_email, subject, body)
+
+    metrics.MAIL_IN_FLIGHT.inc()
+    try:
+        with smtp_session() as smtp:
             smtp.send_message(message)
-        print(f"[DEBUG] Email enviado com sucesso para {to_email}")
-    except Exception as e:
-        print(f"[ERROR] Erro ao enviar email: {type(e).__name__}: {e}")
-        import traceback
-        traceback.print_exc()
+        metrics.MAIL_SENT.inc()
+        logger.info("E-mail enviado", extra={"subject": subject})
+    except Exception:
+        metrics.MAIL_FAILURES.inc()
+        logger.exception("Erro ao enviar email")
         raise
+    finally:
+        metrics.MAIL_IN_FLIGHT.dec()
 
 
 def generate_email_confirmation(user):
@@ -665,11 +810,6 @@ def send_password_reset_email(user, token):
     send_email(user.email, "Recuperacao de senha - IMSIS", body)
 
 
-# 🔥 Inicializa o banco de dados automaticamente quando a app inicia
-with app.app_context():
-    criar_tabelas()
-
-
 # ------------------------------------------------------------------------------
 # ROUTES
 # ------------------------------------------------------------------------------
@@ -788,7 +928,7 @@ def register():
             send_confirmation_email(user, token)
             flash("Cadastro criado. Verifique seu e-mail para confirmar a conta.")
         except Exception as e:
-            print(f"[WARN] Erro ao enviar e-mail de confirmacao: {e}")
+            logger.warning("Erro ao enviar e-mail de confirmacao: %s", e)
             flash(
                 "Cadastro criado, mas nao foi possivel enviar o e-mail de confirmacao. "
                 "Use 'Reenviar confirmacao' no login."
@@ -819,9 +959,7 @@ def login():
             login_user(user)
             return redirect(url_for("projetos"))
         except Exception as e:
-            print(f"[ERROR] Erro no login: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Erro no login")
             flash("Erro ao fazer login. Tente novamente.")
             return redirect(url_for("login"))
 
@@ -891,7 +1029,7 @@ def resend_confirmation():
             send_confirmation_email(user, token)
             flash("Enviamos um novo link de confirmacao para o seu e-mail.")
         except Exception as e:
-            print(f"[WARN] Erro ao reenviar e-mail de confirmacao: {e}")
+            logger.warning("Erro ao reenviar e-mail de confirmacao: %s", e)
             flash("Nao foi possivel enviar o e-mail de confirmacao. Tente novamente.")
 
         return redirect(url_for("login"))
@@ -920,7 +1058,7 @@ def forgot_password():
             send_password_reset_email(user, token)
             flash("Enviamos um link de recuperacao para o seu e-mail.")
         except Exception as e:
-            print(f"[WARN] Erro ao enviar e-mail de recuperacao de senha: {e}")
+            logger.warning("Erro ao enviar e-mail de recuperacao de senha: %s", e)
             flash("Nao foi possivel enviar o e-mail. Tente novamente.")
 
         return redirect(url_for("login"))
@@ -1019,6 +1157,37 @@ def index():
     )
 
 
+def criar_projeto(nome, membros_ids=()):
+    """
+    Cria o projeto; o usuário atual entra como Administrador e os demais
+    `membros_ids` como Membro. Não faz commit.
+    """
+    projeto = Projeto(nome=nome)
+    db.session.add(projeto)
+    db.session.flush()
+
+    # Perfis padrão são os modelos globais (permissoes.py)
+    perfil_admin = permissoes.modelo_id("Administrador")
+    perfil_membro = permissoes.modelo_id("Membro")
+
+    # Adicionar membros
+    membros = {int(mid) for mid in membros_ids if str(mid).isdigit()}
+    membros.add(current_user.id)
+
+    for uid in membros:
+        membro = ProjetoMembro(projeto_id=projeto.id, user_id=uid)
+        db.session.add(membro)
+        db.session.flush()
+
+        # Criador é admin, outros são membros
+        if uid == current_user.id:
+            db.session.add(MembroPerfil(projeto_membro_id=membro.id, perfil_id=perfil_admin))
+        else:
+            db.session.add(MembroPerfil(projeto_membro_id=membro.id, perfil_id=perfil_membro))
+
+    return projeto
+
+
 @app.route("/projetos", methods=["GET", "POST"])
 @login_required
 def projetos():
@@ -1026,76 +1195,7 @@ def projetos():
         nome = request.form.get("nome")
         membros_ids = request.form.getlist("membros")
         if nome:
-            projeto = Projeto(nome=nome)
-            db.session.add(projeto)
-            db.session.flush()
-            
-            # Criar perfis padrão
-            perfil_admin = Perfil(
-                nome="Administrador",
-                projeto_id=projeto.id,
-                pode_criar_atividade=True,
-                pode_editar_atividade=True,
-                pode_excluir_atividade=True,
-                pode_concluir_qualquer_atividade=True,
-                pode_editar_projeto=True,
-                pode_gerenciar_membros=True,
-                pode_criar_licao=True,
-                pode_editar_licao=True,
-                pode_excluir_licao=True,
-                pode_criar_mudanca=True,
-                pode_editar_mudanca=True,
-                pode_excluir_mudanca=True,
-                pode_criar_incidente=True,
-                pode_editar_incidente=True,
-                pode_excluir_incidente=True,
-                pode_criar_risco=True,
-                pode_editar_risco=True,
-                pode_excluir_risco=True,
-                is_default=True
-            )
-            perfil_membro = Perfil(
-                nome="Membro",
-                projeto_id=projeto.id,
-                pode_criar_atividade=True,
-                pode_editar_atividade=True,
-                pode_excluir_atividade=False,
-                pode_concluir_qualquer_atividade=False,
-                pode_editar_projeto=False,
-                pode_gerenciar_membros=False,
-                pode_criar_licao=True,
-                pode_editar_licao=True,
-                pode_excluir_licao=False,
-                pode_criar_mudanca=True,
-                pode_editar_mudanca=True,
-                pode_excluir_mudanca=False,
-                pode_criar_incidente=True,
-                pode_editar_incidente=True,
-                pode_excluir_incidente=True,
-                pode_criar_risco=True,
-                pode_editar_risco=True,
-                pode_excluir_risco=True,
-                is_default=True
-            )
-            db.session.add(perfil_admin)
-            db.session.add(perfil_membro)
-            db.session.flush()
-            
-            # Adicionar membros
-            membros = {int(mid) for mid in membros_ids if mid.isdigit()}
-            membros.add(current_user.id)
-            
-            for uid in membros:
-                membro = ProjetoMembro(projeto_id=projeto.id, user_id=uid)
-                db.session.add(membro)
-                db.session.flush()
-                
-                # Criador é admin, outros são membros
-                if uid == current_user.id:
-                    db.session.add(MembroPerfil(projeto_membro_id=membro.id, perfil_id=perfil_admin.id))
-                else:
-                    db.session.add(MembroPerfil(projeto_membro_id=membro.id, perfil_id=perfil_membro.id))
-            
+            criar_projeto(nome, membros_ids)
             db.session.commit()
             flash("Projeto criado com sucesso")
         return redirect(url_for("projetos"))
@@ -1116,6 +1216,25 @@ def projetos():
     )
 
 
+@app.route("/projetos/<int:projeto_id>/clonar", methods=["POST"])
+@login_required
+def clonar_projeto(projeto_id):
+    """Novo projeto com a estrutura (fases, cenários, atividades, perfis) deste"""
+    origem = Projeto.query.get_or_404(projeto_id)
+    if not is_project_member(projeto_id):
+        abort(403)
+
+    nome = (request.form.get("nome") or "").strip() or f"{origem.nome} (cópia)"
+    projeto = criar_projeto(nome)
+    copiadas = clonagem.clonar_projeto(
+        projeto_id, projeto.id, incluir_licoes=request.form.get("incluir_licoes") == "on"
+    )
+    db.session.commit()
+    logger.info("Projeto clonado", extra={"origem_id": projeto_id, "projeto_id": projeto.id, **copiadas})
+    flash(f"Projeto '{nome}' criado a partir de '{origem.nome}' ({copiadas['atividades']} atividades)")
+    return redirect(url_for("projetos"))
+
+
 @app.route("/projetos/<int:projeto_id>/membros", methods=["POST"])
 @login_required
 def adicionar_membro_projeto(projeto_id):
@@ -1135,9 +1254,9 @@ def adicionar_membro_projeto(projeto_id):
             db.session.flush()
             
             # Atribuir perfil padrão de Membro
-            perfil_membro = Perfil.query.filter_by(projeto_id=projeto_id, nome="Membro", is_default=True).first()
+            perfil_membro = permissoes.perfil_padrao(projeto_id, "Membro")
             if perfil_membro:
-                db.session.add(MembroPerfil(projeto_membro_id=membro.id, perfil_id=perfil_membro.id))
+                db.session.add(MembroPerfil(projeto_membro_id=membro.id, perfil_id=perfil_membro))
             
             db.session.commit()
             flash("Membro adicionado com sucesso")
@@ -1214,6 +1333,11 @@ def fluxo(projeto_id):
             responsavel = request.form.get("responsavel")
             
             if descricao and responsavel and cenario_id:
+                # Número ocupado: a nova entra no lugar e as seguintes descem
+                if numero:
+                    sequencia.abrir_espaco(cenario_id, numero)
+                else:
+                    numero = sequencia.proximo_numero(cenario_id)
                 nova = Atividade(
                     numero_sequencial=numero,
                     descricao=descricao,
@@ -1221,43 +1345,18 @@ def fluxo(projeto_id):
                     cenario_id=cenario_id,
                 )
                 db.session.add(nova)
+                db.session.flush()
+                # Cenário sem nada liberado: libera o ponto de partida
+                dependencias.liberar_iniciais(cenario_id)
                 db.session.commit()
                 
-                # Se não houver nenhuma atividade liberada neste cenário, liberar a primeira (menor seq)
-                any_liberada = (
-                    Atividade.query
-                    .filter_by(cenario_id=cenario_id)
-                    .filter(Atividade.data_liberacao != None)
-                    .first()
-                )
-                if not any_liberada:
-                    primeira = (
-                        Atividade.query
-                        .filter_by(cenario_id=cenario_id)
-                        .order_by(Atividade.numero_sequencial)
-                        .first()
-                    )
-                    if primeira and not primeira.data_liberacao:
-                        primeira.data_liberacao = datetime.now()
-                        db.session.commit()
-                
                 flash("Atividade criada com sucesso", "success")
             return redirect(url_for("fluxo", projeto_id=projeto_id, fase=fase_id, cenario=cenario_id))
 
-    # Carregar todas as fases com seus cenários
+    # Só as fases (com contadores); cenários e atividades das fases não
+    # selecionadas são buscados sob demanda pelos endpoints JSON abaixo
     fases = Fase.query.filter_by(projeto_id=projeto_id).order_by(Fase.id).all()
-    
-    # Para cada fase, carregar seus cenários
-    for fase in fases:
-        fase.cenarios = Cenario.query.filter_by(fase_id=fase.id).order_by(Cenario.id).all()
-        # Para cada cenário, carregar suas atividades
-        for cenario in fase.cenarios:
-            cenario.atividades = (
-                Atividade.query
-                .filter_by(cenario_id=cenario.id)
-                .order_by(Atividade.numero_sequencial)
-                .all()
-            )
+    cenarios_por_fase = contar_cenarios_por_fase(projeto_id)
 
     # Fase selecionada (da query string)
     fase_id = request.args.get("fase", type=int)
@@ -1267,20 +1366,14 @@ def fluxo(projeto_id):
     if fase_id:
         fase_selecionada = Fase.query.filter_by(id=fase_id, projeto_id=projeto_id).first()
         if fase_selecionada:
+            # Progresso vem dos contadores do cenário; atividades só do selecionado
             cenarios = Cenario.query.filter_by(fase_id=fase_id).order_by(Cenario.id).all()
-            # Carregar atividades para cada cenário
-            for cenario in cenarios:
-                cenario.atividades = (
-                    Atividade.query
-                    .filter_by(cenario_id=cenario.id)
-                    .order_by(Atividade.numero_sequencial)
-                    .all()
-                )
 
     # Cenário selecionado (da query string)
     cenario_id = request.args.get("cenario", type=int)
     cenario_selecionado = None
     atividades = []
+    predecessoras = {}
     usuarios = []
     
     if cenario_id:
@@ -1292,6 +1385,14 @@ def fluxo(projeto_id):
                 .order_by(Atividade.numero_sequencial)
                 .all()
             )
+            # Predecessoras de cada atividade (podem estar em outros cenários)
+            for dep in (
+                DependenciaAtividade.query
+                .options(joinedload(DependenciaAtividade.predecessora))
+                .filter(DependenciaAtividade.sucessora_id.in_([a.id for a in atividades]))
+                .order_by(DependenciaAtividade.id)
+            ):
+                predecessoras.setdefault(dep.sucessora_id, []).append(dep)
             # Apenas membros do projeto podem ser responsáveis
             usuarios = (
                 User.query
@@ -1309,6 +1410,8 @@ def fluxo(projeto_id):
         cenarios=cenarios,
         cenario_selecionado=cenario_selecionado,
         atividades=atividades,
+        predecessoras=predecessoras,
+        cenarios_por_fase=cenarios_por_fase,
         usuario_atual=current_user.username,
         usuarios=usuarios,
         pode_concluir_qualquer=has_permission(projeto_id, 'pode_concluir_qualquer_atividade'),
@@ -1348,12 +1451,8 @@ def fluxo_excluir_fase(projeto_id):
     if fase_id:
         fase = Fase.query.get_or_404(fase_id)
         if fase.projeto_id == projeto_id:
-            # Excluir cenários e atividades relacionados
-            cenarios = Cenario.query.filter_by(fase_id=fase_id).all()
-            for cenario in cenarios:
-                Atividade.query.filter_by(cenario_id=cenario.id).delete()
-                db.session.delete(cenario)
-            db.session.delete(fase)
+            # Excluir cenários e atividades relacionados (set-based)
+            deletion.excluir_fase(fase_id)
             db.session.commit()
             flash("Fase excluída com sucesso", "success")
     
@@ -1394,9 +1493,8 @@ def fluxo_excluir_cenario(projeto_id):
         cenario = Cenario.query.get_or_404(cenario_id)
         fase = Fase.query.get_or_404(cenario.fase_id)
         if fase.projeto_id == projeto_id:
-            # Excluir atividades relacionadas
-            Atividade.query.filter_by(cenario_id=cenario_id).delete()
-            db.session.delete(cenario)
+            # Excluir atividades relacionadas (set-based)
+            deletion.excluir_cenario(cenario_id)
             db.session.commit()
             flash("Cenário excluído com sucesso", "success")
     
@@ -1421,19 +1519,57 @@ def fluxo_editar_atividade(projeto_id):
         return redirect(url_for("fluxo", projeto_id=projeto_id, fase=fase_id, cenario=cenario_id))
     
     if atividade_id and descricao and responsavel:
-        atividade = Atividade.query.get_or_404(atividade_id)
-        cenario = Cenario.query.get_or_404(atividade.cenario_id)
-        fase = Fase.query.get_or_404(cenario.fase_id)
-        if fase.projeto_id == projeto_id:
-            atividade.numero_sequencial = numero_sequencial
-            atividade.descricao = descricao
-            atividade.responsavel = responsavel
-            db.session.commit()
-            flash("Atividade atualizada com sucesso", "success")
+        atividade = get_atividade_do_projeto_or_404(atividade_id, projeto_id)
+        if numero_sequencial is not None and numero_sequencial != atividade.numero_sequencial:
+            sequencia.abrir_espaco(atividade.cenario_id, numero_sequencial, atividade.id)
+            dependencias.reposicionar(atividade.cenario_id)
+        atividade.descricao = descricao
+        atividade.responsavel = responsavel
+        db.session.commit()
+        flash("Atividade atualizada com sucesso", "success")
     
     return redirect(url_for("fluxo", projeto_id=projeto_id, fase=fase_id, cenario=cenario_id))
 
 
+@app.route("/projetos/<int:projeto_id>/cenarios/<int:cenario_id>/reordenar", methods=["POST"])
+@login_required
+def reordenar_atividades(projeto_id, cenario_id):
+    """
+    Renumera o cenário em uma transação. Corpo JSON {"atividade_ids": [...]}
+    (ou a própria lista, ou campos de formulário atividade_ids) com todas as
+    atividades na nova ordem. A liberação acompanha a nova sequência.
+    """
+    if not is_project_member(projeto_id):
+        abort(403)
+    if not has_permission(projeto_id, "pode_editar_atividade"):
+        abort(403)
+    Cenario.query.filter_by(id=cenario_id, projeto_id=projeto_id).first_or_404()
+
+    dados = request.get_json(silent=True)
+    if isinstance(dados, dict):
+        atividade_ids = dados.get("atividade_ids")
+    elif dados is not None:
+        atividade_ids = dados
+    else:
+        atividade_ids = request.form.getlist("atividade_ids")
+    if not isinstance(atividade_ids, list):
+        return {"erro": "Lista de atividades inválida"}, 400
+    try:
+        atividade_ids = [int(a) for a in atividade_ids]
+        numeros = sequencia.reordenar(cenario_id, atividade_ids)
+        dependencias.reposicionar(cenario_id)
+        db.session.commit()
+    except (TypeError, ValueError) as e:
+        db.session.rollback()
+        mensagem = str(e) if isinstance(e, sequencia.SequenciaInvalida) else "Lista de atividades inválida"
+        return {"erro": mensagem}, 400
+
+    return {
+        "cenario_id": cenario_id,
+        "atividades": [{"id": a, "numero_sequencial": n} for a, n in numeros.items()],
+    }
+
+
 @app.route("/projetos/<int:projeto_id>/excluir_atividade", methods=["POST"])
 @login_required
 def fluxo_excluir_atividade(projeto_id):
@@ -1449,13 +1585,10 @@ def fluxo_excluir_atividade(projeto_id):
         return redirect(url_for("fluxo", projeto_id=projeto_id, fase=fase_id, cenario=cenario_id))
     
     if atividade_id:
-        atividade = Atividade.query.get_or_404(atividade_id)
-        cenario = Cenario.query.get_or_404(atividade.cenario_id)
-        fase = Fase.query.get_or_404(cenario.fase_id)
-        if fase.projeto_id == projeto_id:
-            db.session.delete(atividade)
-            db.session.commit()
-            flash("Atividade excluída com sucesso", "success")
+        atividade = get_atividade_do_projeto_or_404(atividade_id, projeto_id)
+        deletion.excluir_atividade(atividade.id)
+        db.session.commit()
+        flash("Atividade excluída com sucesso", "success")
     
     return redirect(url_for("fluxo", projeto_id=projeto_id, fase=fase_id, cenario=cenario_id))
 
@@ -1474,38 +1607,27 @@ def fluxo_concluir_atividade(projeto_id):
     pode_concluir_qualquer = has_permission(projeto_id, 'pode_concluir_qualquer_atividade')
     
     if atividade_id:
-        atividade = Atividade.query.get_or_404(atividade_id)
-        cenario = Cenario.query.get_or_404(atividade.cenario_id)
-        fase = Fase.query.get_or_404(cenario.fase_id)
-        if fase.projeto_id == projeto_id:
-            # Verificar permissões apenas se não for admin
-            if not pode_concluir_qualquer:
-                # Verificar se é o responsável
-                if atividade.responsavel != current_user.username:
-                    flash("Apenas o responsável pode concluir esta atividade", "error")
-                    return redirect(url_for("fluxo", projeto_id=projeto_id, fase=fase_id, cenario=cenario_id))
-                # Verificar se está liberada
-                if not atividade.data_liberacao:
-                    flash("Atividade ainda não está liberada", "error")
-                    return redirect(url_for("fluxo", projeto_id=projeto_id, fase=fase_id, cenario=cenario_id))
-            
-            atividade.data_conclusao = datetime.now()
-            db.session.commit()
-            
-            # Liberar próxima atividade na sequência
-            proxima = (
-                Atividade.query
-                .filter_by(cenario_id=cenario_id)
-                .filter(Atividade.numero_sequencial > atividade.numero_sequencial)
-                .filter(Atividade.data_liberacao == None)
-                .order_by(Atividade.numero_sequencial)
-                .first()
-            )
-            if proxima:
-                proxima.data_liberacao = datetime.now()
-                db.session.commit()
-            
-            flash("Atividade concluída com sucesso", "success")
+        atividade = get_atividade_do_projeto_or_404(atividade_id, projeto_id)
+        # Verificar permissões apenas se não for admin
+        if not pode_concluir_qualquer:
+            # Verificar se é o responsável
+            if atividade.responsavel_id != current_user.id:
+                flash("Apenas o responsável pode concluir esta atividade", "error")
+                return redirect(url_for("fluxo", projeto_id=projeto_id, fase=fase_id, cenario=cenario_id))
+            # Verificar se está liberada
+            if not atividade.data_liberacao:
+                flash("Atividade ainda não está liberada", "error")
+                return redirect(url_for("fluxo", projeto_id=projeto_id, fase=fase_id, cenario=cenario_id))
+        
+        if atividade.data_conclusao:
+            flash("Atividade já está concluída", "error")
+            return redirect(url_for("fluxo", projeto_id=projeto_id, fase=fase_id, cenario=cenario_id))
+
+        # Libera as sucessoras desbloqueadas (ou a próxima da sequência)
+        dependencias.concluir(atividade)
+        db.session.commit()
+        
+        flash("Atividade concluída com sucesso", "success")
     
     return redirect(url_for("fluxo", projeto_id=projeto_id, fase=fase_id, cenario=cenario_id))
 
@@ -1526,18 +1648,169 @@ def fluxo_reabrir_atividade(projeto_id):
     cenario_id = request.form.get("cenario_id", type=int)
     
     if atividade_id:
-        atividade = Atividade.query.get_or_404(atividade_id)
-        cenario = Cenario.query.get_or_404(atividade.cenario_id)
-        fase = Fase.query.get_or_404(cenario.fase_id)
+        atividade = get_atividade_do_projeto_or_404(atividade_id, projeto_id)
         
-        if fase.projeto_id == projeto_id and atividade.data_conclusao:
-            atividade.data_conclusao = None
+        if dependencias.reabrir(atividade):
             db.session.commit()
             flash("Atividade reaberta com sucesso", "success")
     
     return redirect(url_for("fluxo", projeto_id=projeto_id, fase=fase_id, cenario=cenario_id))
 
 
+@app.route("/projetos/<int:projeto_id>/dependencias", methods=["POST"])
+@login_required
+def fluxo_dependencias(projeto_id):
+    if not is_project_member(projeto_id):
+        abort(403)
+
+    fase_id = request.form.get("fase_id", type=int)
+    cenario_id = request.form.get("cenario_id", type=int)
+    destino = url_for("fluxo", projeto_id=projeto_id, fase=fase_id, cenario=cenario_id)
+
+    if not has_permission(projeto_id, "pode_editar_atividade"):
+        flash("Você não tem permissão para editar atividades", "error")
+        return redirect(destino)
+
+    action = request.form.get("action")
+    if action == "criar":
+        predecessora_id = request.form.get("predecessora_id", type=int)
+        sucessora_id = request.form.get("sucessora_id", type=int)
+        if not predecessora_id or not sucessora_id:
+            flash("Informe as duas atividades", "error")
+            return redirect(destino)
+        predecessora = get_atividade_do_projeto_or_404(predecessora_id, projeto_id)
+        sucessora = get_atividade_do_projeto_or_404(sucessora_id, projeto_id)
+        try:
+            dependencias.adicionar_dependencia(predecessora, sucessora)
+        except dependencias.DependenciaInvalida as e:
+            db.session.rollback()
+            flash(str(e), "error")
+            return redirect(destino)
+        db.session.commit()
+        flash("Dependência criada com sucesso", "success")
+
+    elif action == "excluir":
+        dependencia_id = request.form.get("dependencia_id", type=int)
+        dependencia = DependenciaAtividade.query.filter_by(id=dependencia_id, projeto_id=projeto_id).first_or_404()
+        dependencias.remover_dependencia(dependencia)
+        db.session.commit()
+        flash("Dependência removida", "success")
+
+    return redirect(destino)
+
+
+# ------------------------------------------------------------------------------
+# FLUXO - ÁRVORE SOB DEMANDA (JSON)
+# ------------------------------------------------------------------------------
+ATIVIDADES_POR_PAGINA = 100
+ATIVIDADES_POR_PAGINA_MAX = 500
+
+
+def contar_cenarios_por_fase(projeto_id):
+    return dict(
+        db.session.query(Cenario.fase_id, func.count(Cenario.id))
+        .filter(Cenario.projeto_id == projeto_id)
+        .group_by(Cenario.fase_id)
+        .all()
+    )
+
+
+def progresso_json(item):
+    return {
+        "total_atividades": item.total_atividades,
+        "concluidas": item.concluidas,
+        "liberadas": item.liberadas,
+    }
+
+
+def atividade_json(atv, pode_concluir_qualquer):
+    return {
+        "id": atv.id,
+        "numero_sequencial": atv.numero_sequencial,
+        "descricao": atv.descricao,
+        "responsavel": atv.responsavel,
+        "data_liberacao": atv.data_liberacao.isoformat(timespec="minutes") if atv.data_liberacao else None,
+        "data_conclusao": atv.data_conclusao.isoformat(timespec="minutes") if atv.data_conclusao else None,
+        "predecessoras_pendentes": atv.predecessoras_pendentes,
+        "pode_concluir": bool(
+            not atv.data_conclusao
+            and (pode_concluir_qualquer or (atv.data_liberacao and atv.responsavel_id == current_user.id))
+        ),
+        "pode_reabrir": bool(atv.data_conclusao and pode_concluir_qualquer),
+    }
+
+
+@app.route("/projetos/<int:projeto_id>/fluxo/fases.json")
+@login_required
+def fluxo_fases_json(projeto_id):
+    if not is_project_member(projeto_id):
+        abort(403)
+    cenarios_por_fase = contar_cenarios_por_fase(projeto_id)
+    fases = Fase.query.filter_by(projeto_id=projeto_id).order_by(Fase.id).all()
+    return {
+        "fases": [
+            {"id": f.id, "nome": f.nome, "cenarios": cenarios_por_fase.get(f.id, 0), **progresso_json(f)}
+            for f in fases
+        ]
+    }
+
+
+@app.route("/projetos/<int:projeto_id>/fluxo/fases/<int:fase_id>/cenarios.json")
+@login_required
+def fluxo_cenarios_json(projeto_id, fase_id):
+    if not is_project_member(projeto_id):
+        abort(403)
+    Fase.query.filter_by(id=fase_id, projeto_id=projeto_id).first_or_404()
+    cenarios = Cenario.query.filter_by(fase_id=fase_id).order_by(Cenario.id).all()
+    return {
+        "fase_id": fase_id,
+        "cenarios": [{"id": c.id, "nome": c.cenario, **progresso_json(c)} for c in cenarios],
+    }
+
+
+@app.route("/projetos/<int:projeto_id>/fluxo/cenarios/<int:cenario_id>/atividades.json")
+@login_required
+def fluxo_atividades_json(projeto_id, cenario_id):
+    """Atividades do cenário, paginadas (?pagina=1&por_pagina=100)"""
+    if not is_project_member(projeto_id):
+        abort(403)
+    cenario = Cenario.query.filter_by(id=cenario_id, projeto_id=projeto_id).first_or_404()
+    pagina = max(1, request.args.get("pagina", 1, type=int))
+    por_pagina = min(
+        ATIVIDADES_POR_PAGINA_MAX,
+        max(1, request.args.get("por_pagina", ATIVIDADES_POR_PAGINA, type=int)),
+    )
+
+    # Uma linha a mais só para saber se existe próxima página (o total vem do contador)
+    atividades = (
+        Atividade.query
+        .filter_by(cenario_id=cenario_id)
+        .order_by(Atividade.numero_sequencial, Atividade.id)
+        .offset((pagina - 1) * por_pagina)
+        .limit(por_pagina + 1)
+        .all()
+    )
+    pode_concluir_qualquer = has_permission(projeto_id, "pode_concluir_qualquer_atividade")
+    return {
+        "cenario_id": cenario.id,
+        "total": cenario.total_atividades,
+        "pagina": pagina,
+        "por_pagina": por_pagina,
+        "proxima_pagina": pagina + 1 if len(atividades) > por_pagina else None,
+        "atividades": [atividade_json(a, pode_concluir_qualquer) for a in atividades[:por_pagina]],
+    }
+
+
+@app.route("/projetos/<int:projeto_id>/cronograma.json")
+@login_required
+def cronograma_json(projeto_id):
+    """Previsão de término por fase/cenário e caminho crítico (aba Cronograma do fluxo)"""
+    if not is_project_member(projeto_id):
+        abort(403)
+    Projeto.query.get_or_404(projeto_id)
+    return cronograma.cronograma_projeto(projeto_id)
+
+
 @app.route("/projetos/<int:projeto_id>/fases", methods=["GET", "POST"])
 @login_required
 def fases(projeto_id):
@@ -1574,7 +1847,7 @@ def cenarios_por_fase(projeto_id, fase_id):
     if request.method == "POST":
         nome = request.form.get("cenario")
         if nome:
-            db.session.add(Cenario(cenario=nome, fase_id=fase_id))
+            db.session.add(Cenario(cenario=nome, fase_id=fase_id, projeto_id=projeto_id))
             db.session.commit()
             flash("Cenário criado com sucesso")
         return redirect(url_for("cenarios_por_fase", projeto_id=projeto_id, fase_id=fase_id))
@@ -1611,33 +1884,24 @@ def atividades_por_cenario(projeto_id, fase_id, cenario_id):
         responsavel = request.form.get("responsavel")
 
         if descricao and responsavel:
+            # Número ocupado: a nova entra no lugar e as seguintes descem
+            if numero:
+                sequencia.abrir_espaco(cenario_id, numero)
+            else:
+                numero = sequencia.proximo_numero(cenario_id)
             nova = Atividade(
                 numero_sequencial=numero,
                 descricao=descricao,
                 responsavel=responsavel,
                 cenario_id=cenario_id,
+                projeto_id=projeto_id,
             )
             db.session.add(nova)
+            db.session.flush()
+            # Cenário sem nada liberado: libera o ponto de partida
+            dependencias.liberar_iniciais(cenario_id)
             db.session.commit()
 
-            # Se não houver nenhuma atividade liberada neste cenário, liberar a primeira (menor seq)
-            any_liberada = (
-                Atividade.query
-                .filter_by(cenario_id=cenario_id)
-                .filter(Atividade.data_liberacao != None)
-                .first()
-            )
-            if not any_liberada:
-                primeira = (
-                    Atividade.query
-                    .filter_by(cenario_id=cenario_id)
-                    .order_by(Atividade.numero_sequencial)
-                    .first()
-                )
-                if primeira and not primeira.data_liberacao:
-                    primeira.data_liberacao = datetime.now()
-                    db.session.commit()
-
             flash("Atividade criada com sucesso")
 
         return redirect(
@@ -1705,25 +1969,11 @@ def atividades_legacy(cenario_id):
 @app.route("/atividades/<int:atividade_id>/editar", methods=["POST"])
 @login_required
 def editar_atividade(atividade_id):
-    atv = Atividade.query.get_or_404(atividade_id)
-    cenario = Cenario.query.get(atv.cenario_id) if atv.cenario_id else None
-    fase = get_fase_for_cenario_or_none(cenario) if cenario else None
-
-    if not fase or not is_project_member(fase.projeto_id):
-        abort(403)
+    atv = get_atividade_autorizada_or_404(atividade_id)
 
-    if not has_permission(fase.projeto_id, "pode_editar_atividade"):
+    if not has_permission(atv.projeto_id, "pode_editar_atividade"):
         flash("Você não tem permissão para editar atividades", "error")
-        if cenario and fase:
-            return redirect(
-                url_for(
-                    "atividades_por_cenario",
-                    projeto_id=fase.projeto_id,
-                    fase_id=fase.id,
-                    cenario_id=cenario.id,
-                )
-            )
-        return redirect(url_for("projetos"))
+        return redirect_atividades_cenario(atv)
 
     try:
         numero = int(request.form.get("numero_sequencial") or atv.numero_sequencial)
@@ -1737,83 +1987,42 @@ def editar_atividade(atividade_id):
         atv.descricao = descricao
     if responsavel:
         atv.responsavel = responsavel
-    atv.numero_sequencial = numero
+    if numero != atv.numero_sequencial:
+        sequencia.abrir_espaco(atv.cenario_id, numero, atv.id)
+        dependencias.reposicionar(atv.cenario_id)
     
     db.session.commit()
     flash("Atividade atualizada com sucesso", "success")
-
-    if cenario and fase:
-        return redirect(
-            url_for(
-                "atividades_por_cenario",
-                projeto_id=fase.projeto_id,
-                fase_id=fase.id,
-                cenario_id=cenario.id,
-            )
-        )
-    return redirect(url_for("projetos"))
+    return redirect_atividades_cenario(atv)
 
 
 @app.route("/atividades/<int:atividade_id>/delete", methods=["POST"])
 @login_required
 def delete_atividade(atividade_id):
-    atv = Atividade.query.get_or_404(atividade_id)
-    cenario_id = atv.cenario_id
-    cenario = Cenario.query.get(cenario_id) if cenario_id else None
-    fase = get_fase_for_cenario_or_none(cenario) if cenario else None
+    atv = get_atividade_autorizada_or_404(atividade_id)
 
-    if not fase or not is_project_member(fase.projeto_id):
-        abort(403)
-
-    if not has_permission(fase.projeto_id, "pode_excluir_atividade"):
+    if not has_permission(atv.projeto_id, "pode_excluir_atividade"):
         flash("Você não tem permissão para excluir atividades", "error")
-        if cenario_id and fase:
-            return redirect(
-                url_for(
-                    "atividades_por_cenario",
-                    projeto_id=fase.projeto_id,
-                    fase_id=fase.id,
-                    cenario_id=cenario_id,
-                )
-            )
-        return redirect(url_for("projetos"))
-    db.session.delete(atv)
+        return redirect_atividades_cenario(atv)
+
+    resposta = redirect_atividades_cenario(atv)
+    deletion.excluir_atividade(atv.id)
     db.session.commit()
     flash("Atividade excluída")
-    if cenario_id and fase:
-        return redirect(
-            url_for(
-                "atividades_por_cenario",
-                projeto_id=fase.projeto_id,
-                fase_id=fase.id,
-                cenario_id=cenario_id,
-            )
-        )
-    return redirect(url_for("projetos"))
+    return resposta
 
 
 @app.route("/atividades/<int:atividade_id>/liberar", methods=["POST"])
 @login_required
 def liberar_atividade(atividade_id):
-    atv = Atividade.query.get_or_404(atividade_id)
-    cenario = Cenario.query.get(atv.cenario_id) if atv.cenario_id else None
-    fase = get_fase_for_cenario_or_none(cenario) if cenario else None
+    atv = get_atividade_autorizada_or_404(atividade_id)
     if not atv.data_liberacao:
-        atv.data_liberacao = datetime.now()
+        atv.data_liberacao = datetime.utcnow()
         db.session.commit()
         flash("Atividade liberada")
     else:
         flash("Atividade já está liberada")
-    if atv.cenario_id and fase:
-        return redirect(
-            url_for(
-                "atividades_por_cenario",
-                projeto_id=fase.projeto_id,
-                fase_id=fase.id,
-                cenario_id=atv.cenario_id,
-            )
-        )
-    return redirect(url_for("projetos"))
+    return redirect_atividades_cenario(atv)
 
 
 @app.route(
@@ -1825,10 +2034,9 @@ def delete_cenario(projeto_id, fase_id, cenario_id):
     if not is_project_member(projeto_id):
         abort(403)
     Fase.query.filter_by(id=fase_id, projeto_id=projeto_id).first_or_404()
-    c = Cenario.query.filter_by(id=cenario_id, fase_id=fase_id).first_or_404()
+    Cenario.query.filter_by(id=cenario_id, fase_id=fase_id).first_or_404()
     # remover atividades vinculadas
-    Atividade.query.filter_by(cenario_id=cenario_id).delete()
-    db.session.delete(c)
+    deletion.excluir_cenario(cenario_id)
     db.session.commit()
     flash("Cenário excluído", "success")
     return redirect(url_for("cenarios_por_fase", projeto_id=projeto_id, fase_id=fase_id))
@@ -1837,89 +2045,50 @@ def delete_cenario(projeto_id, fase_id, cenario_id):
 @app.route("/concluir/<int:atividade_id>", methods=["POST"])
 @login_required
 def concluir_atividade(atividade_id):
-    atv = Atividade.query.get_or_404(atividade_id)
-    cenario = Cenario.query.get(atv.cenario_id) if atv.cenario_id else None
-    fase = get_fase_for_cenario_or_none(cenario) if cenario else None
-
-    def redirect_cenario():
-        if cenario and fase:
-            return redirect(
-                url_for(
-                    "atividades_por_cenario",
-                    projeto_id=fase.projeto_id,
-                    fase_id=fase.id,
-                    cenario_id=cenario.id,
-                )
-            )
-        return redirect(url_for("projetos"))
+    atv = get_atividade_autorizada_or_404(atividade_id)
 
     # Verificar se tem permissão para concluir qualquer atividade
-    pode_concluir_qualquer = has_permission(fase.projeto_id, 'pode_concluir_qualquer_atividade')
+    pode_concluir_qualquer = has_permission(atv.projeto_id, 'pode_concluir_qualquer_atividade')
     
     if not pode_concluir_qualquer:
         # Segurança: apenas o responsável pode concluir
-        if atv.responsavel != current_user.username:
+        if atv.responsavel_id != current_user.id:
             flash("Apenas o responsável pode concluir esta atividade", "error")
-            return redirect_cenario()
+            return redirect_atividades_cenario(atv)
 
         # Deve estar liberada
         if not atv.data_liberacao:
             flash("Atividade ainda não está liberada")
-            return redirect_cenario()
+            return redirect_atividades_cenario(atv)
 
-    atv.data_conclusao = datetime.now()
+    if atv.data_conclusao:
+        flash("Atividade já está concluída", "error")
+        return redirect_atividades_cenario(atv)
+
+    liberadas = dependencias.concluir(atv)
     db.session.commit()
     flash("Atividade concluída com sucesso")
+    for prox in liberadas:
+        flash(f"Próxima atividade '{prox.descricao}' liberada")
 
-    # Liberar automaticamente a próxima atividade (mesmo cenário, próximo número sequencial)
-    if atv.cenario_id is not None:
-        prox = (
-            Atividade.query
-            .filter(Atividade.cenario_id == atv.cenario_id)
-            .filter(Atividade.numero_sequencial > atv.numero_sequencial)
-            .order_by(Atividade.numero_sequencial)
-            .first()
-        )
-        if prox and not prox.data_liberacao:
-            prox.data_liberacao = datetime.now()
-            db.session.commit()
-            flash(f"Próxima atividade '{prox.descricao}' liberada")
-
-        return redirect_cenario()
-
-    return redirect(url_for("projetos"))
+    return redirect_atividades_cenario(atv)
 
 
 @app.route("/reabrir/<int:atividade_id>", methods=["POST"])
 @login_required
 def reabrir_atividade(atividade_id):
-    atv = Atividade.query.get_or_404(atividade_id)
-    cenario = Cenario.query.get(atv.cenario_id) if atv.cenario_id else None
-    fase = get_fase_for_cenario_or_none(cenario) if cenario else None
-
-    def redirect_cenario():
-        if cenario and fase:
-            return redirect(
-                url_for(
-                    "atividades_por_cenario",
-                    projeto_id=fase.projeto_id,
-                    fase_id=fase.id,
-                    cenario_id=cenario.id,
-                )
-            )
-        return redirect(url_for("projetos"))
+    atv = get_atividade_autorizada_or_404(atividade_id)
 
     # Verificar se tem permissão de administrador
-    if not has_permission(fase.projeto_id, 'pode_concluir_qualquer_atividade'):
+    if not has_permission(atv.projeto_id, 'pode_concluir_qualquer_atividade'):
         flash("Apenas administradores podem reabrir atividades", "error")
-        return redirect_cenario()
+        return redirect_atividades_cenario(atv)
     
-    if atv.data_conclusao:
-        atv.data_conclusao = None
+    if dependencias.reabrir(atv):
         db.session.commit()
         flash("Atividade reaberta com sucesso", "success")
     
-    return redirect_cenario()
+    return redirect_atividades_cenario(atv)
 
 
 # ------------------------------------------------------------------------------
@@ -1940,7 +2109,7 @@ def gerenciar_acessos(projeto_id):
         user_id = request.form.get("user_id")
         perfil_id = request.form.get("perfil_id")
         
-        if user_id and perfil_id:
+        if user_id and perfil_id and permissoes.perfil_disponivel(projeto_id, int(perfil_id)):
             # Verificar se o usuário já não é membro
             membro_existente = ProjetoMembro.query.filter_by(projeto_id=projeto_id, user_id=int(user_id)).first()
             if membro_existente:
@@ -1978,25 +2147,8 @@ def gerenciar_acessos(projeto_id):
             novo_perfil = Perfil(
                 nome=nome_perfil,
                 projeto_id=projeto_id,
-                pode_criar_atividade=request.form.get("pode_criar_atividade") == "on",
-                pode_editar_atividade=request.form.get("pode_editar_atividade") == "on",
-                pode_excluir_atividade=request.form.get("pode_excluir_atividade") == "on",
-                pode_concluir_qualquer_atividade=request.form.get("pode_concluir_qualquer_atividade") == "on",
-                pode_editar_projeto=request.form.get("pode_editar_projeto") == "on",
-                pode_gerenciar_membros=request.form.get("pode_gerenciar_membros") == "on",
-                pode_criar_licao=request.form.get("pode_criar_licao") == "on",
-                pode_editar_licao=request.form.get("pode_editar_licao") == "on",
-                pode_excluir_licao=request.form.get("pode_excluir_licao") == "on",
-                pode_criar_mudanca=request.form.get("pode_criar_mudanca") == "on",
-                pode_editar_mudanca=request.form.get("pode_editar_mudanca") == "on",
-                pode_excluir_mudanca=request.form.get("pode_excluir_mudanca") == "on",
-                pode_criar_incidente=request.form.get("pode_criar_incidente") == "on",
-                pode_editar_incidente=request.form.get("pode_editar_incidente") == "on",
-                pode_excluir_incidente=request.form.get("pode_excluir_incidente") == "on",
-                pode_criar_risco=request.form.get("pode_criar_risco") == "on",
-                pode_editar_risco=request.form.get("pode_editar_risco") == "on",
-                pode_excluir_risco=request.form.get("pode_excluir_risco") == "on",
-                is_default=False
+                is_default=False,
+                **{p: request.form.get(p) == "on" for p in PERMISSOES},
             )
             db.session.add(novo_perfil)
             db.session.commit()
@@ -2007,7 +2159,8 @@ def gerenciar_acessos(projeto_id):
     if request.method == "POST" and request.form.get("action") == "atribuir_perfil":
         membro_id = request.form.get("membro_id")
         perfil_id = request.form.get("perfil_id")
-        if membro_id and perfil_id:
+        membro = ProjetoMembro.query.get(int(membro_id)) if membro_id else None
+        if membro and membro.projeto_id == projeto_id and perfil_id and permissoes.perfil_disponivel(projeto_id, int(perfil_id)):
             # Remover perfil anterior
             MembroPerfil.query.filter_by(projeto_membro_id=int(membro_id)).delete()
             # Adicionar novo perfil
@@ -2020,25 +2173,16 @@ def gerenciar_acessos(projeto_id):
     if request.method == "POST" and request.form.get("action") == "editar_perfil":
         perfil_id = request.form.get("perfil_id")
         perfil = Perfil.query.get(perfil_id)
-        if perfil and perfil.projeto_id == projeto_id and not perfil.is_default:
-            perfil.pode_criar_atividade = request.form.get("pode_criar_atividade") == "on"
-            perfil.pode_editar_atividade = request.form.get("pode_editar_atividade") == "on"
-            perfil.pode_excluir_atividade = request.form.get("pode_excluir_atividade") == "on"
-            perfil.pode_concluir_qualquer_atividade = request.form.get("pode_concluir_qualquer_atividade") == "on"
-            perfil.pode_editar_projeto = request.form.get("pode_editar_projeto") == "on"
-            perfil.pode_gerenciar_membros = request.form.get("pode_gerenciar_membros") == "on"
-            perfil.pode_criar_licao = request.form.get("pode_criar_licao") == "on"
-            perfil.pode_editar_licao = request.form.get("pode_editar_licao") == "on"
-            perfil.pode_excluir_licao = request.form.get("pode_excluir_licao") == "on"
-            perfil.pode_criar_mudanca = request.form.get("pode_criar_mudanca") == "on"
-            perfil.pode_editar_mudanca = request.form.get("pode_editar_mudanca") == "on"
-            perfil.pode_excluir_mudanca = request.form.get("pode_excluir_mudanca") == "on"
-            perfil.pode_criar_incidente = request.form.get("pode_criar_incidente") == "on"
-            perfil.pode_editar_incidente = request.form.get("pode_editar_incidente") == "on"
-            perfil.pode_excluir_incidente = request.form.get("pode_excluir_incidente") == "on"
-            perfil.pode_criar_risco = request.form.get("pode_criar_risco") == "on"
-            perfil.pode_editar_risco = request.form.get("pode_editar_risco") == "on"
-            perfil.pode_excluir_risco = request.form.get("pode_excluir_risco") == "on"
+        valores = {p: request.form.get(p) == "on" for p in PERMISSOES}
+        if perfil and perfil.projeto_id == projeto_id:
+            for permissao, valor in valores.items():
+                setattr(perfil, permissao, valor)
+        elif perfil and perfil.projeto_id is None and not perfil.acesso_total:
+            # Modelo global: a alteração vale só para este projeto
+            permissoes.sobrescrever_modelo(projeto_id, perfil, valores)
+        else:
+            perfil = None
+        if perfil:
             db.session.commit()
             flash("Perfil atualizado com sucesso", "success")
         return redirect(url_for("gerenciar_acessos", projeto_id=projeto_id))
@@ -2047,19 +2191,23 @@ def gerenciar_acessos(projeto_id):
     if request.method == "POST" and request.form.get("action") == "excluir_perfil":
         perfil_id = request.form.get("perfil_id")
         perfil = Perfil.query.get(perfil_id)
-        if perfil and perfil.projeto_id == projeto_id and not perfil.is_default:
+        if perfil and perfil.projeto_id == projeto_id and perfil.modelo_id is not None:
+            # Personalização de um modelo global: volta ao padrão
+            permissoes.restaurar_modelo(perfil)
+            db.session.commit()
+            flash("Perfil restaurado para o padrão", "success")
+        elif perfil and perfil.projeto_id == projeto_id:
             # Transferir membros para perfil Membro padrão
-            perfil_membro_default = Perfil.query.filter_by(projeto_id=projeto_id, nome="Membro", is_default=True).first()
-            if perfil_membro_default:
-                for mp in perfil.membros:
-                    mp.perfil_id = perfil_membro_default.id
+            perfil_membro_default = permissoes.perfil_padrao(projeto_id, "Membro")
+            for mp in perfil.membros:
+                mp.perfil_id = perfil_membro_default
             db.session.delete(perfil)
             db.session.commit()
             flash("Perfil excluído com sucesso", "success")
         return redirect(url_for("gerenciar_acessos", projeto_id=projeto_id))
     
     # Obter dados
-    perfis = Perfil.query.filter_by(projeto_id=projeto_id).all()
+    perfis = permissoes.perfis_do_projeto(projeto_id)
     membros = ProjetoMembro.query.filter_by(projeto_id=projeto_id).all()
     
     # Criar dicionário de perfis por membro
@@ -2130,7 +2278,7 @@ def licoes_aprendidas(projeto_id):
         
         licao_id = request.form.get("licao_id")
         licao = LicaoAprendida.query.get(licao_id)
-        if licao and licao.projeto_id == projeto_id:
+        if licao and licao.projeto_id == projeto_id and versao_do_form_confere(licao):
             licao.fase_id = request.form.get("fase_id") if request.form.get("fase_id") else None
             licao.categoria = request.form.get("categoria")
             licao.tipo = request.form.get("tipo")
@@ -2160,7 +2308,7 @@ def licoes_aprendidas(projeto_id):
         return redirect(url_for("licoes_aprendidas", projeto_id=projeto_id))
     
     # Obter dados
-    licoes = LicaoAprendida.query.filter_by(projeto_id=projeto_id).order_by(LicaoAprendida.data_registro.desc()).all()
+    licoes = LicaoAprendida.query.options(joinedload(LicaoAprendida.responsavel_user)).filter_by(projeto_id=projeto_id).order_by(LicaoAprendida.data_registro.desc()).all()
     fases = Fase.query.filter_by(projeto_id=projeto_id).all()
     
     pode_criar = has_permission(projeto_id, "pode_criar_licao")
@@ -2181,6 +2329,162 @@ def licoes_aprendidas(projeto_id):
     )
 
 
+LICOES_BUSCA_POR_PAGINA = 20
+LICOES_BUSCA_POR_PAGINA_MAX = 100
+
+
+@app.route("/licoes/busca.json")
+@login_required
+def buscar_licoes_json():
+    """Busca textual nas lições de todos os projetos visíveis ao usuário (?q=&pagina=)"""
+    termo = request.args.get("q", "").strip()
+    pagina = max(1, request.args.get("pagina", 1, type=int))
+    por_pagina = min(
+        LICOES_BUSCA_POR_PAGINA_MAX,
+        max(1, request.args.get("por_pagina", LICOES_BUSCA_POR_PAGINA, type=int)),
+    )
+    resultados, tem_proxima = busca.buscar_licoes(termo, current_user.id, pagina, por_pagina)
+    return {
+        "q": termo,
+        "pagina": pagina,
+        "por_pagina": por_pagina,
+        "proxima_pagina": pagina + 1 if tem_proxima else None,
+        "licoes": resultados,
+    }
+
+
+@app.route("/projetos/<int:projeto_id>/historico.json")
+@login_required
+def historico_json(projeto_id):
+    """Trilha de auditoria de um registro do projeto (?entidade=&id=)"""
+    if not is_project_member(projeto_id):
+        abort(403)
+    entidade = request.args.get("entidade")
+    registro_id = request.args.get("id", type=int)
+    if entidade not in auditoria.MODELO_DA_ENTIDADE:
+        return {"erro": "Entidade inválida"}, 400
+    if registro_id is None:
+        return {"erro": "Informe o id do registro"}, 400
+    return {
+        "entidade": entidade,
+        "id": registro_id,
+        "historico": auditoria.historico(entidade, registro_id, projeto_id),
+    }
+
+
+@app.route("/projetos/<int:projeto_id>/<any(incidentes, riscos, mudancas, licoes):tipo>/<int:registro_id>", methods=["PATCH"])
+@login_required
+def editar_registro_json(projeto_id, tipo, registro_id):
+    """
+    Edição parcial de um registro. Corpo JSON {"versao": <versão lida>, campo: valor, ...}:
+    grava só os campos enviados que mudaram. 409 com o registro atual se a versão não confere.
+    """
+    if not is_project_member(projeto_id):
+        abort(403)
+    modelo, permissao, _ = edicao.REGISTROS[tipo]
+    if permissao and not has_permission(projeto_id, permissao):
+        abort(403)
+    dados = request.get_json(silent=True)
+    if not isinstance(dados, dict):
+        return {"erro": "Envie um objeto JSON"}, 400
+    valores = dict(dados)
+    versao = valores.pop("versao", None)
+    if not isinstance(versao, int) or isinstance(versao, bool):
+        return {"erro": "Informe a versao do registro que está sendo editado"}, 400
+    registro = modelo.query.filter_by(id=registro_id, projeto_id=projeto_id).first_or_404()
+    try:
+        alterados = edicao.aplicar(tipo, registro, versao, valores)
+        if alterados:
+            db.session.commit()
+    except edicao.CampoInvalido as e:
+        db.session.rollback()
+        return {"erro": str(e)}, 400
+    except (edicao.Conflito, StaleDataError):
+        db.session.rollback()
+        registro = modelo.query.filter_by(id=registro_id, projeto_id=projeto_id).first_or_404()
+        return {
+            "erro": "O registro foi alterado por outro usuário",
+            "atual": edicao.serializar(tipo, registro),
+        }, 409
+    return {"registro": edicao.serializar(tipo, registro), "alterados": alterados}
+
+
+BUSCA_POR_TIPO_MAX = 50
+
+
+def url_do_resultado(projeto_id, tipo, registro_id, atividades):
+    """Página onde o registro encontrado aparece"""
+    if tipo == "atividade":
+        atividade = atividades.get(registro_id)
+        if atividade is None or atividade.cenario is None:
+            return url_for("fluxo", projeto_id=projeto_id)
+        return url_for("fluxo", projeto_id=projeto_id, fase=atividade.cenario.fase_id, cenario=atividade.cenario_id)
+    endpoint = {
+        "incidente": "incidentes",
+        "risco": "riscos",
+        "mudanca": "solicitacoes_mudanca",
+        "licao": "licoes_aprendidas",
+    }[tipo]
+    return url_for(endpoint, projeto_id=projeto_id)
+
+
+@app.route("/projetos/<int:projeto_id>/busca.json")
+@login_required
+def buscar_no_projeto_json(projeto_id):
+    """Busca em todos os registros do projeto, agrupada por tipo (?q=&tipo=&pagina=&por_tipo=)"""
+    if not is_project_member(projeto_id):
+        abort(403)
+    termo = request.args.get("q", "").strip()
+    tipo = request.args.get("tipo") or None
+    if tipo is not None and tipo not in busca.REGISTROS:
+        return {"erro": "Tipo inválido"}, 400
+    pagina = max(1, request.args.get("pagina", 1, type=int))
+    por_tipo = min(BUSCA_POR_TIPO_MAX, max(1, request.args.get("por_tipo", busca.POR_TIPO, type=int)))
+
+    grupos = busca.buscar_no_projeto(projeto_id, termo, tipo, pagina, por_tipo)
+    atividade_ids = [item["registro_id"] for item in grupos.get("atividade", {}).get("itens", [])]
+    atividades = {
+        a.id: a
+        for a in Atividade.query.options(joinedload(Atividade.cenario)).filter(Atividade.id.in_(atividade_ids))
+    } if atividade_ids else {}
+    for tipo_grupo, grupo in grupos.items():
+        for item in grupo["itens"]:
+            item["url"] = url_do_resultado(projeto_id, tipo_grupo, item["registro_id"], atividades)
+    return {
+        "q": termo,
+        "pagina": pagina,
+        "por_tipo": por_tipo,
+        # Ordem fixa dos grupos na tela
+        "grupos": [{"tipo": t, **grupos[t]} for t in busca.REGISTROS if t in grupos],
+    }
+
+
+@app.route("/projetos/<int:projeto_id>/similares.json")
+@login_required
+def similares_json(projeto_id):
+    """Possíveis duplicados do texto digitado (?tipo=incidente|licao&texto=&ignorar=id)"""
+    if not is_project_member(projeto_id):
+        abort(403)
+    tipo = request.args.get("tipo")
+    if tipo not in similares.TIPOS:
+        return {"erro": "Tipo inválido"}, 400
+    sugestoes = similares.sugerir(
+        tipo, projeto_id, request.args.get("texto", ""), request.args.get("ignorar", type=int)
+    )
+    return {
+        "tipo": tipo,
+        "similares": [
+            {
+                "id": registro.id,
+                "descricao": registro.descricao,
+                "status": registro.status,
+                "similaridade": round(pontos, 2),
+            }
+            for registro, pontos in sugestoes
+        ],
+    }
+
+
 @app.route("/projetos/<int:projeto_id>/mudancas", methods=["GET", "POST"])
 @login_required
 def solicitacoes_mudanca(projeto_id):
@@ -2250,7 +2554,7 @@ def solicitacoes_mudanca(projeto_id):
         
         mudanca_id = request.form.get("mudanca_id")
         solicitacao = SolicitacaoMudanca.query.get(mudanca_id)
-        if solicitacao and solicitacao.projeto_id == projeto_id:
+        if solicitacao and solicitacao.projeto_id == projeto_id and versao_do_form_confere(solicitacao):
             solicitacao.solicitante = request.form.get("solicitante")
             solicitacao.area_solicitante = request.form.get("area_solicitante")
             solicitacao.descricao = request.form.get("descricao")
@@ -2339,7 +2643,6 @@ def incidentes(projeto_id):
             projeto_id=projeto_id,
             atividade_id=int(atividade_id) if atividade_id else None,
             descricao=request.form.get("descricao"),
-            acompanhamento=request.form.get("acompanhamento"),
             responsavel=request.form.get("responsavel"),
             prioridade=request.form.get("prioridade"),
             status=request.form.get("status", "Criado"),
@@ -2347,6 +2650,8 @@ def incidentes(projeto_id):
             previsao_revisada=previsao_revisada
         )
         db.session.add(incidente)
+        if not adicionar_acompanhamento_do_form("incidente", incidente):
+            return redirect(url_for("incidentes", projeto_id=projeto_id))
         db.session.commit()
         flash("Incidente criado com sucesso", "success")
         return redirect(url_for("incidentes", projeto_id=projeto_id))
@@ -2362,18 +2667,18 @@ def incidentes(projeto_id):
         
         incidente_id = request.form.get("incidente_id")
         incidente = Incidente.query.get(incidente_id)
-        if incidente and incidente.projeto_id == projeto_id:
+        if incidente and incidente.projeto_id == projeto_id and versao_do_form_confere(incidente):
             atividade_id = request.form.get("atividade_id")
             incidente.atividade_id = int(atividade_id) if atividade_id else None
             incidente.descricao = request.form.get("descricao")
-            incidente.acompanhamento = request.form.get("acompanhamento")
             incidente.responsavel = request.form.get("responsavel")
             incidente.prioridade = request.form.get("prioridade")
             incidente.status = request.form.get("status")
             incidente.previsao_original = previsao_original
             incidente.previsao_revisada = previsao_revisada
             incidente.conclusao = conclusao
-            incidente.data_ultima_modificacao = datetime.utcnow()
+            if not adicionar_acompanhamento_do_form("incidente", incidente):
+                return redirect(url_for("incidentes", projeto_id=projeto_id))
             db.session.commit()
             flash("Incidente atualizado com sucesso", "success")
         return redirect(url_for("incidentes", projeto_id=projeto_id))
@@ -2389,7 +2694,7 @@ def incidentes(projeto_id):
         return redirect(url_for("incidentes", projeto_id=projeto_id))
     
     # Obter dados
-    incidentes_list = Incidente.query.filter_by(projeto_id=projeto_id).order_by(Incidente.data_criacao.desc()).all()
+    incidentes_list = Incidente.query.options(joinedload(Incidente.responsavel_user), defer(Incidente.acompanhamento)).filter_by(projeto_id=projeto_id).order_by(Incidente.data_criacao.desc()).all()
     
     # Obter todas as atividades do projeto para poder fazer link
     atividades = Atividade.query.filter(
@@ -2417,10 +2722,102 @@ def incidentes(projeto_id):
         pode_editar=pode_editar,
         pode_excluir=pode_excluir,
         pode_gerenciar_membros=pode_gerenciar_membros,
+        sla=sla.relatorio(projeto_id),
+        ultimos_acompanhamentos=acompanhamentos.ultimas(projeto_id, "incidente"),
         usuario_atual=current_user.username
     )
 
 
+@app.route("/projetos/<int:projeto_id>/incidentes/sla.json")
+@login_required
+def incidentes_sla_json(projeto_id):
+    """Indicadores de SLA do projeto: resolução e espera em Aguardando Externo (média e p90, em horas)"""
+    if not is_project_member(projeto_id):
+        abort(403)
+    return sla.relatorio(projeto_id)
+
+
+@app.route("/projetos/<int:projeto_id>/incidentes/<int:incidente_id>/status.json")
+@login_required
+def incidente_status_json(projeto_id, incidente_id):
+    """Mudanças de status do incidente, com o tempo passado em cada status"""
+    if not is_project_member(projeto_id):
+        abort(403)
+    return {"incidente_id": incidente_id, "transicoes": sla.transicoes(incidente_id, projeto_id)}
+
+
+def adicionar_acompanhamento_do_form(entidade, registro):
+    """Campo acompanhamento dos formulários de criar/editar vira uma nota. False (com flash) se inválido"""
+    texto = request.form.get("acompanhamento", "").strip()
+    if not texto:
+        return True
+    try:
+        acompanhamentos.adicionar(entidade, registro, texto, current_user.id)
+    except acompanhamentos.NotaInvalida as e:
+        db.session.rollback()
+        flash(str(e), "danger")
+        return False
+    return True
+
+
+@app.route("/projetos/<int:projeto_id>/acompanhamentos.json")
+@login_required
+def acompanhamentos_json(projeto_id):
+    """Linha do tempo de um incidente/risco, mais novas primeiro (?entidade=&id=&antes=&por_pagina=)"""
+    if not is_project_member(projeto_id):
+        abort(403)
+    entidade = request.args.get("entidade")
+    registro_id = request.args.get("id", type=int)
+    if entidade not in acompanhamentos.ENTIDADES or registro_id is None:
+        return {"erro": "Informe entidade (incidente ou risco) e id"}, 400
+    por_pagina = min(
+        acompanhamentos.POR_PAGINA_MAX,
+        max(1, request.args.get("por_pagina", acompanhamentos.POR_PAGINA, type=int)),
+    )
+    notas, proxima = acompanhamentos.listar(
+        projeto_id, entidade, registro_id, request.args.get("antes", type=int), por_pagina
+    )
+    return {"entidade": entidade, "id": registro_id, "acompanhamentos": notas, "antes": proxima}
+
+
+@app.route("/projetos/<int:projeto_id>/acompanhamentos", methods=["POST"])
+@login_required
+def adicionar_acompanhamento(projeto_id):
+    """Nova nota na linha do tempo. Corpo JSON (ou formulário) {"entidade", "id", "texto"}"""
+    if not is_project_member(projeto_id):
+        abort(403)
+    dados = request.get_json(silent=True) or request.form
+    entidade = dados.get("entidade")
+    registro_id = str(dados.get("id", ""))
+    if entidade not in acompanhamentos.ENTIDADES or not registro_id.isdigit():
+        return {"erro": "Informe entidade (incidente ou risco) e id"}, 400
+    registro = (
+        acompanhamentos.ENTIDADES[entidade].query.filter_by(id=int(registro_id), projeto_id=projeto_id).first_or_404()
+    )
+    try:
+        nota = acompanhamentos.adicionar(entidade, registro, dados.get("texto"), current_user.id)
+        db.session.commit()
+    except acompanhamentos.NotaInvalida as e:
+        db.session.rollback()
+        return {"erro": str(e)}, 400
+    return {
+        "id": nota.id,
+        "criado_em": nota.criado_em.isoformat(timespec="seconds"),
+        "autor": current_user.username,
+        "texto": nota.texto,
+    }
+
+
+# Escala de impacto e de probabilidade dos riscos (score = impacto * probabilidade)
+NOTAS_RISCO = (1, 2, 3, 4, 5)
+
+# Ordenações da lista de riscos (?ordem=)
+ORDEM_RISCOS = {
+    "data": (Risco.data_criacao.desc(),),
+    "score": (Risco.score.desc().nulls_last(), Risco.data_criacao.desc()),
+}
+
+
 @app.route("/projetos/<int:projeto_id>/riscos", methods=["GET", "POST"])
 @login_required
 def riscos(projeto_id):
@@ -2443,11 +2840,26 @@ def riscos(projeto_id):
             flash(f"Data invalida em {label}. Use o formato AAAA-MM-DD.", "danger")
             return invalid_date
 
+    def parse_nota_field(field_name, label):
+        value = request.form.get(field_name)
+        if not value:
+            return None
+        try:
+            nota = int(value)
+        except ValueError:
+            nota = None
+        if nota not in NOTAS_RISCO:
+            flash(f"{label} invalido. Use um valor de 1 a 5.", "danger")
+            return invalid_date
+        return nota
+
     # Criar risco
     if request.method == "POST" and request.form.get("action") == "criar":
         data_proxima_acao = parse_date_field("data_proxima_acao", "Data Proxima acao")
         data_conclusao = parse_date_field("data_conclusao", "Data Conclusao")
-        if data_proxima_acao is invalid_date or data_conclusao is invalid_date:
+        impacto = parse_nota_field("impacto", "Impacto")
+        probabilidade = parse_nota_field("probabilidade", "Probabilidade")
+        if invalid_date in (data_proxima_acao, data_conclusao, impacto, probabilidade):
             return redirect(url_for("riscos", projeto_id=projeto_id))
 
         risco = Risco(
@@ -2456,22 +2868,24 @@ def riscos(projeto_id):
             tipo_risco=request.form.get("tipo_risco"),
             risco=request.form.get("risco"),
             criado_por=current_user.username,
+            criado_por_id=current_user.id,
             responsavel=request.form.get("responsavel"),
             gatilho=request.form.get("gatilho"),
             impacto_projeto=request.form.get("impacto_projeto"),
             consequencia=request.form.get("consequencia"),
-            impacto=request.form.get("impacto"),
-            probabilidade=request.form.get("probabilidade"),
+            impacto=impacto,
+            probabilidade=probabilidade,
             nivel_risco=request.form.get("nivel_risco"),
             estrategia=request.form.get("estrategia"),
             prevencao=request.form.get("prevencao"),
             contingencia=request.form.get("contingencia"),
-            acompanhamento=request.form.get("acompanhamento"),
             status=request.form.get("status"),
             data_proxima_acao=data_proxima_acao,
             data_conclusao=data_conclusao,
         )
         db.session.add(risco)
+        if not adicionar_acompanhamento_do_form("risco", risco):
+            return redirect(url_for("riscos", projeto_id=projeto_id))
         db.session.commit()
         flash("Risco criado com sucesso", "success")
         return redirect(url_for("riscos", projeto_id=projeto_id))
@@ -2480,12 +2894,14 @@ def riscos(projeto_id):
     if request.method == "POST" and request.form.get("action") == "editar":
         data_proxima_acao = parse_date_field("data_proxima_acao", "Data Proxima acao")
         data_conclusao = parse_date_field("data_conclusao", "Data Conclusao")
-        if data_proxima_acao is invalid_date or data_conclusao is invalid_date:
+        impacto = parse_nota_field("impacto", "Impacto")
+        probabilidade = parse_nota_field("probabilidade", "Probabilidade")
+        if invalid_date in (data_proxima_acao, data_conclusao, impacto, probabilidade):
             return redirect(url_for("riscos", projeto_id=projeto_id))
 
         risco_id = request.form.get("risco_id")
         risco = Risco.query.get(risco_id)
-        if risco and risco.projeto_id == projeto_id:
+        if risco and risco.projeto_id == projeto_id and versao_do_form_confere(risco):
             risco.area = request.form.get("area")
             risco.tipo_risco = request.form.get("tipo_risco")
             risco.risco = request.form.get("risco")
@@ -2493,16 +2909,17 @@ def riscos(projeto_id):
             risco.gatilho = request.form.get("gatilho")
             risco.impacto_projeto = request.form.get("impacto_projeto")
             risco.consequencia = request.form.get("consequencia")
-            risco.impacto = request.form.get("impacto")
-            risco.probabilidade = request.form.get("probabilidade")
+            risco.impacto = impacto
+            risco.probabilidade = probabilidade
             risco.nivel_risco = request.form.get("nivel_risco")
             risco.estrategia = request.form.get("estrategia")
             risco.prevencao = request.form.get("prevencao")
             risco.contingencia = request.form.get("contingencia")
-            risco.acompanhamento = request.form.get("acompanhamento")
             risco.status = request.form.get("status")
             risco.data_proxima_acao = data_proxima_acao
             risco.data_conclusao = data_conclusao
+            if not adicionar_acompanhamento_do_form("risco", risco):
+                return redirect(url_for("riscos", projeto_id=projeto_id))
             db.session.commit()
             flash("Risco atualizado com sucesso", "success")
         return redirect(url_for("riscos", projeto_id=projeto_id))
@@ -2517,7 +2934,15 @@ def riscos(projeto_id):
             flash("Risco excluido com sucesso", "success")
         return redirect(url_for("riscos", projeto_id=projeto_id))
 
-    riscos_list = Risco.query.filter_by(projeto_id=projeto_id).order_by(Risco.data_criacao.desc()).all()
+    ordem = request.args.get("ordem")
+    if ordem not in ORDEM_RISCOS:
+        ordem = "data"
+    riscos_list = (
+        Risco.query.options(joinedload(Risco.responsavel_user), defer(Risco.acompanhamento))
+        .filter_by(projeto_id=projeto_id)
+        .order_by(*ORDEM_RISCOS[ordem])
+        .all()
+    )
 
     # Qualquer membro do projeto pode criar/editar/excluir riscos
     pode_criar = True
@@ -2529,14 +2954,51 @@ def riscos(projeto_id):
         "riscos.html",
         projeto=projeto,
         riscos=riscos_list,
+        ordem=ordem,
         pode_criar=pode_criar,
         pode_editar=pode_editar,
         pode_excluir=pode_excluir,
         pode_gerenciar_membros=pode_gerenciar_membros,
+        ultimos_acompanhamentos=acompanhamentos.ultimas(projeto_id, "risco"),
         usuario_atual=current_user.username,
     )
 
 
+@app.route("/projetos/<int:projeto_id>/riscos/mapa.json")
+@login_required
+def riscos_mapa_json(projeto_id):
+    """
+    Mapa de calor impacto x probabilidade: um GROUP BY no banco.
+    celulas[p - 1][i - 1] = riscos com probabilidade p e impacto i;
+    ?abertos=1 ignora os concluídos.
+    """
+    if not is_project_member(projeto_id):
+        abort(403)
+    filtro = [Risco.projeto_id == projeto_id]
+    if request.args.get("abertos") == "1":
+        filtro.append(func.coalesce(Risco.status, "") != "Concluido")
+    linhas = (
+        db.session.query(Risco.probabilidade, Risco.impacto, func.count(Risco.id))
+        .filter(*filtro)
+        .group_by(Risco.probabilidade, Risco.impacto)
+        .all()
+    )
+
+    celulas = [[0] * len(NOTAS_RISCO) for _ in NOTAS_RISCO]
+    sem_nota = 0
+    for probabilidade, impacto, quantidade in linhas:
+        if probabilidade in NOTAS_RISCO and impacto in NOTAS_RISCO:
+            celulas[probabilidade - 1][impacto - 1] = quantidade
+        else:
+            sem_nota += quantidade
+    return {
+        "notas": list(NOTAS_RISCO),
+        "celulas": celulas,
+        "total": sum(quantidade for _, _, quantidade in linhas),
+        "sem_nota": sem_nota,
+    }
+
+
 # Listas constantes para status e prioridade
 LISTA_STATUS_INCIDENTE = [
     "Criado",
@@ -2562,4 +3024,4 @@ LISTA_PRIORIDADE_INCIDENTE = [
 # ------------------------------------------------------------------------------
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080))
-    app.run(host="0.0.0.0", port=port)
+    create_app().run(host="0.0.0.0", port=port)
@@ -0,0 +1,195 @@
+"""
+Logging estruturado da aplicação.
+
+- Cada linha é um objeto JSON compatível com o Cloud Logging (campo "severity").
+- A escrita em stdout acontece numa thread separada (QueueHandler/QueueListener),
+  então a thread da requisição nunca bloqueia em I/O de log.
+- Cada requisição recebe um request_id (X-Request-ID, X-Cloud-Trace-Context ou
+  gerado), anexado a todas as linhas emitidas durante a requisição.
+- DEBUG fica desligado por padrão; use LOG_LEVEL=DEBUG para ativar.
+  Use sempre logger.debug("... %s", valor) para não formatar quando desligado.
+
+Variáveis de ambiente:
+    LOG_LEVEL   DEBUG, INFO (padrão), WARNING, ERROR
+    LOG_FORMAT  json (padrão) ou text (mais legível em desenvolvimento local)
+"""
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import uuid
+from datetime import datetime, timezone
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+_listener = None
+
+# Atributos padrão de LogRecord; o resto vem de extra={...} e vai para o JSON
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message",
+    "request_id",
+}
+
+
+def get_request_id():
+    return _request_id.get()
+
+
+class JsonFormatter(logging.Formatter):
+    """Formata o registro como uma linha JSON no formato do Cloud Logging"""
+
+    def __init__(self, gcp_project=None):
+        super().__init__()
+        self.gcp_project = gcp_project
+
+    def format(self, record):
+        payload = {
+            "severity": record.levelname,
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            payload["request_id"] = request_id
+            if self.gcp_project:
+                payload["logging.googleapis.com/trace"] = (
+                    f"projects/{self.gcp_project}/traces/{request_id}"
+                )
+
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                payload[key] = value
+
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exception"] = record.exc_text
+
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(name)s] [%(request_id)s] %(message)s")
+
+    def format(self, record):
+        if not getattr(record, "request_id", None):
+            record.request_id = "-"
+        return super().format(record)
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que captura o request_id na thread da requisição
+    (o contextvar não existe na thread do listener) e mantém os campos
+    estruturados para o formatter final.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.request_id = _request_id.get()
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging(level=None, fmt=None):
+    """
+    Configura o root logger. Idempotente: chamadas seguintes só ajustam o nível.
+    """
+    global _listener
+
+    level_name = (level or os.environ.get("LOG_LEVEL", "INFO")).upper()
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, level_name, logging.INFO))
+
+    if _listener is not None:
+        return
+
+    fmt = (fmt or os.environ.get("LOG_FORMAT", "json")).lower()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if fmt == "text":
+        stream_handler.setFormatter(TextFormatter())
+    else:
+        stream_handler.setFormatter(JsonFormatter(os.environ.get("GCP_PROJECT")))
+
+    log_queue = queue.SimpleQueue()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(ContextQueueHandler(log_queue))
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def _restart_after_fork():
+    """
+    A thread do listener não sobrevive ao fork (gunicorn com preload_app):
+    o processo filho recria a fila e o listener com os mesmos handlers.
+    """
+    global _listener
+    if _listener is None:
+        return
+    log_queue = queue.SimpleQueue()
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, ContextQueueHandler):
+            handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    """Esvazia a fila de logs (chamado no atexit e antes de fork)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _incoming_request_id(headers):
+    request_id = headers.get("X-Request-ID")
+    if request_id:
+        return request_id[:64]
+    # Cloud Run: "TRACE_ID/SPAN_ID;o=1"
+    trace = headers.get("X-Cloud-Trace-Context")
+    if trace:
+        return trace.split("/", 1)[0]
+    return uuid.uuid4().hex
+
+
+def init_request_logging(app):
+    """Registra hooks que atribuem um request_id a cada requisição"""
+    from flask import g, request
+
+    @app.before_request
+    def _bind_request_id():
+        request_id = _incoming_request_id(request.headers)
+        g.request_id = request_id
+        g._request_id_token = _request_id.set(request_id)
+
+    @app.after_request
+    def _expose_request_id(response):
+        request_id = g.get("request_id")
+        if request_id:
+            response.headers["X-Request-ID"] = request_id
+        return response
+
+    @app.teardown_request
+    def _unbind_request_id(exc):
+        token = g.pop("_request_id_token", None)
+        if token is not None:
+            _request_id.reset(token)
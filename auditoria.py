@@ -0,0 +1,391 @@
+"""
+Trilha de auditoria: quem alterou o quê, campo a campo.
+
+As alterações feitas pelo ORM em atividades, incidentes, riscos, mudanças,
+lições e perfis são capturadas no after_flush (diferença entre o valor
+antigo e o novo de cada coluna) e guardadas em session.info até o fim da
+transação. Comandos em lote (UPDATE/DELETE sem ORM) não passam pelo flush:
+quem os executa chama capturar_exclusao()/capturar_update() antes, com a
+mesma condição do comando (deletion.py, dependencias.py). No commit as
+linhas vão para uma fila em memória; uma thread do processo grava a fila em
+lotes (até LOTE linhas ou INTERVALO segundos) com um INSERT por lote, fora
+da requisição. Rollback descarta o que foi capturado.
+
+A tabela `auditoria` é só de inserção e não tem FKs (o histórico sobrevive
+à exclusão do registro). No PostgreSQL é particionada por mês de
+alterado_em: garantir_particoes() cria a partição do mês corrente e das
+MESES_A_FRENTE seguintes (startup e tarefa diária do agendador); uma
+partição DEFAULT recebe o que cair fora delas. No SQLite é uma tabela comum.
+
+historico(entidade, registro_id) lê a trilha de um registro, do mais novo
+para o mais antigo.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import date, datetime
+
+from flask import has_request_context
+from flask_login import current_user
+from sqlalchemy import Column, DateTime, Integer, JSON, MetaData, String, Table, event, insert, select, text
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import Session
+
+import metrics
+from app_logging import get_request_id
+from models import db, Atividade, Incidente, LicaoAprendida, Perfil, Risco, SolicitacaoMudanca, User
+
+logger = logging.getLogger("imsis.auditoria")
+
+# Modelo -> entidade gravada na trilha (mesmos nomes da busca do projeto)
+ENTIDADES = {
+    Atividade: "atividade",
+    Incidente: "incidente",
+    Risco: "risco",
+    SolicitacaoMudanca: "mudanca",
+    LicaoAprendida: "licao",
+    Perfil: "perfil",
+}
+MODELO_DA_ENTIDADE = {entidade: modelo for modelo, entidade in ENTIDADES.items()}
+
+# Colunas derivadas ou de controle: mudam sem ação do usuário
+IGNORAR = {
+    "id",
+    "data_ultima_modificacao",
+    "predecessoras_pendentes",
+    "score",
+    "alerta_atraso_para",
+    "alerta_acao_para",
+    "status_desde",
+    "versao",
+}
+
+LOTE = 500
+INTERVALO = 2.0
+TAMANHO_FILA = 10000
+MESES_A_FRENTE = 2
+
+# Sem MetaData do db: a tabela é criada por criar_tabela() (DDL diferente por banco)
+tabela = Table(
+    "auditoria",
+    MetaData(),
+    Column("id", Integer),
+    Column("alterado_em", DateTime, nullable=False),
+    Column("entidade", String(20), nullable=False),
+    Column("registro_id", Integer, nullable=False),
+    Column("projeto_id", Integer),
+    Column("user_id", Integer),
+    Column("acao", String(10), nullable=False),  # criar, editar, excluir
+    Column("alteracoes", JSON, nullable=False),  # {campo: [antes, depois]}
+    Column("request_id", String(64)),
+)
+
+
+# ------------------------------------------------------------------------------
+# TABELA E PARTIÇÕES
+# ------------------------------------------------------------------------------
+def criar_tabela():
+    """Cria a tabela e o índice por registro. Devolve True se criou"""
+    if sa_inspect(db.engine).has_table("auditoria"):
+        return False
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(text(
+            "CREATE TABLE auditoria ("
+            "id BIGSERIAL, alterado_em TIMESTAMP NOT NULL, entidade VARCHAR(20) NOT NULL, "
+            "registro_id INTEGER NOT NULL, projeto_id INTEGER, user_id INTEGER, "
+            "acao VARCHAR(10) NOT NULL, alteracoes JSONB NOT NULL, request_id VARCHAR(64), "
+            "PRIMARY KEY (id, alterado_em)"
+            ") PARTITION BY RANGE (alterado_em)"
+        ))
+        db.session.execute(text("CREATE TABLE auditoria_padrao PARTITION OF auditoria DEFAULT"))
+    else:
+        db.session.execute(text(
+            "CREATE TABLE auditoria ("
+            "id INTEGER PRIMARY KEY, alterado_em DATETIME NOT NULL, entidade VARCHAR(20) NOT NULL, "
+            "registro_id INTEGER NOT NULL, projeto_id INTEGER, user_id INTEGER, "
+            "acao VARCHAR(10) NOT NULL, alteracoes JSON NOT NULL, request_id VARCHAR(64))"
+        ))
+    db.session.execute(text(
+        "CREATE INDEX ix_auditoria_registro ON auditoria (entidade, registro_id, alterado_em)"
+    ))
+    return True
+
+
+def _mes(ano, mes, deslocamento):
+    indice = ano * 12 + (mes - 1) + deslocamento
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def garantir_particoes(agora=None, meses=MESES_A_FRENTE):
+    """PostgreSQL: cria as partições do mês de `agora` e dos `meses` seguintes. Devolve quantas criou"""
+    if db.engine.dialect.name != "postgresql":
+        return 0
+    agora = agora or datetime.utcnow()
+    existentes = set(db.session.scalars(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'auditoria'"
+    )))
+    criadas = 0
+    for deslocamento in range(meses + 1):
+        inicio, fim = _mes(agora.year, agora.month, deslocamento), _mes(agora.year, agora.month, deslocamento + 1)
+        nome = f"auditoria_{inicio:%Y_%m}"
+        if nome in existentes:
+            continue
+        db.session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {nome} PARTITION OF auditoria "
+            f"FOR VALUES FROM ('{inicio:%Y-%m-%d}') TO ('{fim:%Y-%m-%d}')"
+        ))
+        criadas += 1
+    return criadas
+
+
+# ------------------------------------------------------------------------------
+# CAPTURA
+# ------------------------------------------------------------------------------
+def _valor(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if valor is None or isinstance(valor, (bool, int, float, str)):
+        return valor
+    return str(valor)
+
+
+def _anterior(historico):
+    if historico.deleted:
+        return historico.deleted[0]
+    if historico.unchanged:
+        return historico.unchanged[0]
+    return None
+
+
+def _diferencas(obj, acao):
+    estado = sa_inspect(obj)
+    alteracoes = {}
+    for coluna in estado.mapper.column_attrs:
+        if coluna.key in IGNORAR:
+            continue
+        if acao == "criar":
+            antes, depois = None, getattr(obj, coluna.key)
+        elif acao == "excluir":
+            antes, depois = _anterior(estado.attrs[coluna.key].history), None
+        else:
+            historico = estado.attrs[coluna.key].history
+            if not historico.has_changes():
+                continue
+            antes, depois = _anterior(historico), getattr(obj, coluna.key)
+        antes, depois = _valor(antes), _valor(depois)
+        if antes != depois:
+            alteracoes[coluna.key] = [antes, depois]
+    return alteracoes
+
+
+def usuario_atual():
+    if has_request_context() and current_user and current_user.is_authenticated:
+        return current_user.id
+    return None
+
+
+@event.listens_for(Session, "after_flush")
+def _auditoria_apos_flush(session, flush_context):
+    agora = datetime.utcnow()
+    linhas = []
+    for acao, objetos in (("criar", session.new), ("editar", session.dirty), ("excluir", session.deleted)):
+        for obj in objetos:
+            entidade = ENTIDADES.get(type(obj))
+            if entidade is None:
+                continue
+            alteracoes = _diferencas(obj, acao)
+            if not alteracoes:
+                continue
+            linhas.append({
+                "alterado_em": agora,
+                "entidade": entidade,
+                "registro_id": obj.id,
+                "projeto_id": obj.projeto_id,
+                "acao": acao,
+                "alteracoes": alteracoes,
+            })
+    _guardar(session, linhas)
+
+
+def _guardar(session, linhas):
+    if linhas:
+        user_id, request_id = usuario_atual(), get_request_id()
+        for linha in linhas:
+            linha["user_id"], linha["request_id"] = user_id, request_id
+        session.info.setdefault("auditoria", []).extend(linhas)
+
+
+def _linhas_do_comando(modelo, condicao, acao, depois):
+    """Uma linha por registro que `condicao` seleciona; depois(coluna, valor) dá o valor novo"""
+    entidade = ENTIDADES[modelo]
+    colunas = [coluna.key for coluna in modelo.__table__.c if coluna.key not in IGNORAR]
+    agora = datetime.utcnow()
+    linhas = []
+    for registro in db.session.execute(select(modelo.__table__).where(condicao)).mappings():
+        alteracoes = {}
+        for coluna in colunas:
+            antes, novo = _valor(registro[coluna]), _valor(depois(coluna, registro[coluna]))
+            if antes != novo:
+                alteracoes[coluna] = [antes, novo]
+        if alteracoes:
+            linhas.append({
+                "alterado_em": agora,
+                "entidade": entidade,
+                "registro_id": registro["id"],
+                "projeto_id": registro["projeto_id"],
+                "acao": acao,
+                "alteracoes": alteracoes,
+            })
+    return linhas
+
+
+def capturar_exclusao(modelo, condicao):
+    """DELETE em lote de `modelo` WHERE `condicao`: chamar antes do comando"""
+    _guardar(db.session(), _linhas_do_comando(modelo, condicao, "excluir", lambda coluna, valor: None))
+
+
+def capturar_update(modelo, condicao, valores):
+    """UPDATE em lote de `modelo` WHERE `condicao` SET `valores` (só constantes): chamar antes do comando"""
+    _guardar(
+        db.session(),
+        _linhas_do_comando(modelo, condicao, "editar", lambda coluna, valor: valores.get(coluna, valor)),
+    )
+
+
+@event.listens_for(Session, "after_commit")
+def _auditoria_apos_commit(session):
+    linhas = session.info.pop("auditoria", None)
+    if linhas:
+        enfileirar(session.get_bind(), linhas)
+
+
+@event.listens_for(Session, "after_rollback")
+def _auditoria_apos_rollback(session):
+    session.info.pop("auditoria", None)
+
+
+# ------------------------------------------------------------------------------
+# GRAVAÇÃO EM LOTE
+# ------------------------------------------------------------------------------
+_fila = None
+_escritor = None
+_lock = threading.Lock()
+
+
+def _gravar(itens):
+    """Grava [(engine, linha)] com um INSERT por engine"""
+    por_engine = {}
+    for engine, linha in itens:
+        por_engine.setdefault(engine, []).append(linha)
+    for engine, linhas in por_engine.items():
+        try:
+            with engine.begin() as conexao:
+                conexao.execute(insert(tabela), linhas)
+            metrics.AUDIT_ROWS.inc("gravada", amount=len(linhas))
+        except Exception:
+            metrics.AUDIT_ROWS.inc("perdida", amount=len(linhas))
+            logger.exception("Erro ao gravar auditoria", extra={"linhas": len(linhas)})
+
+
+def _escrever_continuamente(fila):
+    while True:
+        itens = [fila.get()]
+        prazo = time.monotonic() + INTERVALO
+        while len(itens) < LOTE:
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                itens.append(fila.get(timeout=restante))
+            except queue.Empty:
+                break
+        _gravar(itens)
+        for _ in itens:
+            fila.task_done()
+
+
+def _garantir_escritor():
+    global _fila, _escritor
+    with _lock:
+        if _escritor is None or not _escritor.is_alive():
+            _fila = _fila or queue.Queue(maxsize=TAMANHO_FILA)
+            _escritor = threading.Thread(
+                target=_escrever_continuamente, args=(_fila,), name="auditoria", daemon=True
+            )
+            _escritor.start()
+        return _fila
+
+
+def enfileirar(engine, linhas):
+    fila = _garantir_escritor()
+    for linha in linhas:
+        try:
+            fila.put_nowait((engine, linha))
+        except queue.Full:
+            metrics.AUDIT_ROWS.inc("perdida")
+            logger.warning("Fila de auditoria cheia: alteracao descartada", extra={"entidade": linha["entidade"]})
+
+
+def descarregar():
+    """Grava agora o que está na fila e espera o lote em andamento (testes, encerramento do processo)"""
+    fila = _fila
+    if fila is None:
+        return
+    itens = []
+    while True:
+        try:
+            itens.append(fila.get_nowait())
+        except queue.Empty:
+            break
+    for inicio in range(0, len(itens), LOTE):
+        _gravar(itens[inicio:inicio + LOTE])
+    for _ in itens:
+        fila.task_done()
+    if _escritor is not None and _escritor.is_alive():
+        fila.join()
+
+
+def _reiniciar_apos_fork():
+    """A thread não sobrevive ao fork (gunicorn com preload_app): o filho começa com fila nova"""
+    global _fila, _escritor, _lock
+    _fila, _escritor, _lock = None, None, threading.Lock()
+
+
+atexit.register(descarregar)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reiniciar_apos_fork)
+
+
+# ------------------------------------------------------------------------------
+# CONSULTA
+# ------------------------------------------------------------------------------
+def historico(entidade, registro_id, projeto_id=None, limite=100):
+    """Trilha do registro, do mais novo para o mais antigo"""
+    A = tabela
+    filtro = [A.c.entidade == entidade, A.c.registro_id == registro_id]
+    if projeto_id is not None:
+        filtro.append(A.c.projeto_id == projeto_id)
+    linhas = db.session.execute(
+        select(A.c.alterado_em, A.c.acao, A.c.alteracoes, A.c.user_id, User.username)
+        .outerjoin(User, User.id == A.c.user_id)
+        .where(*filtro)
+        .order_by(A.c.alterado_em.desc(), A.c.id.desc())
+        .limit(limite)
+    )
+    return [
+        {
+            "alterado_em": alterado_em.isoformat(timespec="seconds"),
+            "acao": acao,
+            "alteracoes": alteracoes if isinstance(alteracoes, dict) else json.loads(alteracoes),
+            "user_id": user_id,
+            "usuario": username,
+        }
+        for alterado_em, acao, alteracoes, user_id, username in linhas
+    ]
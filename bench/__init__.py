@@ -0,0 +1 @@
+"""Benchmark e teste de carga do IMSIS (veja bench/load_test.py)."""
@@ -0,0 +1,66 @@
+"""
+Compara dois resultados do bench/load_test.py.
+
+Uso:
+    python -m bench.compare bench/baseline.json bench/atual.json [--threshold 10]
+
+Sai com código 1 se o p95 de alguma rota piorar mais que --threshold por cento.
+"""
+
+import argparse
+import json
+import sys
+
+COLUNAS = ("p50_ms", "p95_ms", "p99_ms", "queries_per_request")
+
+
+def delta(antes, depois):
+    if antes in (None, 0) or depois is None:
+        return None
+    return (depois - antes) / antes * 100.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("atual")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Regressão máxima de p95 em %%")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        base = json.load(f)
+    with open(args.atual) as f:
+        atual = json.load(f)
+
+    print(f"baseline: {base['meta'].get('commit')}  atual: {atual['meta'].get('commit')}")
+    b_sum, a_sum = base["summary"], atual["summary"]
+    d = delta(b_sum["throughput_rps"], a_sum["throughput_rps"])
+    print(f"throughput: {b_sum['throughput_rps']} -> {a_sum['throughput_rps']} req/s ({d:+.1f}%)" if d is not None else "throughput: n/a")
+    print()
+    print(f"{'rota':<22}" + "".join(f"{c:>28}" for c in COLUNAS))
+
+    regressoes = []
+    rotas = sorted(set(b_sum["routes"]) | set(a_sum["routes"]))
+    for rota in rotas:
+        b = b_sum["routes"].get(rota, {})
+        a = a_sum["routes"].get(rota, {})
+        celulas = []
+        for coluna in COLUNAS:
+            d = delta(b.get(coluna), a.get(coluna))
+            texto = f"{b.get(coluna)} -> {a.get(coluna)}"
+            if d is not None:
+                texto += f" ({d:+.1f}%)"
+            celulas.append(f"{texto:>28}")
+            if coluna == "p95_ms" and d is not None and d > args.threshold:
+                regressoes.append((rota, d))
+        print(f"{rota:<22}" + "".join(celulas))
+
+    if regressoes:
+        print()
+        for rota, d in regressoes:
+            print(f"REGRESSAO: {rota} p95 {d:+.1f}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Gerador de dados sintéticos para benchmark.
+
+Popula o banco com N projetos, cada um com fases, cenários, atividades,
+incidentes, riscos, membros e perfis. Os dados são determinísticos para uma
+mesma semente (--seed), então dois commits podem ser comparados sobre a mesma base.
+
+Uso:
+    DATABASE_URL=sqlite:////tmp/imsis-bench.db python -m bench.seed --projetos 5
+"""
+
+import argparse
+import random
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+
+BENCH_PASSWORD = "bench-senha"
+
+PALAVRAS = (
+    "interface SAP pedido fatura estoque cutover carga integracao cliente "
+    "fornecedor pagamento contabil relatorio migracao validacao teste usuario "
+    "perfil acesso nota fiscal entrega transporte cadastro material preco"
+).split()
+
+
+@dataclass
+class SeedParams:
+    seed: int = 42
+    usuarios: int = 20
+    projetos: int = 3
+    membros_por_projeto: int = 10
+    perfis_por_projeto: int = 2
+    fases: int = 4
+    cenarios_por_fase: int = 5
+    atividades_por_cenario: int = 20
+    incidentes_por_projeto: int = 100
+    riscos_por_projeto: int = 50
+
+    @classmethod
+    def add_arguments(cls, parser):
+        for name, default in asdict(cls()).items():
+            parser.add_argument(f"--{name.replace('_', '-')}", dest=name, type=int, default=default)
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(**{name: getattr(args, name) for name in asdict(cls())})
+
+
+def _frase(rng, n=8):
+    return " ".join(rng.choice(PALAVRAS) for _ in range(n)).capitalize()
+
+
+def seed_database(app_module, params):
+    """
+    Cria os dados sintéticos usando inserts em lote (executemany).
+    Retorna um dict com os ids úteis para o teste de carga.
+    """
+    from sqlalchemy import insert
+    from werkzeug.security import generate_password_hash
+
+    import acompanhamentos
+    import busca
+    import contadores
+    import similares
+    import sla
+
+    db = app_module.db
+    rng = random.Random(params.seed)
+    agora = datetime.utcnow()
+
+    # Um único hash para todos os usuários (pbkdf2 é propositalmente lento)
+    senha_hash = generate_password_hash(BENCH_PASSWORD)
+    db.session.execute(
+        insert(app_module.User),
+        [
+            {
+                "username": f"bench{i}",
+                "email": f"bench{i}@bench.local",
+                "password": senha_hash,
+                "email_verified": True,
+            }
+            for i in range(params.usuarios)
+        ],
+    )
+    user_ids = [
+        u.id for u in app_module.User.query.filter(app_module.User.email.like("%@bench.local")).order_by(app_module.User.id)
+    ]
+    # (username, id): os inserts em lote não passam pelos eventos do ORM
+    usuarios = list(zip((f"bench{i}" for i in range(params.usuarios)), user_ids))
+
+    projetos = []
+    for p in range(params.projetos):
+        projeto = app_module.Projeto(nome=f"Projeto bench {p}")
+        db.session.add(projeto)
+        db.session.flush()
+
+        perfis = _seed_perfis(app_module, projeto.id, params, rng)
+        membros_uids = [user_ids[0]] + rng.sample(user_ids[1:], min(params.membros_por_projeto, len(user_ids)) - 1)
+        for idx, uid in enumerate(membros_uids):
+            membro = app_module.ProjetoMembro(projeto_id=projeto.id, user_id=uid)
+            db.session.add(membro)
+            db.session.flush()
+            perfil_id = perfis[0] if idx == 0 else rng.choice(perfis[1:])
+            db.session.add(app_module.MembroPerfil(projeto_membro_id=membro.id, perfil_id=perfil_id))
+
+        fase_ids, cenario_ids, atividade_ids = _seed_fluxo(app_module, projeto.id, params, rng, usuarios, agora)
+        _seed_registros(app_module, projeto.id, params, rng, usuarios, atividade_ids, agora)
+
+        projetos.append(
+            {
+                "id": projeto.id,
+                "fases": fase_ids,
+                "cenarios": cenario_ids,
+                "atividades": atividade_ids,
+            }
+        )
+
+    # Inserts em lote não passam pelos eventos que mantêm os contadores de
+    # progresso, o índice da busca no projeto, as assinaturas de similaridade
+    # e o histórico de status dos incidentes; o acompanhamento vira a primeira nota
+    contadores.recalcular()
+    acompanhamentos.migrar_existentes()
+    sla.registrar_existentes()
+    sla.recalcular()
+    for tipo in busca.REGISTROS:
+        busca.indexar_pendentes(tipo)
+    for tipo in similares.TIPOS:
+        similares.indexar_pendentes(tipo)
+    db.session.commit()
+    return {"user_emails": [f"bench{i}@bench.local" for i in range(params.usuarios)], "projetos": projetos}
+
+
+def _dono(rng, usuarios, coluna="responsavel"):
+    username, user_id = rng.choice(usuarios)
+    return {coluna: username, f"{coluna}_id": user_id}
+
+
+def _seed_perfis(app_module, projeto_id, params, rng):
+    import permissoes
+
+    Perfil = app_module.Perfil
+    flags = [c.name for c in Perfil.__table__.columns if c.name.startswith("pode_")]
+    extras = [
+        Perfil(nome=f"Perfil {i}", projeto_id=projeto_id, is_default=False, **{f: rng.random() < 0.5 for f in flags})
+        for i in range(params.perfis_por_projeto)
+    ]
+    app_module.db.session.add_all(extras)
+    app_module.db.session.flush()
+    # Administrador e Membro são os modelos globais
+    return [permissoes.modelo_id("Administrador"), permissoes.modelo_id("Membro")] + [p.id for p in extras]
+
+
+def _seed_fluxo(app_module, projeto_id, params, rng, usuarios, agora):
+    from sqlalchemy import insert
+
+    db = app_module.db
+    fase_ids, cenario_ids, atividade_ids = [], [], []
+    for f in range(params.fases):
+        fase = app_module.Fase(nome=f"Fase {f + 1}", projeto_id=projeto_id)
+        db.session.add(fase)
+        db.session.flush()
+        fase_ids.append(fase.id)
+        for c in range(params.cenarios_por_fase):
+            cenario = app_module.Cenario(cenario=f"Cenario {f + 1}.{c + 1}", fase_id=fase.id, projeto_id=projeto_id)
+            db.session.add(cenario)
+            db.session.flush()
+            cenario_ids.append(cenario.id)
+
+            concluidas = rng.randint(0, params.atividades_por_cenario)
+            rows = []
+            for n in range(params.atividades_por_cenario):
+                liberada = n <= concluidas
+                rows.append(
+                    {
+                        "numero_sequencial": n + 1,
+                        "descricao": _frase(rng, 6),
+                        **_dono(rng, usuarios),
+                        "cenario_id": cenario.id,
+                        "projeto_id": projeto_id,
+                        "data_liberacao": agora - timedelta(days=concluidas - n + 1) if liberada else None,
+                        "data_conclusao": agora - timedelta(days=concluidas - n) if n < concluidas else None,
+                    }
+                )
+            if rows:
+                db.session.execute(insert(app_module.Atividade), rows)
+        atividade_ids.extend(
+            a.id
+            for a in app_module.Atividade.query.with_entities(app_module.Atividade.id)
+            .join(app_module.Cenario)
+            .filter(app_module.Cenario.fase_id == fase.id)
+        )
+    return fase_ids, cenario_ids, atividade_ids
+
+
+def _seed_registros(app_module, projeto_id, params, rng, usuarios, atividade_ids, agora):
+    from sqlalchemy import insert
+
+    db = app_module.db
+    status_incidente = app_module.LISTA_STATUS_INCIDENTE
+    prioridades = app_module.LISTA_PRIORIDADE_INCIDENTE
+
+    if params.incidentes_por_projeto:
+        db.session.execute(
+            insert(app_module.Incidente),
+            [
+                {
+                    "projeto_id": projeto_id,
+                    "atividade_id": rng.choice(atividade_ids) if atividade_ids and rng.random() < 0.7 else None,
+                    "descricao": _frase(rng, 12),
+                    "acompanhamento": _frase(rng, 20),
+                    **_dono(rng, usuarios),
+                    "prioridade": rng.choice(prioridades),
+                    "status": rng.choice(status_incidente),
+                    "previsao_original": agora + timedelta(days=rng.randint(-30, 30)),
+                    "data_criacao": agora - timedelta(days=rng.randint(0, 90)),
+                    "data_ultima_modificacao": agora,
+                }
+                for _ in range(params.incidentes_por_projeto)
+            ],
+        )
+
+    if params.riscos_por_projeto:
+        db.session.execute(
+            insert(app_module.Risco),
+            [
+                {
+                    "projeto_id": projeto_id,
+                    "area": rng.choice(["TI", "Negocio", "Infra", "Fornecedor"]),
+                    "tipo_risco": rng.choice(["Ameaca", "Oportunidade"]),
+                    "risco": _frase(rng, 10),
+                    **_dono(rng, usuarios, "criado_por"),
+                    **_dono(rng, usuarios),
+                    "impacto": rng.randint(1, 5),
+                    "probabilidade": rng.randint(1, 5),
+                    "status": rng.choice(["Planejado", "Iniciado", "Parado", "Concluido"]),
+                    "acompanhamento": _frase(rng, 15),
+                    "data_criacao": agora - timedelta(days=rng.randint(0, 90)),
+                    "data_proxima_acao": agora + timedelta(days=rng.randint(-10, 30)),
+                }
+                for _ in range(params.riscos_por_projeto)
+            ],
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    SeedParams.add_arguments(parser)
+    args = parser.parse_args()
+
+    import app as app_module
+
+    params = SeedParams.from_args(args)
+    app = app_module.create_app({"LOAD_SECRETS": False})
+    with app.app_context():
+        info = seed_database(app_module, params)
+    total = sum(len(p["atividades"]) for p in info["projetos"])
+    print(f"{len(info['projetos'])} projetos, {total} atividades criados ({params})")
+
+
+if __name__ == "__main__":
+    main()
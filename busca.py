@@ -0,0 +1,457 @@
+"""
+Busca textual (full-text).
+
+Duas buscas, com o mesmo mecanismo de índice:
+- lições aprendidas de todos os projetos (buscar_licoes), indexando as
+  colunas da própria licoes_aprendidas;
+- busca unificada de um projeto (buscar_no_projeto): atividades,
+  incidentes, riscos, mudanças e lições, a partir de busca_itens, uma linha
+  de título + texto por registro, mantida pela aplicação (ver REGISTROS).
+  O texto de incidentes e riscos inclui as notas da linha do tempo
+  (acompanhamentos.py), que reindexa o registro a cada nota nova.
+
+Índices:
+- PostgreSQL: coluna gerada `busca` (tsvector, dicionário portuguese, com
+  pesos por campo) e índice GIN; ranking com ts_rank_cd e trechos com
+  ts_headline (calculados só para as linhas devolvidas);
+- SQLite: tabela FTS5 (external content) mantida por triggers; ranking com
+  bm25 e trechos com snippet.
+
+O texto digitado vira uma consulta de prefixos ("interf sap" encontra
+"interface SAP"), montada só com as palavras do texto, sem operadores.
+
+Visibilidade das lições: o usuário vê todas as lições dos projetos em que é
+membro e, dos demais projetos, só as marcadas como aplicáveis a projetos
+futuros. A busca no projeto é só para membros (verificado na rota).
+
+Não faz commit: o chamador controla a transação.
+"""
+import re
+from collections import namedtuple
+
+from markupsafe import Markup, escape
+from sqlalchemy import column, delete, event, func, insert, literal, literal_column, or_, select, table, text
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import Session
+
+from models import (
+    db,
+    Acompanhamento,
+    Atividade,
+    Incidente,
+    ItemBusca,
+    LicaoAprendida,
+    Projeto,
+    ProjetoMembro,
+    Risco,
+    SolicitacaoMudanca,
+)
+
+CONFIGURACAO = "portuguese"
+MAX_TERMOS = 8
+
+# Marcadores dos trechos encontrados; trocados por <mark> depois de escapar o texto
+_INICIO, _FIM = "⟦", "⟧"
+
+# Campos indexados e peso de cada um (descrição pesa mais)
+CAMPOS_LICAO = {
+    "descricao": ("A", 4.0),
+    "recomendacao": ("B", 2.0),
+    "causa_raiz": ("C", 1.5),
+    "acao_tomada": ("C", 1.5),
+}
+
+
+def _postgres():
+    return db.engine.dialect.name == "postgresql"
+
+
+def termos(texto):
+    """Palavras do texto digitado (sem operadores nem aspas)"""
+    return re.findall(r"[^\W_]+", (texto or "").lower())[:MAX_TERMOS]
+
+
+def _consulta(palavras):
+    if _postgres():
+        return " & ".join(f"{p}:*" for p in palavras)
+    return " ".join(f'"{p}"*' for p in palavras)
+
+
+def destacar(trecho):
+    """Trecho com os marcadores do banco -> HTML seguro com <mark>"""
+    if not trecho:
+        return Markup("")
+    html = str(escape(trecho))
+    return Markup(html.replace(_INICIO, "<mark>").replace(_FIM, "</mark>"))
+
+
+# ------------------------------------------------------------------------------
+# ÍNDICE
+# ------------------------------------------------------------------------------
+def _criar_indice(tabela, campos, fts):
+    """
+    Índice textual de `tabela` sobre `campos` ({coluna: (peso, peso_bm25)}):
+    coluna gerada `busca` + GIN no PostgreSQL, tabela FTS5 `fts` + triggers
+    no SQLite. Devolve True se criou.
+    """
+    if _postgres():
+        existe = db.session.scalar(
+            text(
+                "SELECT 1 FROM information_schema.columns "
+                "WHERE table_name = :tabela AND column_name = 'busca'"
+            ),
+            {"tabela": tabela},
+        )
+        if existe:
+            return False
+        vetor = " || ".join(
+            f"setweight(to_tsvector('{CONFIGURACAO}', coalesce({campo}, '')), '{peso}')"
+            for campo, (peso, _) in campos.items()
+        )
+        db.session.execute(text(
+            f"ALTER TABLE {tabela} ADD COLUMN busca tsvector GENERATED ALWAYS AS ({vetor}) STORED"
+        ))
+        db.session.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{tabela}_busca ON {tabela} USING GIN (busca)"))
+        return True
+
+    existe = db.session.scalar(text("SELECT 1 FROM sqlite_master WHERE name = :fts"), {"fts": fts})
+    if existe:
+        return False
+    colunas = ", ".join(campos)
+    novos = ", ".join(f"new.{c}" for c in campos)
+    antigos = ", ".join(f"old.{c}" for c in campos)
+    remover = f"INSERT INTO {fts}({fts}, rowid, {colunas}) VALUES ('delete', old.id, {antigos});"
+    inserir = f"INSERT INTO {fts}(rowid, {colunas}) VALUES (new.id, {novos});"
+    for sql in (
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({colunas}, content='{tabela}', "
+        "content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {tabela} BEGIN {inserir} END",
+        f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {tabela} BEGIN {remover} END",
+        f"CREATE TRIGGER {fts}_au AFTER UPDATE OF {colunas} ON {tabela} BEGIN {remover} {inserir} END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ):
+        db.session.execute(text(sql))
+    return True
+
+
+def criar_indice_licoes():
+    """Cria o índice de busca das lições se ainda não existir. Devolve True se criou"""
+    return _criar_indice("licoes_aprendidas", CAMPOS_LICAO, "licoes_fts")
+
+
+# ------------------------------------------------------------------------------
+# CONSULTA
+# ------------------------------------------------------------------------------
+def _visiveis(user_id):
+    L = LicaoAprendida
+    projetos_do_usuario = select(ProjetoMembro.projeto_id).where(ProjetoMembro.user_id == user_id)
+    return or_(L.projeto_id.in_(projetos_do_usuario), L.aplicavel_futuros.is_(True))
+
+
+def buscar_licoes(texto, user_id, pagina=1, por_pagina=20):
+    """
+    Lições visíveis para o usuário que contêm as palavras de `texto`, das mais
+    relevantes para as menos. Devolve (resultados, tem_proxima_pagina); cada
+    resultado é um dict com os campos da lição, o projeto, `relevancia` e o
+    `trecho` encontrado (HTML com <mark>).
+    """
+    palavras = termos(texto)
+    if not palavras:
+        return [], False
+    consulta = _consulta(palavras)
+    L = LicaoAprendida
+    inicio = (pagina - 1) * por_pagina
+
+    if _postgres():
+        tsquery = func.to_tsquery(CONFIGURACAO, consulta)
+        relevancia = func.ts_rank_cd(literal_column("licoes_aprendidas.busca"), tsquery)
+        encontradas = (
+            select(L.id, relevancia.label("relevancia"))
+            .where(literal_column("licoes_aprendidas.busca").op("@@")(tsquery), _visiveis(user_id))
+            .order_by(relevancia.desc(), L.id.desc())
+            .offset(inicio)
+            .limit(por_pagina + 1)
+            .subquery()
+        )
+        texto_completo = func.concat_ws(" … ", *(getattr(L, c) for c in CAMPOS_LICAO))
+        trecho = func.ts_headline(
+            CONFIGURACAO, texto_completo, tsquery,
+            f"StartSel={_INICIO}, StopSel={_FIM}, MaxFragments=2, MinWords=8, MaxWords=20",
+        )
+        consulta_final = (
+            select(L, Projeto.nome, encontradas.c.relevancia, trecho)
+            .join(encontradas, encontradas.c.id == L.id)
+            .join(Projeto, Projeto.id == L.projeto_id)
+            .order_by(encontradas.c.relevancia.desc(), L.id.desc())
+        )
+    else:
+        fts = table("licoes_fts", column("rowid"))
+        indice = literal_column("licoes_fts")
+        # bm25: menor é melhor; nega para manter "maior = mais relevante"
+        relevancia = -func.bm25(indice, *(peso for _, peso in CAMPOS_LICAO.values()))
+        trecho = func.snippet(indice, -1, _INICIO, _FIM, "…", 16)
+        consulta_final = (
+            select(L, Projeto.nome, relevancia.label("relevancia"), trecho)
+            .join(fts, fts.c.rowid == L.id)
+            .join(Projeto, Projeto.id == L.projeto_id)
+            .where(indice.op("MATCH")(consulta), _visiveis(user_id))
+            .order_by(relevancia.desc(), L.id.desc())
+            .offset(inicio)
+            .limit(por_pagina + 1)
+        )
+
+    linhas = db.session.execute(consulta_final).all()
+    membro_de = set(db.session.scalars(
+        select(ProjetoMembro.projeto_id).where(ProjetoMembro.user_id == user_id)
+    ))
+    resultados = [
+        {
+            "id": licao.id,
+            "projeto_id": licao.projeto_id,
+            "projeto": projeto_nome,
+            "membro": licao.projeto_id in membro_de,
+            "categoria": licao.categoria,
+            "tipo": licao.tipo,
+            "status": licao.status,
+            "descricao": licao.descricao,
+            "data_registro": licao.data_registro.isoformat() if licao.data_registro else None,
+            "relevancia": round(float(pontos or 0), 4),
+            "trecho": destacar(trecho_encontrado),
+        }
+        for licao, projeto_nome, pontos, trecho_encontrado in linhas[:por_pagina]
+    ]
+    return resultados, len(linhas) > por_pagina
+
+
+# ------------------------------------------------------------------------------
+# BUSCA NO PROJETO (todos os registros)
+# ------------------------------------------------------------------------------
+# Tipo -> (modelo, coluna do título, colunas do texto, entidade das notas de
+# acompanhamento ou None). busca_itens guarda uma linha por registro; o
+# after_flush abaixo a mantém a partir do ORM e os comandos em lote
+# (clonagem.py, deletion.py, acompanhamentos.py) chamam
+# indexar_pendentes/reindexar/remover. A coluna `acompanhamento` antiga não
+# é indexada: o texto dela vira a primeira nota na migração.
+Registro = namedtuple("Registro", "modelo titulo campos notas", defaults=(None,))
+REGISTROS = {
+    "atividade": Registro(Atividade, "descricao", ("responsavel",)),
+    "incidente": Registro(Incidente, "descricao", ("responsavel", "status", "prioridade"), "incidente"),
+    "risco": Registro(
+        Risco, "risco",
+        ("area", "gatilho", "consequencia", "impacto_projeto", "prevencao", "contingencia", "responsavel"),
+        "risco",
+    ),
+    "mudanca": Registro(
+        SolicitacaoMudanca, "descricao",
+        ("justificativa", "observacoes", "solicitante", "area_solicitante", "tipo_mudanca", "status"),
+    ),
+    "licao": Registro(LicaoAprendida, "descricao", ("causa_raiz", "recomendacao", "acao_tomada", "impacto", "categoria")),
+}
+_TIPO_DO_MODELO = {registro.modelo: tipo for tipo, registro in REGISTROS.items()}
+
+CAMPOS_ITEM = {"titulo": ("A", 3.0), "texto": ("B", 1.0)}
+POR_TIPO = 5
+
+
+def criar_indice_projeto():
+    """Cria o índice textual de busca_itens se ainda não existir. Devolve True se criou"""
+    return _criar_indice("busca_itens", CAMPOS_ITEM, "busca_itens_fts")
+
+
+def _texto_sql(registro):
+    modelo = registro.modelo
+    partes = [func.coalesce(getattr(modelo, c), "") for c in registro.campos]
+    if registro.notas:
+        A = Acompanhamento
+        partes.append(func.coalesce(
+            select(func.aggregate_strings(A.texto, " "))
+            .where(A.projeto_id == modelo.projeto_id, A.entidade == registro.notas, A.registro_id == modelo.id)
+            .scalar_subquery(),
+            "",
+        ))
+    texto_sql = partes[0]
+    for parte in partes[1:]:
+        texto_sql = texto_sql + " " + parte
+    return texto_sql
+
+
+def _indexar_onde(tipo, filtro, conexao=None):
+    """INSERT ... SELECT em busca_itens dos registros de `tipo` que atendem `filtro`"""
+    registro = REGISTROS[tipo]
+    modelo = registro.modelo
+    return (conexao or db.session.connection()).execute(
+        insert(ItemBusca.__table__).from_select(
+            ["tipo", "registro_id", "projeto_id", "titulo", "texto"],
+            select(
+                literal(tipo), modelo.id, modelo.projeto_id,
+                getattr(modelo, registro.titulo), _texto_sql(registro),
+            ).where(modelo.projeto_id.isnot(None), *filtro),
+        )
+    ).rowcount
+
+
+def indexar_pendentes(tipo, projeto_id=None):
+    """Inclui em busca_itens os registros de `tipo` que ainda não estão lá (INSERT ... SELECT)"""
+    modelo, I = REGISTROS[tipo].modelo, ItemBusca
+    filtro = [modelo.id.not_in(select(I.registro_id).where(I.tipo == tipo))]
+    if projeto_id is not None:
+        filtro.append(modelo.projeto_id == projeto_id)
+    return _indexar_onde(tipo, filtro)
+
+
+def reindexar(tipo, registro_ids, conexao=None):
+    """Refaz a linha de busca_itens dos registros da lista/select `registro_ids`"""
+    remover(tipo, registro_ids, conexao)
+    return _indexar_onde(tipo, [REGISTROS[tipo].modelo.id.in_(registro_ids)], conexao)
+
+
+def indexar_notas_pendentes():
+    """
+    Reindexa os incidentes/riscos cuja nota mais recente não está no texto
+    indexado (notas gravadas antes de o índice incluir a linha do tempo, ou
+    copiadas da coluna antiga na migração). Devolve quantos reindexou.
+    """
+    A, I = Acompanhamento, ItemBusca
+    contem = func.strpos if _postgres() else func.instr
+    total = 0
+    for tipo, registro in REGISTROS.items():
+        if not registro.notas:
+            continue
+        ultimas = select(func.max(A.id)).where(A.entidade == registro.notas).group_by(A.registro_id)
+        desatualizados = db.session.scalars(
+            select(A.registro_id)
+            .outerjoin(I, (I.tipo == tipo) & (I.registro_id == A.registro_id))
+            .where(A.id.in_(ultimas), func.coalesce(contem(I.texto, A.texto), 0) == 0)
+        ).all()
+        if desatualizados:
+            total += reindexar(tipo, desatualizados)
+    return total
+
+
+def remover(tipo, registro_ids, conexao=None):
+    """Tira do índice os registros da lista/select `registro_ids` (antes de excluí-los em lote)"""
+    I = ItemBusca.__table__
+    (conexao or db.session.connection()).execute(
+        delete(I).where(I.c.tipo == tipo, I.c.registro_id.in_(registro_ids))
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _busca_apos_flush(session, flush_context):
+    alterados, removidos = {}, {}
+    for obj in session.new:
+        tipo = _TIPO_DO_MODELO.get(type(obj))
+        if tipo:
+            alterados.setdefault(tipo, []).append(obj)
+    for obj in session.dirty:
+        tipo = _TIPO_DO_MODELO.get(type(obj))
+        if not tipo:
+            continue
+        registro = REGISTROS[tipo]
+        estado = sa_inspect(obj)
+        if any(estado.attrs[c].history.has_changes() for c in ("projeto_id", registro.titulo, *registro.campos)):
+            alterados.setdefault(tipo, []).append(obj)
+    for obj in session.deleted:
+        tipo = _TIPO_DO_MODELO.get(type(obj))
+        if tipo:
+            removidos.setdefault(tipo, []).append(obj.id)
+    if not alterados and not removidos:
+        return
+
+    conexao = session.connection()
+    for tipo, registro_ids in removidos.items():
+        remover(tipo, registro_ids, conexao)
+    for tipo, objetos in alterados.items():
+        # Lido do banco (já gravado no flush) para incluir as notas de acompanhamento
+        reindexar(tipo, [obj.id for obj in objetos], conexao)
+
+
+def buscar_no_projeto(projeto_id, texto, tipo=None, pagina=1, por_tipo=POR_TIPO):
+    """
+    Registros do projeto que contêm as palavras de `texto`, agrupados por tipo:
+    {tipo: {"total": n, "itens": [{registro_id, titulo, trecho, relevancia}]}},
+    com os `por_tipo` mais relevantes de cada tipo (ou a `pagina` de um só tipo).
+    """
+    palavras = termos(texto)
+    if not palavras:
+        return {}
+    consulta = _consulta(palavras)
+    I = ItemBusca
+    filtro = [I.projeto_id == projeto_id]
+    if tipo is not None:
+        filtro.append(I.tipo == tipo)
+    primeira, ultima = (pagina - 1) * por_tipo + 1, pagina * por_tipo
+
+    def _posicoes(encontrados):
+        """Posição de cada registro no seu tipo e total do tipo; só as linhas da página"""
+        ranqueados = select(
+            encontrados.c.id,
+            encontrados.c.relevancia,
+            func.row_number().over(
+                partition_by=encontrados.c.tipo,
+                order_by=(encontrados.c.relevancia.desc(), encontrados.c.id.desc()),
+            ).label("posicao"),
+            func.count().over(partition_by=encontrados.c.tipo).label("total"),
+        ).subquery()
+        return select(ranqueados).where(ranqueados.c.posicao.between(primeira, ultima))
+
+    if _postgres():
+        tsquery = func.to_tsquery(CONFIGURACAO, consulta)
+        vetor = literal_column("busca_itens.busca")
+        encontrados = (
+            select(I.id, I.tipo, func.ts_rank_cd(vetor, tsquery).label("relevancia"))
+            .where(vetor.op("@@")(tsquery), *filtro)
+            .subquery()
+        )
+        pagina_itens = _posicoes(encontrados).subquery()
+        # ts_headline só para as linhas devolvidas
+        trecho = func.ts_headline(
+            CONFIGURACAO, func.concat_ws(" … ", I.titulo, I.texto), tsquery,
+            f"StartSel={_INICIO}, StopSel={_FIM}, MaxFragments=1, MinWords=8, MaxWords=20",
+        )
+        consulta_final = select(
+            I.tipo, I.registro_id, I.titulo, pagina_itens.c.relevancia, pagina_itens.c.total, trecho,
+        ).join(pagina_itens, pagina_itens.c.id == I.id)
+    else:
+        # bm25/snippet só valem na consulta com MATCH (nem dentro da janela).
+        # O FTS conduz: relevância de todas as correspondências, materializada,
+        # depois o filtro do projeto pela chave; o snippet só para a página.
+        indice = literal_column("busca_itens_fts")
+        fts = table("busca_itens_fts", column("rowid"))
+        correspondencias = (
+            select(
+                fts.c.rowid.label("id"),
+                (-func.bm25(indice, *(p for _, p in CAMPOS_ITEM.values()))).label("relevancia"),
+            )
+            .where(indice.op("MATCH")(consulta))
+            .cte("correspondencias")
+            .prefix_with("MATERIALIZED")
+        )
+        encontrados = (
+            select(I.id, I.tipo, correspondencias.c.relevancia)
+            .join(correspondencias, correspondencias.c.id == I.id)
+            .where(*filtro)
+            .subquery()
+        )
+        pagina_itens = _posicoes(encontrados).cte("pagina").prefix_with("MATERIALIZED")
+        consulta_final = (
+            select(
+                I.tipo, I.registro_id, I.titulo, pagina_itens.c.relevancia, pagina_itens.c.total,
+                func.snippet(indice, -1, _INICIO, _FIM, "…", 16),
+            )
+            .join(pagina_itens, pagina_itens.c.id == I.id)
+            .join(fts, fts.c.rowid == I.id)
+            .where(indice.op("MATCH")(consulta))
+        )
+
+    linhas = db.session.execute(consulta_final.order_by(I.tipo, pagina_itens.c.posicao)).all()
+    grupos = {}
+    for tipo_item, registro_id, titulo, pontos, total, trecho in linhas:
+        grupo = grupos.setdefault(tipo_item, {"total": total, "itens": []})
+        grupo["itens"].append({
+            "registro_id": registro_id,
+            "titulo": titulo,
+            "trecho": destacar(trecho),
+            "relevancia": round(float(pontos or 0), 4),
+        })
+    return grupos
@@ -0,0 +1,182 @@
+"""
+Clonagem de projeto (projeto modelo -> novo projeto).
+
+Copia fases, cenários, atividades, dependências, perfis personalizados e,
+opcionalmente, lições aprendidas com um INSERT ... SELECT por tabela, sem
+carregar as linhas na sessão. Os ids novos são reservados antes, em tabelas
+temporárias de mapeamento (antigo -> novo):
+- PostgreSQL: nextval() da sequência da tabela, uma vez por linha;
+- SQLite: MAX(id) + ROW_NUMBER() (a escrita já está serializada pelo banco).
+
+As atividades copiadas começam sem liberação/conclusão; o ponto de partida
+de cada cenário é liberado com um UPDATE (mesma regra de
+dependencias.liberar_iniciais) e os contadores de progresso são somados
+pelo contadores.py; atividades e lições copiadas entram na busca do
+projeto (busca.py) e as lições recebem assinatura de similaridade
+(similares.py). Membros e vínculos de perfil não são copiados.
+
+Não faz commit: o chamador controla a transação.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import column, func, insert, literal, select, table, text, update
+
+import busca
+import contadores
+import similares
+from models import (
+    db,
+    incrementar_versao_fluxo,
+    Atividade,
+    Cenario,
+    DependenciaAtividade,
+    Fase,
+    LicaoAprendida,
+    Perfil,
+)
+
+
+def _mapear(tabela, origem_id):
+    """Cria a tabela temporária clone_<tabela>(antigo, novo) com ids reservados"""
+    nome = f"clone_{tabela}"
+    if db.engine.dialect.name == "postgresql":
+        sql = (
+            f"CREATE TEMPORARY TABLE {nome} ON COMMIT DROP AS "
+            f"SELECT id AS antigo, nextval(pg_get_serial_sequence('{tabela}', 'id')) AS novo "
+            f"FROM {tabela} WHERE projeto_id = :origem"
+        )
+    else:
+        db.session.execute(text(f"DROP TABLE IF EXISTS temp.{nome}"))
+        sql = (
+            f"CREATE TEMPORARY TABLE {nome} AS "
+            f"SELECT id AS antigo, (SELECT COALESCE(MAX(id), 0) FROM {tabela}) "
+            f"+ ROW_NUMBER() OVER (ORDER BY id) AS novo "
+            f"FROM {tabela} WHERE projeto_id = :origem"
+        )
+    db.session.execute(text(sql), {"origem": origem_id})
+    return table(nome, column("antigo"), column("novo"))
+
+
+def _descartar_mapas(mapas):
+    # No PostgreSQL somem no commit (ON COMMIT DROP)
+    if db.engine.dialect.name != "postgresql":
+        for mapa in mapas:
+            db.session.execute(text(f"DROP TABLE IF EXISTS temp.{mapa.name}"))
+
+
+def _colunas(tabela, *excluir):
+    return [c for c in tabela.c if c.name not in excluir]
+
+
+def clonar_projeto(origem_id, destino_id, incluir_licoes=False, agora=None):
+    """
+    Copia o conteúdo do projeto `origem_id` para `destino_id` (já criado, com
+    os perfis padrão). Devolve quantas linhas foram copiadas por tabela.
+    """
+    agora = agora or datetime.utcnow()
+    F, C, A = Fase.__table__, Cenario.__table__, Atividade.__table__
+    D, P, L = DependenciaAtividade.__table__, Perfil.__table__, LicaoAprendida.__table__
+    destino = literal(destino_id)
+    copiadas = {}
+
+    mapa_fases = _mapear("fases", origem_id)
+    mapa_cenarios = _mapear("cenarios", origem_id)
+    mapa_atividades = _mapear("atividades", origem_id)
+
+    copiadas["fases"] = db.session.execute(
+        insert(F).from_select(
+            ["id", "nome", "projeto_id"],
+            select(mapa_fases.c.novo, F.c.nome, destino).join(mapa_fases, mapa_fases.c.antigo == F.c.id),
+        )
+    ).rowcount
+
+    copiadas["cenarios"] = db.session.execute(
+        insert(C).from_select(
+            ["id", "cenario", "fase_id", "projeto_id"],
+            select(mapa_cenarios.c.novo, C.c.cenario, mapa_fases.c.novo, destino)
+            .join(mapa_cenarios, mapa_cenarios.c.antigo == C.c.id)
+            .outerjoin(mapa_fases, mapa_fases.c.antigo == C.c.fase_id),
+        )
+    ).rowcount
+
+    # Todas as predecessoras da cópia começam pendentes
+    pendentes = (
+        select(func.count())
+        .select_from(D)
+        .where(D.c.sucessora_id == A.c.id)
+        .scalar_subquery()
+    )
+    copiadas["atividades"] = db.session.execute(
+        insert(A).from_select(
+            [
+                "id", "numero_sequencial", "descricao", "responsavel", "responsavel_id",
+                "cenario_id", "projeto_id", "predecessoras_pendentes",
+            ],
+            select(
+                mapa_atividades.c.novo, A.c.numero_sequencial, A.c.descricao, A.c.responsavel,
+                A.c.responsavel_id, mapa_cenarios.c.novo, destino, pendentes,
+            )
+            .join(mapa_atividades, mapa_atividades.c.antigo == A.c.id)
+            .outerjoin(mapa_cenarios, mapa_cenarios.c.antigo == A.c.cenario_id),
+        )
+    ).rowcount
+
+    predecessora, sucessora = mapa_atividades.alias("predecessora"), mapa_atividades.alias("sucessora")
+    copiadas["dependencias"] = db.session.execute(
+        insert(D).from_select(
+            ["projeto_id", "predecessora_id", "sucessora_id"],
+            select(destino, predecessora.c.novo, sucessora.c.novo)
+            .join(predecessora, predecessora.c.antigo == D.c.predecessora_id)
+            .join(sucessora, sucessora.c.antigo == D.c.sucessora_id)
+            .where(D.c.projeto_id == origem_id),
+        )
+    ).rowcount
+
+    colunas_perfil = _colunas(P, "id", "projeto_id")
+    copiadas["perfis"] = db.session.execute(
+        insert(P).from_select(
+            ["projeto_id", *(c.name for c in colunas_perfil)],
+            select(destino, *colunas_perfil).where(P.c.projeto_id == origem_id, P.c.is_default.isnot(True)),
+        )
+    ).rowcount
+
+    if incluir_licoes:
+        colunas_licao = _colunas(L, "id", "projeto_id", "fase_id")
+        copiadas["licoes"] = db.session.execute(
+            insert(L).from_select(
+                ["projeto_id", "fase_id", *(c.name for c in colunas_licao)],
+                select(destino, mapa_fases.c.novo, *colunas_licao)
+                .outerjoin(mapa_fases, mapa_fases.c.antigo == L.c.fase_id)
+                .where(L.c.projeto_id == origem_id),
+            )
+        ).rowcount
+        similares.indexar_pendentes("licao", destino_id)
+
+    _descartar_mapas([mapa_fases, mapa_cenarios, mapa_atividades])
+
+    # Ponto de partida (mesma regra de dependencias.liberar_iniciais): nada
+    # está concluído e quem tem aresta de entrada começa com predecessoras
+    # pendentes, então só sai a primeira de cada cenário sem aresta de entrada
+    novas = select(A.c.id).where(A.c.projeto_id == destino_id)
+    outra = A.alias("outra")
+    com_entrada = select(D.c.sucessora_id).where(D.c.projeto_id == destino_id)
+    primeira_do_cenario = A.c.numero_sequencial == (
+        select(func.min(outra.c.numero_sequencial)).where(outra.c.cenario_id == A.c.cenario_id).scalar_subquery()
+    )
+    db.session.execute(
+        update(A)
+        .where(
+            A.c.projeto_id == destino_id,
+            A.c.cenario_id.isnot(None),
+            A.c.id.not_in(com_entrada),
+            primeira_do_cenario,
+        )
+        .values(data_liberacao=agora)
+    )
+
+    for tipo in ("atividade", "licao"):
+        busca.indexar_pendentes(tipo, destino_id)
+    contadores.aplicar(db.session.connection(), contadores.deltas_de_select(novas))
+    incrementar_versao_fluxo(db.session.connection(), [destino_id])
+    return copiadas
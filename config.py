@@ -0,0 +1,129 @@
+"""
+Configuração da aplicação.
+
+Separado em duas fases, chamadas explicitamente por create_app():
+- load_environment(): carrega secrets (Secret Manager / arquivos do Cloud Run)
+  para os.environ. Pode fazer chamadas de rede, por isso nunca roda no import.
+- config_from_env(): monta o dict de configuração do Flask a partir de os.environ.
+"""
+
+import logging
+import os
+from urllib.parse import quote_plus
+
+logger = logging.getLogger("imsis.config")
+
+CLOUD_RUN_SECRET_FILES = {
+    "DB_PASS": "/var/run/secrets/cloud.google.com/secret/db-pass/latest",
+    "SECRET_KEY": "/var/run/secrets/cloud.google.com/secret/secret-key/latest",
+}
+
+
+def get_secret_or_env(key, default=""):
+    """Obtém secret de variável de ambiente ou padrão"""
+    value = os.environ.get(key, "").strip()
+    if value:
+        # Nunca logar o valor (nem prefixo): pode ser um secret
+        logger.debug("get_secret_or_env: %s definido", key)
+        return value
+    logger.debug("get_secret_or_env: %s nao encontrado, usando default", key)
+    return default
+
+
+def env_truthy(value):
+    return str(value).strip().lower() in {"1", "true", "yes", "on"}
+
+
+def load_environment():
+    """Fase 1: carrega secrets para os.environ"""
+    # Carregar secrets do Google Secret Manager (se em produção no GCP)
+    try:
+        from load_secrets import load_secrets
+        load_secrets()
+    except ImportError:
+        pass  # load_secrets.py não disponível (dev local)
+    except Exception as e:
+        logger.warning("Erro ao carregar secrets: %s", e)
+
+    # Se ainda não houver DB_PASS/SECRET_KEY, tentar ler arquivo de secret do Cloud Run
+    for env_var, secret_path in CLOUD_RUN_SECRET_FILES.items():
+        if os.environ.get(env_var):
+            continue
+        try:
+            if os.path.exists(secret_path):
+                with open(secret_path, "r") as f:
+                    value = f.read().strip()
+                    if value:
+                        os.environ[env_var] = value
+                        logger.info("%s carregado de arquivo de secret", env_var)
+        except Exception as e:
+            logger.warning("Erro ao carregar %s de arquivo: %s", env_var, e)
+
+
+def database_uri():
+    db_user = get_secret_or_env("DB_USER", "")
+    db_pass = get_secret_or_env("DB_PASS", "")
+    db_name = get_secret_or_env("DB_NAME", "")
+    cloud_sql_connection_name = get_secret_or_env("CLOUD_SQL_CONNECTION_NAME", "")
+
+    if os.environ.get("DATABASE_URL"):
+        logger.info("Usando DATABASE_URL")
+        return os.environ.get("DATABASE_URL")
+    if db_user and db_pass and db_name and cloud_sql_connection_name:
+        db_pass_encoded = quote_plus(db_pass)  # URL-encode the password
+        logger.info(
+            "Conectando ao Cloud SQL",
+            extra={"db_user": db_user, "db_name": db_name, "cloud_sql_connection_name": cloud_sql_connection_name},
+        )
+        return f"postgresql+psycopg2://{db_user}:{db_pass_encoded}@/{db_name}?host=/cloudsql/{cloud_sql_connection_name}"
+    if not db_pass:
+        logger.warning("DB_PASS está vazio!")
+    logger.info("Usando SQLite local")
+    return "sqlite:///dev.db"
+
+
+def config_from_env():
+    """Fase 2: configuração do Flask a partir das variáveis de ambiente"""
+    config = {
+        "SECRET_KEY": os.environ.get("SECRET_KEY", "chave-secreta-dev"),
+        "APP_BASE_URL": get_secret_or_env("APP_BASE_URL", "").rstrip("/"),
+        "SMTP_HOST": get_secret_or_env("SMTP_HOST"),
+        "SMTP_PORT": get_secret_or_env("SMTP_PORT", ""),
+        "SMTP_USER": get_secret_or_env("SMTP_USER"),
+        "SMTP_PASS": get_secret_or_env("SMTP_PASS"),
+        "SMTP_FROM": get_secret_or_env("SMTP_FROM"),
+        "EMAIL_CONFIRM_MINUTES": int(get_secret_or_env("EMAIL_CONFIRM_MINUTES", "60")),
+        "SQLALCHEMY_DATABASE_URI": database_uri(),
+        "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+        "BOOTSTRAP_DB": env_truthy(os.environ.get("BOOTSTRAP_DB", "true")),
+    }
+
+    # Auto-detect SSL/TLS based on port
+    smtp_port = config["SMTP_PORT"]
+    if smtp_port == "465":
+        # Port 465 requires SMTP_SSL (implicit SSL)
+        config["SMTP_USE_SSL"] = True
+        config["SMTP_USE_TLS"] = False
+    elif smtp_port == "587":
+        # Port 587 requires STARTTLS
+        config["SMTP_USE_SSL"] = False
+        config["SMTP_USE_TLS"] = True
+    else:
+        # Use manual configuration or defaults
+        config["SMTP_USE_TLS"] = env_truthy(get_secret_or_env("SMTP_USE_TLS", "false"))
+        config["SMTP_USE_SSL"] = env_truthy(get_secret_or_env("SMTP_USE_SSL", "false"))
+
+    if config["SMTP_HOST"]:
+        logger.info(
+            "SMTP configurado",
+            extra={
+                "smtp_host": config["SMTP_HOST"],
+                "smtp_port": config["SMTP_PORT"],
+                "smtp_use_ssl": config["SMTP_USE_SSL"],
+                "smtp_use_tls": config["SMTP_USE_TLS"],
+            },
+        )
+    else:
+        logger.warning("SMTP_HOST nao configurado em app.config")
+
+    return config
@@ -0,0 +1,206 @@
+"""
+Contadores de progresso do fluxo: total_atividades, concluidas e liberadas
+(liberada e ainda não concluída) em cada cenário, somados por fase e por
+projeto. As telas mostram o progresso sem carregar as atividades.
+
+Manutenção na mesma transação da alteração:
+- mudanças feitas pelo ORM (criar, concluir, reabrir, liberar, mover de
+  cenário, excluir) são capturadas no after_flush deste módulo, pela
+  diferença entre o estado antigo e o novo de cada atividade;
+- os comandos em lote (deletion.py, dependencias.liberar_desbloqueadas)
+  chamam aplicar() com os deltas que calculam.
+
+recalcular() refaz tudo a partir das atividades, para corrigir divergências:
+    python contadores.py [--projeto ID]
+"""
+
+import logging
+
+from sqlalchemy import and_, bindparam, event, func, or_, select, true, update
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import Session
+
+from models import db, Atividade, Cenario, Fase, Projeto
+
+logger = logging.getLogger("imsis.contadores")
+
+CAMPOS = ("total_atividades", "concluidas", "liberadas")
+
+
+def contribuicao(data_liberacao, data_conclusao):
+    """Quanto uma atividade soma em (total_atividades, concluidas, liberadas)"""
+    return (1, 1 if data_conclusao else 0, 1 if data_liberacao and not data_conclusao else 0)
+
+
+def _somar(deltas, cenario_id, valores, sinal=1):
+    if cenario_id is None:
+        return
+    acumulado = deltas.setdefault(cenario_id, [0, 0, 0])
+    for i, valor in enumerate(valores):
+        acumulado[i] += sinal * valor
+
+
+def aplicar(conexao, deltas):
+    """Soma `deltas` ({cenario_id: [total, concluidas, liberadas]}) no cenário, na fase e no projeto"""
+    deltas = {cenario_id: d for cenario_id, d in deltas.items() if cenario_id is not None and any(d)}
+    if not deltas:
+        return
+
+    cenarios, fases, projetos = Cenario.__table__, Fase.__table__, Projeto.__table__
+    por_tabela = {cenarios: {}, fases: {}, projetos: {}}
+    destinos = conexao.execute(
+        select(cenarios.c.id, cenarios.c.fase_id, cenarios.c.projeto_id).where(cenarios.c.id.in_(deltas))
+    )
+    for cenario_id, fase_id, projeto_id in destinos:
+        for tabela, chave in ((cenarios, cenario_id), (fases, fase_id), (projetos, projeto_id)):
+            if chave is not None:
+                _somar(por_tabela[tabela], chave, deltas[cenario_id])
+
+    # Ordem fixa (cenário -> fase -> projeto, ids crescentes) evita deadlock entre transações
+    for tabela, linhas in por_tabela.items():
+        if not linhas:
+            continue
+        conexao.execute(
+            update(tabela)
+            .where(tabela.c.id == bindparam("b_id"))
+            .values({campo: tabela.c[campo] + bindparam(f"b_{campo}") for campo in CAMPOS}),
+            [
+                {"b_id": chave, **{f"b_{campo}": valor for campo, valor in zip(CAMPOS, valores)}}
+                for chave, valores in sorted(linhas.items())
+            ],
+        )
+
+
+def deltas_de_select(atividade_ids, sinal=1):
+    """Deltas por cenário das atividades do select `atividade_ids` (antes de excluir/liberar em lote)"""
+    linhas = db.session.execute(
+        select(Atividade.cenario_id, Atividade.data_liberacao.isnot(None), Atividade.data_conclusao.isnot(None), func.count())
+        .where(Atividade.id.in_(atividade_ids))
+        .group_by(Atividade.cenario_id, Atividade.data_liberacao.isnot(None), Atividade.data_conclusao.isnot(None))
+    )
+    deltas = {}
+    for cenario_id, liberada, concluida, quantidade in linhas:
+        _somar(deltas, cenario_id, [quantidade * v for v in contribuicao(liberada, concluida)], sinal)
+    return deltas
+
+
+def atualizar_em_lote(atividade_ids, comando):
+    """Executa `comando` (UPDATE em lote sobre as atividades do select/lista `atividade_ids`) ajustando os contadores"""
+    deltas = deltas_de_select(atividade_ids, -1)
+    db.session.execute(comando, execution_options={"synchronize_session": "fetch"})
+    for cenario_id, valores in deltas_de_select(atividade_ids).items():
+        _somar(deltas, cenario_id, valores)
+    aplicar(db.session.connection(), deltas)
+
+
+def _valor_anterior(estado, atributo):
+    historico = estado.attrs[atributo].history
+    if historico.deleted:
+        return historico.deleted[0]
+    if historico.unchanged:
+        return historico.unchanged[0]
+    return getattr(estado.object, atributo)
+
+
+@event.listens_for(Session, "after_flush")
+def _contadores_apos_flush(session, flush_context):
+    deltas = {}
+    for obj in session.new:
+        if isinstance(obj, Atividade):
+            _somar(deltas, obj.cenario_id, contribuicao(obj.data_liberacao, obj.data_conclusao))
+    for obj in session.deleted:
+        if isinstance(obj, Atividade):
+            estado = sa_inspect(obj)
+            _somar(
+                deltas,
+                _valor_anterior(estado, "cenario_id"),
+                contribuicao(_valor_anterior(estado, "data_liberacao"), _valor_anterior(estado, "data_conclusao")),
+                -1,
+            )
+    for obj in session.dirty:
+        if not isinstance(obj, Atividade) or not session.is_modified(obj, include_collections=False):
+            continue
+        estado = sa_inspect(obj)
+        _somar(
+            deltas,
+            _valor_anterior(estado, "cenario_id"),
+            contribuicao(_valor_anterior(estado, "data_liberacao"), _valor_anterior(estado, "data_conclusao")),
+            -1,
+        )
+        _somar(deltas, obj.cenario_id, contribuicao(obj.data_liberacao, obj.data_conclusao))
+    if deltas:
+        aplicar(session.connection(), deltas)
+
+
+# ------------------------------------------------------------------------------
+# REPARO
+# ------------------------------------------------------------------------------
+def _agregados_cenario(cenarios):
+    def contar(*condicoes):
+        return (
+            select(func.count(Atividade.id))
+            .where(Atividade.cenario_id == cenarios.c.id, *condicoes)
+            .scalar_subquery()
+        )
+
+    return {
+        "total_atividades": contar(),
+        "concluidas": contar(Atividade.data_conclusao.isnot(None)),
+        "liberadas": contar(Atividade.data_liberacao.isnot(None), Atividade.data_conclusao.is_(None)),
+    }
+
+
+def _agregados_pai(tabela, coluna_filho):
+    cenarios = Cenario.__table__.alias("c")
+    return {
+        campo: select(func.coalesce(func.sum(cenarios.c[campo]), 0))
+        .where(cenarios.c[coluna_filho] == tabela.c.id)
+        .scalar_subquery()
+        for campo in CAMPOS
+    }
+
+
+def _divergentes(tabela, agregados, filtro):
+    diferente = or_(*(tabela.c[campo] != valor for campo, valor in agregados.items()))
+    return db.session.scalar(select(func.count()).select_from(tabela).where(and_(filtro, diferente)))
+
+
+def recalcular(projeto_id=None):
+    """
+    Recalcula os contadores (de um projeto ou de todos) a partir das
+    atividades. Devolve quantas linhas estavam divergentes por tabela.
+    Não faz commit.
+    """
+    cenarios, fases, projetos = Cenario.__table__, Fase.__table__, Projeto.__table__
+    etapas = (
+        ("cenarios", cenarios, _agregados_cenario(cenarios), cenarios.c.projeto_id),
+        ("fases", fases, _agregados_pai(fases, "fase_id"), fases.c.projeto_id),
+        ("projetos", projetos, _agregados_pai(projetos, "projeto_id"), projetos.c.id),
+    )
+    divergentes = {}
+    for nome, tabela, agregados, coluna_projeto in etapas:
+        filtro = coluna_projeto == projeto_id if projeto_id is not None else true()
+        divergentes[nome] = _divergentes(tabela, agregados, filtro)
+        if divergentes[nome]:
+            db.session.execute(update(tabela).where(filtro).values(agregados))
+    if any(divergentes.values()):
+        logger.warning("Contadores de progresso divergentes corrigidos", extra={"projeto_id": projeto_id, **divergentes})
+    return divergentes
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from app import create_app
+    from app_logging import configure_logging
+
+    parser = argparse.ArgumentParser(description="Recalcula os contadores de progresso do fluxo")
+    parser.add_argument("--projeto", type=int, help="Apenas este projeto (padrão: todos)")
+    args = parser.parse_args()
+
+    configure_logging()
+    app = create_app({"BOOTSTRAP_DB": False})
+    with app.app_context():
+        resultado = recalcular(args.projeto)
+        db.session.commit()
+        logger.info("Contadores recalculados", extra=resultado)
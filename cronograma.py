@@ -0,0 +1,273 @@
+"""
+Previsão de prazos de fases e cenários pelo caminho crítico.
+
+A duração de cada atividade é estimada pelo histórico do próprio projeto
+(data_conclusao - data_liberacao das atividades concluídas): mediana do
+responsável, senão do cenário, senão do projeto, senão DURACAO_PADRAO.
+
+O grafo usado é o de atividade_dependencias mais, nos cenários sem
+dependências explícitas, a sequência linear por numero_sequencial (a mesma
+regra de liberação do dependencias.py). Um passe de ordenação topológica
+calcula início/fim previstos e um passe reverso calcula a folga, ambos
+O(V+E). O resultado fica em cache por projeto enquanto Projeto.versao_fluxo
+não mudar (e no máximo CACHE_TTL_SEGUNDOS, porque atividades em andamento
+são projetadas a partir do horário atual).
+"""
+
+import statistics
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+import metrics
+from models import db, Atividade, Cenario, DependenciaAtividade, Fase, Projeto
+
+DURACAO_PADRAO = timedelta(days=1)
+CACHE_MAX_PROJETOS = 128
+CACHE_TTL_SEGUNDOS = 300
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def estatisticas_duracao(atividades):
+    """Medianas de duração (segundos) por responsável, por cenário e do projeto"""
+    por_responsavel, por_cenario, todas = {}, {}, []
+    for atv in atividades:
+        if not (atv.data_liberacao and atv.data_conclusao) or atv.data_conclusao < atv.data_liberacao:
+            continue
+        segundos = (atv.data_conclusao - atv.data_liberacao).total_seconds()
+        todas.append(segundos)
+        if atv.responsavel_id is not None:
+            por_responsavel.setdefault(atv.responsavel_id, []).append(segundos)
+        por_cenario.setdefault(atv.cenario_id, []).append(segundos)
+    return {
+        "responsavel": {k: statistics.median(v) for k, v in por_responsavel.items()},
+        "cenario": {k: statistics.median(v) for k, v in por_cenario.items()},
+        "projeto": statistics.median(todas) if todas else None,
+    }
+
+
+def duracao_estimada(atv, estatisticas):
+    segundos = (
+        estatisticas["responsavel"].get(atv.responsavel_id)
+        or estatisticas["cenario"].get(atv.cenario_id)
+        or estatisticas["projeto"]
+    )
+    return timedelta(seconds=segundos) if segundos else DURACAO_PADRAO
+
+
+def arestas_do_projeto(atividades, dependencias):
+    """
+    Dependências explícitas + sequência linear dos cenários: quem não tem
+    aresta de entrada depende da anterior do cenário (dependencias.py)
+    """
+    arestas = list(dependencias)
+    com_entrada = {s for _, s in arestas}
+
+    por_cenario = {}
+    for atv in atividades:
+        if atv.cenario_id is not None:
+            por_cenario.setdefault(atv.cenario_id, []).append(atv)
+    for lista in por_cenario.values():
+        lista.sort(key=lambda a: (a.numero_sequencial, a.id))
+        arestas.extend(
+            (anterior.id, atual.id) for anterior, atual in zip(lista, lista[1:]) if atual.id not in com_entrada
+        )
+    return arestas
+
+
+def calcular(atividades, dependencias, agora=None):
+    """
+    Início/fim previstos, folga e caminho crítico. `atividades` precisa de
+    id, cenario_id, numero_sequencial, responsavel_id, data_liberacao e
+    data_conclusao; `dependencias` é uma lista de (predecessora_id, sucessora_id).
+    """
+    agora = agora or datetime.utcnow()
+    estatisticas = estatisticas_duracao(atividades)
+    por_id = {a.id: a for a in atividades}
+    arestas = [(p, s) for p, s in arestas_do_projeto(atividades, dependencias) if p in por_id and s in por_id]
+
+    sucessoras = {a_id: [] for a_id in por_id}
+    predecessoras = {a_id: [] for a_id in por_id}
+    for p, s in arestas:
+        sucessoras[p].append(s)
+        predecessoras[s].append(p)
+
+    # Passe direto (Kahn): o início espera o fim da predecessora mais tardia
+    grau = {a_id: len(predecessoras[a_id]) for a_id in por_id}
+    fila = deque(sorted(a_id for a_id, g in grau.items() if g == 0))
+    ordem, inicio, fim, determinante = [], {}, {}, {}
+    while fila:
+        a_id = fila.popleft()
+        ordem.append(a_id)
+        atv = por_id[a_id]
+        duracao = duracao_estimada(atv, estatisticas)
+        pronto = max((fim[p] for p in predecessoras[a_id]), default=agora)
+        if predecessoras[a_id]:
+            determinante[a_id] = max(predecessoras[a_id], key=lambda p: fim[p])
+
+        if atv.data_conclusao:
+            inicio[a_id] = atv.data_liberacao or atv.data_conclusao - duracao
+            fim[a_id] = atv.data_conclusao
+        elif atv.data_liberacao:
+            inicio[a_id] = atv.data_liberacao
+            fim[a_id] = max(agora, atv.data_liberacao + duracao)
+        else:
+            inicio[a_id] = max(agora, pronto)
+            fim[a_id] = inicio[a_id] + duracao
+
+        for s in sucessoras[a_id]:
+            grau[s] -= 1
+            if grau[s] == 0:
+                fila.append(s)
+
+    # Ciclos não passam pela validação de inserção; se existirem, ficam de fora
+    fora_do_grafo = [a_id for a_id in por_id if a_id not in fim]
+    if not ordem:
+        return {
+            "inicio": {},
+            "fim": {},
+            "folga": {},
+            "caminho_critico": [],
+            "fim_previsto": None,
+            "fora_do_grafo": fora_do_grafo,
+        }
+
+    fim_projeto = max(fim.values())
+
+    # Passe reverso: fim mais tardio que não atrasa o projeto
+    fim_tardio = {}
+    for a_id in reversed(ordem):
+        fim_tardio[a_id] = min(
+            (fim_tardio[s] - (fim[s] - inicio[s]) for s in sucessoras[a_id] if s in fim_tardio),
+            default=fim_projeto,
+        )
+    folga = {a_id: max(timedelta(0), fim_tardio[a_id] - fim[a_id]) for a_id in ordem}
+
+    caminho = [max(fim, key=lambda a_id: (fim[a_id], a_id))]
+    while caminho[-1] in determinante:
+        caminho.append(determinante[caminho[-1]])
+    caminho.reverse()
+
+    return {
+        "inicio": inicio,
+        "fim": fim,
+        "folga": folga,
+        "caminho_critico": caminho,
+        "fim_previsto": fim_projeto,
+        "fora_do_grafo": fora_do_grafo,
+    }
+
+
+def _iso(valor):
+    return valor.isoformat(timespec="minutes") if valor else None
+
+
+def montar_cronograma(projeto_id, agora=None):
+    agora = agora or datetime.utcnow()
+    atividades = db.session.execute(
+        select(
+            Atividade.id,
+            Atividade.descricao,
+            Atividade.cenario_id,
+            Atividade.numero_sequencial,
+            Atividade.responsavel,
+            Atividade.responsavel_id,
+            Atividade.data_liberacao,
+            Atividade.data_conclusao,
+        ).where(Atividade.projeto_id == projeto_id)
+    ).all()
+    dependencias = db.session.execute(
+        select(DependenciaAtividade.predecessora_id, DependenciaAtividade.sucessora_id)
+        .where(DependenciaAtividade.projeto_id == projeto_id)
+    ).all()
+    cenarios = db.session.execute(
+        select(Cenario.id, Cenario.cenario, Cenario.fase_id).where(Cenario.projeto_id == projeto_id).order_by(Cenario.id)
+    ).all()
+    fases = db.session.execute(
+        select(Fase.id, Fase.nome).where(Fase.projeto_id == projeto_id).order_by(Fase.id)
+    ).all()
+
+    resultado = calcular(atividades, [tuple(d) for d in dependencias], agora)
+    inicio, fim, folga = resultado["inicio"], resultado["fim"], resultado["folga"]
+    criticas = set(resultado["caminho_critico"])
+
+    def resumo(ids):
+        ids = [a_id for a_id in ids if a_id in fim]
+        return {
+            "inicio_previsto": _iso(min((inicio[a] for a in ids), default=None)),
+            "fim_previsto": _iso(max((fim[a] for a in ids), default=None)),
+        }
+
+    por_cenario = {}
+    for atv in atividades:
+        por_cenario.setdefault(atv.cenario_id, []).append(atv)
+
+    cenarios_json = []
+    por_fase = {}
+    for c in cenarios:
+        lista = por_cenario.get(c.id, [])
+        ids = [a.id for a in lista]
+        por_fase.setdefault(c.fase_id, []).extend(ids)
+        cenarios_json.append({
+            "id": c.id,
+            "nome": c.cenario,
+            "fase_id": c.fase_id,
+            "total": len(lista),
+            "concluidas": sum(1 for a in lista if a.data_conclusao),
+            "critico": any(a_id in criticas for a_id in ids),
+            **resumo(ids),
+        })
+
+    return {
+        "projeto_id": projeto_id,
+        "gerado_em": _iso(agora),
+        "fim_previsto": _iso(resultado["fim_previsto"]),
+        "caminho_critico": resultado["caminho_critico"],
+        "fora_do_grafo": resultado["fora_do_grafo"],
+        "fases": [{"id": f.id, "nome": f.nome, **resumo(por_fase.get(f.id, []))} for f in fases],
+        "cenarios": cenarios_json,
+        "atividades": [
+            {
+                "id": a.id,
+                "descricao": a.descricao,
+                "cenario_id": a.cenario_id,
+                "numero_sequencial": a.numero_sequencial,
+                "responsavel": a.responsavel,
+                "concluida": bool(a.data_conclusao),
+                "inicio_previsto": _iso(inicio.get(a.id)),
+                "fim_previsto": _iso(fim.get(a.id)),
+                "folga_horas": (
+                    round(folga[a.id].total_seconds() / 3600, 1) if a.id in folga and not a.data_conclusao else None
+                ),
+                "critica": a.id in criticas,
+            }
+            for a in sorted(atividades, key=lambda a: (a.cenario_id or 0, a.numero_sequencial, a.id))
+        ],
+    }
+
+
+def cronograma_projeto(projeto_id):
+    """Cronograma do projeto, reaproveitado enquanto a versão do fluxo não mudar"""
+    versao = db.session.scalar(select(Projeto.versao_fluxo).where(Projeto.id == projeto_id))
+    agora = time.monotonic()
+    with _cache_lock:
+        item = _cache.get(projeto_id)
+        if item and item[0] == versao and agora - item[1] < CACHE_TTL_SEGUNDOS:
+            _cache.move_to_end(projeto_id)
+            metrics.cache_hit("cronograma")
+            return item[2]
+    metrics.cache_miss("cronograma")
+
+    resultado = montar_cronograma(projeto_id)
+    resultado["versao"] = versao
+    with _cache_lock:
+        _cache[projeto_id] = (versao, agora, resultado)
+        _cache.move_to_end(projeto_id)
+        while len(_cache) > CACHE_MAX_PROJETOS:
+            _cache.popitem(last=False)
+    return resultado
@@ -0,0 +1,71 @@
+"""
+Exclusão em cascata de fases, cenários e atividades.
+
+Em vez de carregar cada cenário na sessão e apagar um a um, cada nível é
+removido com um único DELETE ... WHERE ... IN (SELECT ...). Referências
+opcionais (incidentes -> atividade, lições -> fase) são anuladas no mesmo
+lote, para não deixar ids órfãos, e as dependências entre atividades são
+desfeitas pelo dependencias.py, que depois libera o que ficou livre nos
+cenários afetados. Como são comandos em lote (fora dos eventos
+do ORM), a versão do fluxo do projeto, os contadores de progresso e o índice
+da busca no projeto são ajustados aqui, assim como a versão (edicao.py)
+dos incidentes e lições anulados e a trilha de auditoria (auditoria.py).
+
+O número de comandos é constante, independente do tamanho da fase.
+As funções não fazem commit: o chamador controla a transação.
+"""
+
+from sqlalchemy import delete, select, update
+
+import auditoria
+import busca
+import contadores
+import dependencias
+from models import db, incrementar_versao_fluxo, Atividade, Cenario, Fase, Incidente, LicaoAprendida
+
+_BULK = {"synchronize_session": False}
+
+
+def _tocar_projeto(projeto_id):
+    if projeto_id is not None:
+        incrementar_versao_fluxo(db.session.connection(), [projeto_id])
+
+
+def _excluir_atividades_where(condicao):
+    atividade_ids = select(Atividade.id).where(condicao)
+    cenarios = dependencias.desvincular_atividades(atividade_ids)
+    contadores.aplicar(db.session.connection(), contadores.deltas_de_select(atividade_ids, -1))
+    auditoria.capturar_update(Incidente, Incidente.atividade_id.in_(atividade_ids), {"atividade_id": None})
+    db.session.execute(
+        update(Incidente).where(Incidente.atividade_id.in_(atividade_ids)).values(atividade_id=None, versao=Incidente.versao + 1),
+        execution_options=_BULK,
+    )
+    busca.remover("atividade", atividade_ids)
+    auditoria.capturar_exclusao(Atividade, condicao)
+    db.session.execute(delete(Atividade).where(condicao), execution_options=_BULK)
+    for cenario_id in cenarios:
+        dependencias.liberar_iniciais(cenario_id)
+
+
+def excluir_atividade(atividade_id):
+    _tocar_projeto(db.session.scalar(select(Atividade.projeto_id).where(Atividade.id == atividade_id)))
+    _excluir_atividades_where(Atividade.id == atividade_id)
+
+
+def excluir_cenario(cenario_id):
+    _tocar_projeto(db.session.scalar(select(Cenario.projeto_id).where(Cenario.id == cenario_id)))
+    _excluir_atividades_where(Atividade.cenario_id == cenario_id)
+    db.session.execute(delete(Cenario).where(Cenario.id == cenario_id), execution_options=_BULK)
+
+
+def excluir_fase(fase_id):
+    _tocar_projeto(db.session.scalar(select(Fase.projeto_id).where(Fase.id == fase_id)))
+    cenario_ids = select(Cenario.id).where(Cenario.fase_id == fase_id)
+    _excluir_atividades_where(Atividade.cenario_id.in_(cenario_ids))
+    db.session.execute(delete(Cenario).where(Cenario.fase_id == fase_id), execution_options=_BULK)
+    auditoria.capturar_update(LicaoAprendida, LicaoAprendida.fase_id == fase_id, {"fase_id": None})
+    db.session.execute(
+        update(LicaoAprendida).where(LicaoAprendida.fase_id == fase_id).values(fase_id=None, versao=LicaoAprendida.versao + 1),
+        execution_options=_BULK,
+    )
+    db.session.execute(delete(Fase).where(Fase.id == fase_id), execution_options=_BULK)
@@ -0,0 +1,322 @@
+"""
+Dependências entre atividades e motor de liberação.
+
+Cada atividade guarda em `predecessoras_pendentes` quantas predecessoras
+(atividade_dependencias) ainda não foram concluídas. Concluir uma atividade
+decrementa o contador só das suas sucessoras diretas e libera as que chegam
+a zero, sem percorrer o grafo. Reabrir faz o caminho inverso.
+
+Atividade sem dependência explícita de entrada segue o fluxo linear: a
+predecessora implícita é a anterior do cenário por numero_sequencial, e
+concluir uma atividade libera a próxima. Só as atividades com arestas de
+entrada trocam a sequência pelo grafo; assim, ligar B2 -> B4 num cenário
+linear não libera nada além do que a própria aresta muda, e atividades
+cujas predecessoras foram concluídas são liberadas juntas (ramos
+paralelos). Cada liberação gera uma notificação para o responsável da
+atividade (notificacoes.py). Renumerar o cenário (reposicionar) refaz a
+liberação pela nova ordem.
+
+As funções não fazem commit: o chamador controla a transação.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import bindparam, delete, exists, func, or_, select, update
+
+import auditoria
+import contadores
+import notificacoes
+from models import db, Atividade, DependenciaAtividade, Projeto
+
+_BULK = {"synchronize_session": False}
+
+
+class DependenciaInvalida(ValueError):
+    """Dependência rejeitada (ciclo, projetos diferentes, duplicada...)"""
+
+
+def _tem_predecessora_explicita():
+    return exists().where(DependenciaAtividade.sucessora_id == Atividade.id)
+
+
+def _sequencia_do_cenario(cenario_id):
+    """Atividades do cenário na ordem do fluxo, com a flag de aresta de entrada"""
+    return db.session.execute(
+        select(
+            Atividade.id,
+            Atividade.predecessoras_pendentes,
+            Atividade.data_liberacao,
+            Atividade.data_conclusao,
+            _tem_predecessora_explicita().label("explicita"),
+        )
+        .where(Atividade.cenario_id == cenario_id)
+        .order_by(Atividade.numero_sequencial, Atividade.id)
+    ).all()
+
+
+def _avaliar_sequencia(linhas):
+    """
+    (linha, liberavel) para cada atividade: com aresta de entrada vale o
+    contador de predecessoras; sem, a anterior do cenário precisa estar
+    concluída (a primeira sempre pode começar).
+    """
+    anterior_concluida = True
+    for linha in linhas:
+        if linha.explicita:
+            yield linha, (linha.predecessoras_pendentes or 0) <= 0
+        else:
+            yield linha, anterior_concluida
+        anterior_concluida = linha.data_conclusao is not None
+
+
+def _alcanca(projeto_id, origem, destino):
+    """Busca em profundidade nas arestas do projeto: há caminho origem -> destino?"""
+    adjacencia = {}
+    arestas = db.session.execute(
+        select(DependenciaAtividade.predecessora_id, DependenciaAtividade.sucessora_id)
+        .where(DependenciaAtividade.projeto_id == projeto_id)
+    )
+    for predecessora_id, sucessora_id in arestas:
+        adjacencia.setdefault(predecessora_id, []).append(sucessora_id)
+
+    pilha, vistos = [origem], {origem}
+    while pilha:
+        atual = pilha.pop()
+        if atual == destino:
+            return True
+        for proxima in adjacencia.get(atual, ()):
+            if proxima not in vistos:
+                vistos.add(proxima)
+                pilha.append(proxima)
+    return False
+
+
+def _ajustar_pendentes(atividade_ids, delta):
+    if atividade_ids:
+        db.session.execute(
+            update(Atividade)
+            .where(Atividade.id.in_(atividade_ids))
+            .values(predecessoras_pendentes=Atividade.predecessoras_pendentes + delta),
+            execution_options=_BULK,
+        )
+
+
+def liberar_desbloqueadas(atividade_ids, agora=None):
+    """Libera, entre `atividade_ids`, as que não têm predecessoras pendentes"""
+    if not atividade_ids:
+        return []
+    liberaveis = db.session.scalars(
+        select(Atividade.id).where(
+            Atividade.id.in_(atividade_ids),
+            Atividade.predecessoras_pendentes <= 0,
+            Atividade.data_liberacao.is_(None),
+            Atividade.data_conclusao.is_(None),
+        )
+    ).all()
+    if liberaveis:
+        agora = agora or datetime.utcnow()
+        auditoria.capturar_update(Atividade, Atividade.id.in_(liberaveis), {"data_liberacao": agora})
+        contadores.atualizar_em_lote(
+            liberaveis,
+            update(Atividade).where(Atividade.id.in_(liberaveis)).values(data_liberacao=agora),
+        )
+        notificacoes.atividades_liberadas(liberaveis)
+    return liberaveis
+
+
+def liberar_iniciais(cenario_id, agora=None):
+    """
+    Libera as atividades do cenário que já podem começar e ainda não foram
+    liberadas: a primeira da sequência, as que vêm depois de uma concluída
+    e as com arestas de entrada cujas predecessoras já foram concluídas.
+    """
+    if cenario_id is None:
+        return []
+    return liberar_desbloqueadas(
+        [linha.id for linha, liberavel in _avaliar_sequencia(_sequencia_do_cenario(cenario_id)) if liberavel],
+        agora,
+    )
+
+
+def reposicionar(cenario_id, agora=None):
+    """
+    Depois de renumerar o cenário (sequencia.reordenar/abrir_espaco): as
+    atividades sem aresta de entrada liberadas e não concluídas que agora
+    vêm depois de uma aberta voltam a aguardar, e o novo ponto de partida
+    é liberado. Devolve (recolhidas, liberadas).
+    """
+    if cenario_id is None:
+        return [], []
+    recolhidas = [
+        linha.id
+        for linha, liberavel in _avaliar_sequencia(_sequencia_do_cenario(cenario_id))
+        if not liberavel and not linha.explicita and linha.data_liberacao and not linha.data_conclusao
+    ]
+    if recolhidas:
+        auditoria.capturar_update(Atividade, Atividade.id.in_(recolhidas), {"data_liberacao": None})
+        contadores.atualizar_em_lote(
+            recolhidas,
+            update(Atividade).where(Atividade.id.in_(recolhidas)).values(data_liberacao=None),
+        )
+    return recolhidas, liberar_iniciais(cenario_id, agora)
+
+
+def concluir(atividade, agora=None):
+    """
+    Conclui a atividade e devolve as atividades liberadas por ela. Concluir
+    de novo (reenvio do formulário) não faz nada: as sucessoras já foram
+    decrementadas na primeira vez. A linha é relida com lock (PostgreSQL)
+    para que dois envios simultâneos não decrementem as sucessoras duas vezes.
+    """
+    if atividade.id is not None:
+        db.session.refresh(atividade, ["data_conclusao"], with_for_update=True)
+    if atividade.data_conclusao:
+        return []
+    agora = agora or datetime.utcnow()
+    atividade.data_conclusao = agora
+    db.session.flush()
+
+    sucessoras = db.session.scalars(
+        select(DependenciaAtividade.sucessora_id).where(DependenciaAtividade.predecessora_id == atividade.id)
+    ).all()
+    _ajustar_pendentes(sucessoras, -1)
+    candidatas = list(sucessoras)
+    if atividade.cenario_id is not None:
+        # Fluxo linear: a próxima do cenário, se não depender de arestas
+        proxima = db.session.scalar(
+            select(Atividade.id)
+            .where(
+                Atividade.cenario_id == atividade.cenario_id,
+                or_(
+                    Atividade.numero_sequencial > atividade.numero_sequencial,
+                    (Atividade.numero_sequencial == atividade.numero_sequencial) & (Atividade.id > atividade.id),
+                ),
+            )
+            .order_by(Atividade.numero_sequencial, Atividade.id)
+            .limit(1)
+        )
+        if proxima is not None and not db.session.scalar(
+            select(exists().where(DependenciaAtividade.sucessora_id == proxima))
+        ):
+            candidatas.append(proxima)
+    liberadas = liberar_desbloqueadas(candidatas, agora)
+
+    if not liberadas:
+        return []
+    return (
+        Atividade.query
+        .execution_options(populate_existing=True)
+        .filter(Atividade.id.in_(liberadas))
+        .order_by(Atividade.numero_sequencial)
+        .all()
+    )
+
+
+def reabrir(atividade):
+    """
+    Volta a atividade para não concluída. As sucessoras passam a ter de novo
+    uma predecessora pendente; liberações já feitas não são desfeitas.
+    """
+    if not atividade.data_conclusao:
+        return False
+    atividade.data_conclusao = None
+    sucessoras = db.session.scalars(
+        select(DependenciaAtividade.sucessora_id).where(DependenciaAtividade.predecessora_id == atividade.id)
+    ).all()
+    _ajustar_pendentes(sucessoras, 1)
+    return True
+
+
+def adicionar_dependencia(predecessora, sucessora):
+    if predecessora.id == sucessora.id:
+        raise DependenciaInvalida("Uma atividade não pode depender de si mesma")
+    if predecessora.projeto_id is None or predecessora.projeto_id != sucessora.projeto_id:
+        raise DependenciaInvalida("As atividades precisam ser do mesmo projeto")
+
+    # Serializa inserções de arestas por projeto (PostgreSQL) para que duas
+    # requisições simultâneas não fechem um ciclo entre si
+    db.session.execute(select(Projeto.id).where(Projeto.id == predecessora.projeto_id).with_for_update())
+
+    duplicada = db.session.scalar(
+        select(
+            exists().where(
+                DependenciaAtividade.predecessora_id == predecessora.id,
+                DependenciaAtividade.sucessora_id == sucessora.id,
+            )
+        )
+    )
+    if duplicada:
+        raise DependenciaInvalida("Dependência já cadastrada")
+    if _alcanca(predecessora.projeto_id, sucessora.id, predecessora.id):
+        raise DependenciaInvalida("A dependência criaria um ciclo")
+
+    dependencia = DependenciaAtividade(
+        projeto_id=predecessora.projeto_id,
+        predecessora_id=predecessora.id,
+        sucessora_id=sucessora.id,
+    )
+    db.session.add(dependencia)
+    if not predecessora.data_conclusao:
+        sucessora.predecessoras_pendentes = (sucessora.predecessoras_pendentes or 0) + 1
+    db.session.flush()
+    liberar_iniciais(predecessora.cenario_id)
+    if sucessora.cenario_id != predecessora.cenario_id:
+        liberar_iniciais(sucessora.cenario_id)
+    return dependencia
+
+
+def remover_dependencia(dependencia, agora=None):
+    predecessora, sucessora = dependencia.predecessora, dependencia.sucessora
+    db.session.delete(dependencia)
+    if not predecessora.data_conclusao:
+        sucessora.predecessoras_pendentes = max(0, (sucessora.predecessoras_pendentes or 0) - 1)
+    db.session.flush()
+    if sucessora.cenario_id is None:
+        liberar_desbloqueadas([sucessora.id], agora)
+    for cenario_id in {predecessora.cenario_id, sucessora.cenario_id}:
+        liberar_iniciais(cenario_id, agora)
+
+
+def desvincular_atividades(atividade_ids):
+    """
+    Antes de excluir as atividades do select `atividade_ids`: sucessoras que
+    ficam perdem as predecessoras excluídas ainda pendentes e as arestas que
+    tocam as atividades são removidas. Devolve os cenários a passar por
+    liberar_iniciais depois da exclusão (o das sucessoras e o das excluídas,
+    cuja próxima na sequência pode ficar livre).
+    """
+    D = DependenciaAtividade
+    cenarios = set(db.session.scalars(
+        select(Atividade.cenario_id).where(
+            Atividade.cenario_id.isnot(None),
+            or_(
+                Atividade.id.in_(atividade_ids),
+                Atividade.id.in_(select(D.sucessora_id).where(D.predecessora_id.in_(atividade_ids))),
+            ),
+        )
+    ))
+    contagem = db.session.execute(
+        select(D.sucessora_id, func.count())
+        .join(Atividade, Atividade.id == D.predecessora_id)
+        .where(
+            D.predecessora_id.in_(atividade_ids),
+            D.sucessora_id.not_in(atividade_ids),
+            Atividade.data_conclusao.is_(None),
+        )
+        .group_by(D.sucessora_id)
+    ).all()
+
+    if contagem:
+        tabela = Atividade.__table__
+        db.session.execute(
+            update(tabela)
+            .where(tabela.c.id == bindparam("b_id"))
+            .values(predecessoras_pendentes=tabela.c.predecessoras_pendentes - bindparam("b_n")),
+            [{"b_id": sucessora_id, "b_n": n} for sucessora_id, n in contagem],
+        )
+
+    db.session.execute(
+        delete(D).where(or_(D.predecessora_id.in_(atividade_ids), D.sucessora_id.in_(atividade_ids))),
+        execution_options=_BULK,
+    )
+    return cenarios
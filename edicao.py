@@ -0,0 +1,189 @@
+"""
+Edição parcial (PATCH) de incidentes, riscos, mudanças e lições, com
+controle de concorrência otimista.
+
+Os quatro registros têm a coluna `versao` (version_id_col do SQLAlchemy):
+todo UPDATE feito pelo ORM leva "WHERE versao = <versão lida>" e grava
+versao + 1. O cliente manda a versão que estava editando e só os campos
+que quer mudar; aplicar() converte os valores, grava apenas os que
+mudaram de fato (o UPDATE contém só essas colunas) e levanta Conflito se
+a versão não confere. A mesma verificação no banco cobre duas gravações
+simultâneas (StaleDataError no commit).
+
+Não faz commit: o chamador controla a transação.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import select
+
+from models import db, Atividade, Fase, Incidente, LicaoAprendida, Risco, SolicitacaoMudanca
+
+Registro = namedtuple("Registro", "modelo permissao campos")
+
+NOTAS = (1, 2, 3, 4, 5)
+
+
+class CampoInvalido(ValueError):
+    pass
+
+
+class Conflito(Exception):
+    """A versão enviada não é a atual do registro"""
+
+
+# ------------------------------------------------------------------------------
+# CONVERSÃO DOS CAMPOS: (valor JSON, projeto_id) -> valor da coluna
+# ------------------------------------------------------------------------------
+def texto(valor, projeto_id):
+    if valor is None or isinstance(valor, str):
+        return valor
+    raise CampoInvalido("deve ser texto")
+
+
+def texto_obrigatorio(valor, projeto_id):
+    if not isinstance(valor, str) or not valor.strip():
+        raise CampoInvalido("não pode ficar vazio")
+    return valor
+
+
+def data(valor, projeto_id):
+    if valor in (None, ""):
+        return None
+    try:
+        return datetime.strptime(valor, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        raise CampoInvalido("use o formato AAAA-MM-DD")
+
+
+def nota(valor, projeto_id):
+    if valor in (None, ""):
+        return None
+    if isinstance(valor, str) and valor.isdigit():
+        valor = int(valor)
+    if valor not in NOTAS or isinstance(valor, bool):
+        raise CampoInvalido("deve ser de 1 a 5")
+    return valor
+
+
+def booleano(valor, projeto_id):
+    if not isinstance(valor, bool):
+        raise CampoInvalido("deve ser true ou false")
+    return valor
+
+
+def do_projeto(modelo):
+    """Id de um `modelo` do mesmo projeto (ou null)"""
+    def converter(valor, projeto_id):
+        if valor in (None, ""):
+            return None
+        if isinstance(valor, bool) or not isinstance(valor, (int, str)) or not str(valor).isdigit():
+            raise CampoInvalido("id inválido")
+        valor = int(valor)
+        if db.session.scalar(select(modelo.id).where(modelo.id == valor, modelo.projeto_id == projeto_id)) is None:
+            raise CampoInvalido("não pertence ao projeto")
+        return valor
+    return converter
+
+
+REGISTROS = {
+    "incidentes": Registro(Incidente, None, {
+        "atividade_id": do_projeto(Atividade),
+        "descricao": texto_obrigatorio,
+        "responsavel": texto,
+        "prioridade": texto,
+        "status": texto,
+        "previsao_original": data,
+        "previsao_revisada": data,
+        "conclusao": data,
+    }),
+    "riscos": Registro(Risco, None, {
+        "area": texto,
+        "tipo_risco": texto,
+        "risco": texto_obrigatorio,
+        "responsavel": texto,
+        "gatilho": texto,
+        "impacto_projeto": texto,
+        "consequencia": texto,
+        "impacto": nota,
+        "probabilidade": nota,
+        "nivel_risco": texto,
+        "estrategia": texto,
+        "prevencao": texto,
+        "contingencia": texto,
+        "status": texto,
+        "data_proxima_acao": data,
+        "data_conclusao": data,
+    }),
+    "mudancas": Registro(SolicitacaoMudanca, "pode_editar_mudanca", {
+        "solicitante": texto,
+        "area_solicitante": texto,
+        "descricao": texto_obrigatorio,
+        "justificativa": texto,
+        "tipo_mudanca": texto,
+        "impacto_prazo": texto,
+        "impacto_custo": texto,
+        "impacto_escopo": texto,
+        "impacto_recursos": texto,
+        "impacto_risco": texto,
+        "prioridade": texto,
+        "recomendacao_pm": texto,
+        "status": texto,
+        "aprovador": texto,
+        "data_decisao": data,
+        "data_implementacao": data,
+        "observacoes": texto,
+    }),
+    "licoes": Registro(LicaoAprendida, "pode_editar_licao", {
+        "fase_id": do_projeto(Fase),
+        "categoria": texto,
+        "tipo": texto,
+        "descricao": texto_obrigatorio,
+        "causa_raiz": texto,
+        "impacto": texto,
+        "acao_tomada": texto,
+        "recomendacao": texto,
+        "responsavel": texto,
+        "status": texto,
+        "aplicavel_futuros": booleano,
+    }),
+}
+
+
+def _json(valor):
+    return valor.strftime("%Y-%m-%d") if isinstance(valor, datetime) else valor
+
+
+def serializar(tipo, registro):
+    """Campos editáveis + id e versao, no formato aceito pelo PATCH"""
+    return {
+        "id": registro.id,
+        "versao": registro.versao,
+        **{campo: _json(getattr(registro, campo)) for campo in REGISTROS[tipo].campos},
+    }
+
+
+def aplicar(tipo, registro, versao, valores):
+    """
+    Valida e aplica `valores` ({campo: valor JSON}) em `registro` editado na
+    `versao`. Devolve os campos que mudaram. CampoInvalido ou Conflito.
+    """
+    campos = REGISTROS[tipo].campos
+    desconhecidos = sorted(set(valores) - set(campos))
+    if desconhecidos:
+        raise CampoInvalido(f"Campo(s) não editável(is): {', '.join(desconhecidos)}")
+    if versao != registro.versao:
+        raise Conflito(registro.versao)
+
+    convertidos = {}
+    for campo, valor in valores.items():
+        try:
+            convertidos[campo] = campos[campo](valor, registro.projeto_id)
+        except CampoInvalido as e:
+            raise CampoInvalido(f"{campo}: {e}")
+
+    alterados = [campo for campo, valor in convertidos.items() if getattr(registro, campo) != valor]
+    for campo in alterados:
+        setattr(registro, campo, convertidos[campo])
+    return alterados
@@ -0,0 +1,163 @@
+"""
+Configuração do Gunicorn para o Cloud Run (e qualquer container).
+
+Workers e threads são dimensionados a partir dos limites de CPU e memória do
+container (cgroup), e tudo pode ser ajustado por variável de ambiente:
+
+    WEB_CONCURRENCY             número de workers (sobrepõe o cálculo automático)
+    GUNICORN_THREADS            threads por worker (padrão 8)
+    GUNICORN_WORKER_MEMORY_MB   memória estimada por worker (padrão 256)
+    GUNICORN_TIMEOUT            segundos até matar um worker travado (padrão 120)
+    GUNICORN_GRACEFUL_TIMEOUT   segundos para terminar requisições no restart (padrão 30)
+    GUNICORN_MAX_REQUESTS       recicla o worker após N requisições (padrão 2000, 0 desliga)
+    GUNICORN_MAX_REQUESTS_JITTER
+    GUNICORN_PRELOAD            carrega a app uma vez no master (padrão true)
+    AGENDADOR_INTERNO           roda as tarefas periódicas (agendador.py) numa thread
+                                de cada worker (padrão false)
+
+Com preload, o import do app (secrets, DDL) roda uma única vez no master;
+cada worker descarta as conexões herdadas do pool logo após o fork.
+"""
+
+import logging
+import os
+
+
+def _env_int(name, default):
+    value = os.environ.get(name, "").strip()
+    return int(value) if value else default
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name, "").strip().lower()
+    if not value:
+        return default
+    return value in {"1", "true", "yes", "on"}
+
+
+def _read_cgroup(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cpu_limit():
+    """CPUs disponíveis respeitando a quota do cgroup (v2 e v1)"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    quota = None
+    cpu_max = _read_cgroup("/sys/fs/cgroup/cpu.max")
+    if cpu_max:
+        limit, period = cpu_max.split()
+        if limit != "max":
+            quota = int(limit) / int(period)
+    else:
+        limit = _read_cgroup("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+        period = _read_cgroup("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        if limit and period and int(limit) > 0:
+            quota = int(limit) / int(period)
+
+    if quota:
+        cpus = min(cpus, max(1, int(round(quota))))
+    return max(1, cpus)
+
+
+def memory_limit_mb():
+    """Limite de memória do container em MB, ou None se ilimitado"""
+    value = _read_cgroup("/sys/fs/cgroup/memory.max") or _read_cgroup("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+    if not value or value == "max":
+        return None
+    limit = int(value)
+    # cgroup v1 reporta um número enorme quando não há limite
+    if limit >= 1 << 60:
+        return None
+    return limit // (1024 * 1024)
+
+
+def default_workers():
+    cpus = cpu_limit()
+    workers = 2 * cpus + 1
+    memory = memory_limit_mb()
+    if memory:
+        per_worker = _env_int("GUNICORN_WORKER_MEMORY_MB", 256)
+        workers = min(workers, max(1, memory // per_worker))
+    return max(1, workers)
+
+
+bind = f":{os.environ.get('PORT', '8080')}"
+worker_class = "gthread"
+workers = _env_int("WEB_CONCURRENCY", default_workers())
+threads = _env_int("GUNICORN_THREADS", 8)
+
+# Cloud Run encerra a requisição em 300s por padrão; matar antes evita
+# workers presos indefinidamente (o antigo --timeout 0 nunca matava)
+timeout = _env_int("GUNICORN_TIMEOUT", 120)
+graceful_timeout = _env_int("GUNICORN_GRACEFUL_TIMEOUT", 30)
+keepalive = _env_int("GUNICORN_KEEPALIVE", 5)
+
+max_requests = _env_int("GUNICORN_MAX_REQUESTS", 2000)
+max_requests_jitter = _env_int("GUNICORN_MAX_REQUESTS_JITTER", max(1, max_requests // 10) if max_requests else 0)
+
+preload_app = _env_bool("GUNICORN_PRELOAD", True)
+agendador_interno = _env_bool("AGENDADOR_INTERNO", False)
+
+# Heartbeat dos workers em memória (o /tmp do container pode ser lento)
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# O Cloud Run já registra cada requisição; os logs da app vão em JSON para stdout
+accesslog = None
+errorlog = "-"
+loglevel = os.environ.get("LOG_LEVEL", "info").lower()
+
+
+def when_ready(server):
+    logging.getLogger("imsis.gunicorn").info(
+        "Gunicorn pronto",
+        extra={
+            "workers": workers,
+            "threads": threads,
+            "timeout": timeout,
+            "max_requests": max_requests,
+            "preload_app": preload_app,
+        },
+    )
+
+
+def post_fork(server, worker):
+    """
+    Com preload_app o pool de conexões foi criado no master (DDL do startup).
+    Conexões não podem ser compartilhadas entre processos: descartar sem fechar
+    (o socket pertence ao master) para cada worker abrir as suas.
+    """
+    if not preload_app:
+        return
+    from app import app, db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    """A app já está carregada no worker: sobe o agendador, se habilitado"""
+    if not agendador_interno:
+        return
+    import agendador
+    from app import app
+
+    agendador.iniciar(app)
+
+
+def worker_exit(server, worker):
+    if agendador_interno:
+        import agendador
+
+        agendador.parar()
+
+
+def worker_abort(worker):
+    logging.getLogger("imsis.gunicorn").error("Worker abortado por timeout", extra={"pid": worker.pid})
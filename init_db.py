@@ -17,7 +17,9 @@ Estes scripts antigos (.py) não precisam mais ser executados:
 A criação de tabelas acontece automaticamente no startup da aplicação.
 """
 
-from app import app, db
+from app import create_app, db
+
+app = create_app()
 
 print(__doc__)
 
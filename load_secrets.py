@@ -3,9 +3,12 @@ Script para carregar secrets do Google Secret Manager como variáveis de ambient
 Necessário porque Cloud Run com --set-secrets frequentemente nao funciona corretamente
 """
 
+import logging
 import os
 import sys
 
+logger = logging.getLogger("imsis.secrets")
+
 
 def load_secret(secret_id):
     """Carrega um secret do Google Secret Manager API"""
@@ -16,26 +19,26 @@ def load_secret(secret_id):
         project_id = os.environ.get("GCP_PROJECT", "imsis-486003")
         
         name = f"projects/{project_id}/secrets/{secret_id}/versions/latest"
-        print(f"[DEBUG load_secret] Tentando ler {secret_id} de {name}")
+        logger.debug("Tentando ler %s de %s", secret_id, name)
         response = client.access_secret_version(request={"name": name})
         secret_string = response.payload.data.decode("UTF-8")
         
         if secret_string:
-            print(f"[OK] Secret '{secret_id}' carregado com sucesso ({len(secret_string)} chars)")
+            logger.debug("Secret '%s' carregado com sucesso", secret_id)
             return secret_string
         else:
-            print(f"[WARN] Secret '{secret_id}' está vazio")
+            logger.warning("Secret '%s' está vazio", secret_id)
             return None
             
     except Exception as e:
-        print(f"[WARN] Erro ao carregar secret {secret_id} da API: {type(e).__name__}: {e}")
+        logger.warning("Erro ao carregar secret %s da API: %s: %s", secret_id, type(e).__name__, e)
         return None
 
 
 def load_secrets():
     """Carrega todos os secrets necessários"""
     
-    print("[DEBUG load_secrets] Iniciando carregamento de secrets")
+    logger.debug("Iniciando carregamento de secrets")
     
     # Check 1: Se ao menos DB_PASS ja esta em os.environ LIMPO (sem BOM)
     # isso significa que o --set-secrets do Cloud Run funcionou
@@ -44,22 +47,22 @@ def load_secrets():
     db_pass = os.environ.get("DB_PASS", "").strip()
     
     if db_pass and not db_pass.startswith("ï»¿"):  # Nao tem BOM
-        print("[INFO] DB_PASS ja esta em os.environ (Cloud Run --set-secrets)")
+        logger.info("DB_PASS ja esta em os.environ (Cloud Run --set-secrets)")
         # Mas ainda tentar carregar SMTP secrets se nao estiverem setados
         if not os.environ.get("SMTP_HOST"):
-            print("[WARN] SMTP_HOST nao encontrado em os.environ, tentando carregar da API...")
+            logger.warning("SMTP_HOST nao encontrado em os.environ, tentando carregar da API...")
             load_secrets_from_api()
         return
     
     # Se DB_PASS tiver BOM ou estiver vazio, precisa recarregar TUDO da API
     if db_pass.startswith("ï»¿"):
-        print("[WARN] DB_PASS tem BOM (corrupao), recarregando todos os secrets da API")
+        logger.warning("DB_PASS tem BOM (corrupao), recarregando todos os secrets da API")
     else:
-        print("[INFO] DB_PASS nao encontrado em os.environ, carregando da API")
+        logger.info("DB_PASS nao encontrado em os.environ, carregando da API")
     
     # Check 2: Se .env existe (desenvolvimento local)
     if os.path.exists(".env"):
-        print("[INFO] Arquivo .env encontrado, carregando variaveis locais...")
+        logger.info("Arquivo .env encontrado, carregando variaveis locais...")
         with open(".env") as f:
             for line in f:
                 line = line.strip()
@@ -67,11 +70,11 @@ def load_secrets():
                     if "=" in line:
                         key, val = line.split("=", 1)
                         os.environ[key.strip()] = val.strip()
-        print("[OK] Variaveis carregadas do .env")
+        logger.info("Variaveis carregadas do .env")
         return
     
     # Check 3: Carregar todos os secrets da API (Cloud Run production)
-    print("[INFO] Carregando secrets do Google Secret Manager API...")
+    logger.info("Carregando secrets do Google Secret Manager API...")
     load_secrets_from_api()
 
 
@@ -91,7 +94,7 @@ def load_secrets_from_api():
     loaded_count = 0
     for env_var, secret_id in secrets_to_load.items():
         if os.environ.get(env_var) and not os.environ.get(env_var).startswith("ï»¿"):
-            print(f"[DEBUG] {env_var} ja esta em os.environ (saltando)")
+            logger.debug("%s ja esta em os.environ (saltando)", env_var)
             loaded_count += 1
             continue
         
@@ -99,18 +102,25 @@ def load_secrets_from_api():
         if secret_value:
             secret_value = secret_value.strip()  # Remove whitespace/BOM
             os.environ[env_var] = secret_value
-            print(f"[OK] {env_var} atribuido de {secret_id}")
+            logger.debug("%s atribuido de %s", env_var, secret_id)
             loaded_count += 1
         else:
-            print(f"[ERROR] Falha ao carregar {env_var} de {secret_id}")
+            logger.error("Falha ao carregar %s de %s", env_var, secret_id)
     
     if loaded_count == len(secrets_to_load):
-        print(f"[OK] Todos os {loaded_count} secrets carregados com sucesso da API")
+        logger.info("Todos os %d secrets carregados com sucesso da API", loaded_count)
     else:
-        print(f"[WARN] Apenas {loaded_count}/{len(secrets_to_load)} secrets carregados da API")
-        print(f"[ERROR] Faltam {len(secrets_to_load) - loaded_count} secrets!")
+        logger.error(
+            "Apenas %d/%d secrets carregados da API (faltam %d)",
+            loaded_count,
+            len(secrets_to_load),
+            len(secrets_to_load) - loaded_count,
+        )
 
 
 if __name__ == "__main__":
+    from app_logging import configure_logging
+
+    configure_logging()
     load_secrets()
 
@@ -0,0 +1,335 @@
+"""
+Métricas no formato de texto do Prometheus, expostas em /metrics.
+
+Os coletores são "lock-light": cada thread do worker escreve no seu próprio
+shard (dict por thread, sem lock); o lock só é usado quando uma thread nova
+cria o seu shard. O scrape soma os shards, então não disputa lock com as
+requisições.
+
+Métricas principais:
+    imsis_http_request_duration_seconds   latência por endpoint (histograma)
+    imsis_http_requests_total             requisições por endpoint/status
+    imsis_db_queries_per_request          queries por requisição (histograma)
+    imsis_db_queries_total / imsis_db_query_duration_seconds
+    imsis_db_pool_*                       estado do pool de conexões
+    imsis_mail_*                          envios, falhas e envios em andamento
+    imsis_cache_requests_total            hits/misses por cache
+    imsis_job_runs_total                  execuções de tarefas agendadas por resultado
+    imsis_audit_rows_total                linhas de auditoria gravadas/perdidas
+
+/metrics é interno e fechado por padrão: com METRICS_TOKEN definido exige
+"Authorization: Bearer <token>"; sem token responde 404, a não ser que
+METRICS_PUBLIC=true (só desenvolvimento local).
+"""
+
+import hmac
+import os
+import threading
+import time
+
+from config import env_truthy
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def _iter_shards(self):
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            # list() copia o dict em C, sem liberar o GIL
+            yield list(shard.items())
+
+    def _labels(self, labelvalues, extra=None):
+        pairs = list(zip(self.labelnames, labelvalues))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+        return "{" + body + "}"
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labelvalues, amount=1):
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def collect(self):
+        totals = {}
+        for items in self._iter_shards():
+            for key, value in items:
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def render(self):
+        lines = self.header()
+        for key, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{self._labels(key)} {_number(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value, *labelvalues):
+        shard = self._shard()
+        data = shard.get(labelvalues)
+        if data is None:
+            # [contagem por bucket..., soma, contagem total]
+            data = [0] * (len(self.buckets) + 2)
+            shard[labelvalues] = data
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[i] += 1
+                break
+        data[-2] += value
+        data[-1] += 1
+
+    def collect(self):
+        totals = {}
+        for items in self._iter_shards():
+            for key, data in items:
+                acc = totals.setdefault(key, [0] * len(data))
+                for i, v in enumerate(data):
+                    acc[i] += v
+        return totals
+
+    def render(self):
+        lines = self.header()
+        for key, data in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._labels(key, ('le', _number(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{self._labels(key, ('le', '+Inf'))} {data[-1]}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_number(data[-2])}")
+            lines.append(f"{self.name}_count{self._labels(key)} {data[-1]}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    Gauge calculado no momento do scrape. A função retorna um número ou um
+    dict {labelvalues: número}.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set_function(self, function):
+        self.function = function
+
+    def render(self):
+        lines = self.header()
+        if self.function is None:
+            return lines
+        try:
+            value = self.function()
+        except Exception:
+            return lines
+        if value is None:
+            return lines
+        if isinstance(value, dict):
+            for key, v in sorted(value.items()):
+                lines.append(f"{self.name}{self._labels(key)} {_number(v)}")
+        else:
+            lines.append(f"{self.name} {_number(value)}")
+        return lines
+
+
+class InFlightGauge(Counter):
+    """Gauge incrementado/decrementado pelas threads (ex.: envios em andamento)"""
+
+    kind = "gauge"
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = Counter(
+    "imsis_http_requests_total",
+    "Requisições HTTP por endpoint, método e status",
+    ("endpoint", "method", "status"),
+)
+HTTP_LATENCY = Histogram(
+    "imsis_http_request_duration_seconds",
+    "Latência das requisições HTTP por endpoint",
+    ("endpoint",),
+)
+DB_QUERIES = Counter("imsis_db_queries_total", "Queries SQL executadas")
+DB_QUERY_LATENCY = Histogram("imsis_db_query_duration_seconds", "Duração das queries SQL")
+DB_QUERIES_PER_REQUEST = Histogram(
+    "imsis_db_queries_per_request",
+    "Queries SQL por requisição, por endpoint",
+    ("endpoint",),
+    buckets=QUERY_COUNT_BUCKETS,
+)
+DB_POOL = Gauge(
+    "imsis_db_pool_connections",
+    "Conexões do pool SQLAlchemy por estado",
+    ("state",),
+)
+MAIL_SENT = Counter("imsis_mail_sent_total", "E-mails enviados com sucesso")
+MAIL_FAILURES = Counter("imsis_mail_failures_total", "Falhas no envio de e-mail")
+MAIL_IN_FLIGHT = InFlightGauge("imsis_mail_in_flight", "Envios de e-mail em andamento")
+CACHE_REQUESTS = Counter(
+    "imsis_cache_requests_total",
+    "Consultas a caches internos por resultado (hit/miss)",
+    ("cache", "result"),
+)
+JOB_RUNS = Counter(
+    "imsis_job_runs_total",
+    "Execuções de tarefas agendadas por tarefa e resultado (ok/erro)",
+    ("tarefa", "result"),
+)
+AUDIT_ROWS = Counter(
+    "imsis_audit_rows_total",
+    "Linhas da trilha de auditoria por resultado (gravada/perdida)",
+    ("result",),
+)
+
+_request_state = threading.local()
+
+
+def cache_hit(cache_name):
+    CACHE_REQUESTS.inc(cache_name, "hit")
+
+
+def cache_miss(cache_name):
+    CACHE_REQUESTS.inc(cache_name, "miss")
+
+
+def current_query_count():
+    """Queries executadas pela requisição corrente nesta thread"""
+    return getattr(_request_state, "queries", 0)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start")
+    if starts:
+        DB_QUERY_LATENCY.observe(time.perf_counter() - starts.pop())
+    DB_QUERIES.inc()
+    _request_state.queries = getattr(_request_state, "queries", 0) + 1
+
+
+def instrument_sqlalchemy():
+    """Conta queries de qualquer Engine (registrado uma vez por processo)"""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    if not event.contains(Engine, "after_cursor_execute", _after_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {}
+    for state, attr in (("checked_out", "checkedout"), ("checked_in", "checkedin"), ("overflow", "overflow"), ("size", "size")):
+        fn = getattr(pool, attr, None)
+        if fn is not None:
+            stats[(state,)] = fn()
+    return stats
+
+
+def init_app(app, db):
+    """Registra hooks de latência/queries e a rota /metrics"""
+    from flask import Response, abort, g, request
+
+    instrument_sqlalchemy()
+    DB_POOL.set_function(lambda: pool_stats(db.engine))
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_start = time.perf_counter()
+        _request_state.queries = 0
+
+    @app.after_request
+    def _metrics_record(response):
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            endpoint = request.endpoint or "not_found"
+            HTTP_LATENCY.observe(time.perf_counter() - start, endpoint)
+            HTTP_REQUESTS.inc(endpoint, request.method, str(response.status_code))
+            DB_QUERIES_PER_REQUEST.observe(current_query_count(), endpoint)
+        return response
+
+    def metrics_endpoint():
+        token = os.environ.get("METRICS_TOKEN")
+        if token:
+            auth = request.headers.get("Authorization", "")
+            if not hmac.compare_digest(auth.encode(), f"Bearer {token}".encode()):
+                abort(401)
+        elif not env_truthy(os.environ.get("METRICS_PUBLIC", "false")):
+            abort(404)
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+    app.add_url_rule("/metrics", "metrics", metrics_endpoint)
@@ -6,12 +6,13 @@ Execute isto se receber erros de colunas ausentes
 
 import os
 import sys
-from app import app, db
+from app import create_app, db
 from sqlalchemy import text, inspect
 
 def migrate_columns():
     """Força a criação de todas as colunas necessárias"""
     
+    app = create_app({"BOOTSTRAP_DB": False})
     with app.app_context():
         inspector = inspect(db.engine)
         
@@ -0,0 +1,573 @@
+"""
+Modelos SQLAlchemy do IMSIS.
+
+O objeto `db` não é ligado a nenhuma app no import: create_app() (app.py)
+chama db.init_app(app). Assim outros módulos podem importar os modelos sem
+efeitos colaterais.
+"""
+
+from datetime import datetime
+from itertools import chain
+
+from flask_login import UserMixin
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func, inspect as sa_inspect, select, update
+from sqlalchemy.orm import Session
+
+db = SQLAlchemy()
+
+
+# ------------------------------------------------------------------------------
+# MODELS
+# ------------------------------------------------------------------------------
+class ResponsavelMixin:
+    """Nome exibido do responsável: o usuário vinculado ou o texto livre"""
+
+    @property
+    def responsavel_nome(self):
+        return self.responsavel_user.username if self.responsavel_user else self.responsavel
+
+
+class User(UserMixin, db.Model):
+    __tablename__ = "users"
+
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(100), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password = db.Column(db.String(200), nullable=False)
+    email_verified = db.Column(db.Boolean, default=False, nullable=False)
+    email_verification_token_hash = db.Column(db.String(255))
+    email_verification_expires_at = db.Column(db.DateTime)
+    password_reset_token_hash = db.Column(db.String(255))
+    password_reset_expires_at = db.Column(db.DateTime)
+
+
+class Projeto(db.Model):
+    __tablename__ = "projetos"
+
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(200), nullable=False)
+    # Incrementada a cada alteração em fases/cenários/atividades/dependências;
+    # chave dos caches derivados do fluxo (ex.: cronograma)
+    versao_fluxo = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # Soma dos contadores dos cenários (contadores.py)
+    total_atividades = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    concluidas = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    liberadas = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    membros = db.relationship(
+        "ProjetoMembro",
+        backref="projeto",
+        lazy=True,
+        cascade="all, delete-orphan",
+    )
+
+
+class ProjetoMembro(db.Model):
+    __tablename__ = "projeto_membros"
+
+    id = db.Column(db.Integer, primary_key=True)
+    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    user = db.relationship("User", backref=db.backref("projeto_membros", lazy=True))
+
+    __table_args__ = (
+        db.UniqueConstraint("projeto_id", "user_id", name="uq_projeto_membro"),
+    )
+
+
+class Fase(db.Model):
+    __tablename__ = "fases"
+
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(200), nullable=False)
+    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id"), nullable=False)
+    projeto = db.relationship("Projeto", backref=db.backref("fases", lazy=True))
+    # Soma dos contadores dos cenários (contadores.py)
+    total_atividades = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    concluidas = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    liberadas = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+
+class Atividade(ResponsavelMixin, db.Model):
+    __tablename__ = "atividades"
+
+    id = db.Column(db.Integer, primary_key=True)
+    numero_sequencial = db.Column(db.Integer, nullable=False)
+    descricao = db.Column(db.String(200), nullable=False)
+    responsavel = db.Column(db.String(100), nullable=False)
+    responsavel_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="SET NULL"), index=True)
+    responsavel_user = db.relationship("User", foreign_keys=[responsavel_id])
+    # active_history: o valor anterior é carregado ao alterar, para os contadores de progresso
+    data_liberacao = db.column_property(db.Column(db.DateTime), active_history=True)
+    data_conclusao = db.column_property(db.Column(db.DateTime), active_history=True)
+    # Relacionamento com Cenario (opcional)
+    cenario_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey("cenarios.id", ondelete="CASCADE"), nullable=True),
+        active_history=True,
+    )
+    cenario = db.relationship("Cenario", backref=db.backref("atividades", lazy=True))
+    # Denormalizado de cenario -> fase -> projeto para autorizar com uma query
+    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id", ondelete="CASCADE"), index=True)
+    # Predecessoras (atividade_dependencias) ainda não concluídas; 0 = desbloqueada
+    predecessoras_pendentes = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+
+class DependenciaAtividade(db.Model):
+    """Aresta predecessora -> sucessora; pode ligar cenários diferentes do mesmo projeto"""
+
+    __tablename__ = "atividade_dependencias"
+    __table_args__ = (db.UniqueConstraint("predecessora_id", "sucessora_id", name="uq_atividade_dependencia"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id", ondelete="CASCADE"), nullable=False, index=True)
+    predecessora_id = db.Column(db.Integer, db.ForeignKey("atividades.id", ondelete="CASCADE"), nullable=False)
+    sucessora_id = db.Column(db.Integer, db.ForeignKey("atividades.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    predecessora = db.relationship("Atividade", foreign_keys=[predecessora_id])
+    sucessora = db.relationship("Atividade", foreign_keys=[sucessora_id])
+
+
+class TesteTabela1(db.Model):
+    __tablename__ = "teste_tabela_1"
+
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.Text, nullable=False)
+
+
+class Cenario(db.Model):
+    __tablename__ = "cenarios"
+
+    id = db.Column(db.Integer, primary_key=True)
+    cenario = db.Column(db.String(200), nullable=False)
+    fase_id = db.Column(db.Integer, db.ForeignKey("fases.id", ondelete="CASCADE"), nullable=True)
+    fase = db.relationship("Fase", backref=db.backref("cenarios", lazy=True))
+    # Denormalizado de fase -> projeto
+    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id", ondelete="CASCADE"), index=True)
+    # Contadores de progresso (contadores.py)
+    total_atividades = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    concluidas = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    liberadas = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+
+class LicaoAprendida(ResponsavelMixin, db.Model):
+    __tablename__ = "licoes_aprendidas"
+
+    id = db.Column(db.Integer, primary_key=True)
+    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id"), nullable=False)
+    fase_id = db.Column(db.Integer, db.ForeignKey("fases.id", ondelete="SET NULL"), nullable=True)
+    categoria = db.Column(db.String(100))  # Ex: Técnica, Gestão, Comunicação
+    tipo = db.Column(db.String(50))  # Ex: Sucesso, Problema, Oportunidade
+    descricao = db.Column(db.Text, nullable=False)
+    causa_raiz = db.Column(db.Text)
+    impacto = db.Column(db.Text)
+    acao_tomada = db.Column(db.Text)
+    recomendacao = db.Column(db.Text)
+    responsavel = db.Column(db.String(100))
+    responsavel_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="SET NULL"), index=True)
+    status = db.Column(db.String(50))  # Ex: Registrada, Em Análise, Aplicada
+    aplicavel_futuros = db.Column(db.Boolean, default=True)
+    data_registro = db.Column(db.DateTime, default=datetime.utcnow)
+    # Versão do registro para edição concorrente (edicao.py): todo UPDATE do ORM confere e incrementa
+    versao = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": versao}
+    
+    projeto = db.relationship("Projeto", backref=db.backref("licoes_aprendidas", lazy=True))
+    fase = db.relationship("Fase", backref=db.backref("licoes_aprendidas", lazy=True))
+    responsavel_user = db.relationship("User", foreign_keys=[responsavel_id])
+
+
+class SolicitacaoMudanca(db.Model):
+    __tablename__ = "solicitacoes_mudanca"
+
+    id = db.Column(db.Integer, primary_key=True)
+    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id"), nullable=False)
+    data_solicitacao = db.Column(db.DateTime, default=datetime.utcnow)
+    solicitante = db.Column(db.String(100))
+    area_solicitante = db.Column(db.String(100))
+    descricao = db.Column(db.Text, nullable=False)
+    justificativa = db.Column(db.Text)
+    tipo_mudanca = db.Column(db.String(50))  # Escopo, Legal, Técnica, Melhoria, Correção, Integração
+    impacto_prazo = db.Column(db.String(100))
+    impacto_custo = db.Column(db.String(100))
+    impacto_escopo = db.Column(db.String(50))  # Baixo, Médio, Alto
+    impacto_recursos = db.Column(db.String(200))
+    impacto_risco = db.Column(db.String(50))  # Baixo, Médio, Alto
+    prioridade = db.Column(db.String(50))  # Baixa, Média, Alta, Crítica
+    recomendacao_pm = db.Column(db.String(50))  # Aprovar, Rejeitar, Postergar
+    status = db.Column(db.String(50))  # Em análise, Aprovada, Rejeitada, Em implementação, Concluída
+    aprovador = db.Column(db.String(100))
+    data_decisao = db.Column(db.DateTime)
+    data_implementacao = db.Column(db.DateTime)
+    observacoes = db.Column(db.Text)
+    # Versão do registro para edição concorrente (edicao.py): todo UPDATE do ORM confere e incrementa
+    versao = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": versao}
+    
+    projeto = db.relationship("Projeto", backref=db.backref("solicitacoes_mudanca", lazy=True))
+
+
+class Incidente(ResponsavelMixin, db.Model):
+    __tablename__ = "incidentes"
+
+    id = db.Column(db.Integer, primary_key=True)
+    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id"), nullable=False)
+    atividade_id = db.Column(db.Integer, db.ForeignKey("atividades.id", ondelete="SET NULL"), nullable=True)
+    descricao = db.Column(db.Text, nullable=False)
+    acompanhamento = db.Column(db.Text)  # Texto anterior à linha do tempo (acompanhamentos.py); só leitura
+    responsavel = db.Column(db.String(100))
+    responsavel_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="SET NULL"), index=True)
+    prioridade = db.Column(db.String(50))  # 1 - Muito Alto, 2 - Alto, 3 - Médio, 4 - Baixo, 5 - Muito Baixo
+    status = db.Column(db.String(50))  # Criado, Em andamento, Aguardando Solicitante, Aguardando Externo, Encaminhado Responsavel, Proposta de solução, Concluído
+    previsao_original = db.Column(db.DateTime)
+    previsao_revisada = db.Column(db.DateTime)
+    data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+    data_ultima_modificacao = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    conclusao = db.Column(db.DateTime)
+    # Prazo (previsão revisada ou original) cujo atraso já foi avisado ao responsável (agendador.py)
+    alerta_atraso_para = db.Column(db.DateTime)
+    # Início do status atual (sla.py)
+    status_desde = db.Column(db.DateTime, default=datetime.utcnow)
+    # Versão do registro para edição concorrente (edicao.py): todo UPDATE do ORM confere e incrementa
+    versao = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": versao}
+    
+    projeto = db.relationship("Projeto", backref=db.backref("incidentes", lazy=True))
+    atividade = db.relationship("Atividade", backref=db.backref("incidentes", lazy=True))
+    responsavel_user = db.relationship("User", foreign_keys=[responsavel_id])
+
+
+class Risco(ResponsavelMixin, db.Model):
+    __tablename__ = "riscos"
+    __table_args__ = (db.Index("ix_riscos_projeto_score", "projeto_id", "score"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id"), nullable=False)
+    area = db.Column(db.String(100))
+    tipo_risco = db.Column(db.String(50))  # Ameaca, Oportunidade
+    risco = db.Column(db.Text, nullable=False)
+    criado_por = db.Column(db.String(100))
+    criado_por_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="SET NULL"), index=True)
+    responsavel = db.Column(db.String(100))
+    responsavel_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="SET NULL"), index=True)
+    gatilho = db.Column(db.Text)
+    impacto_projeto = db.Column(db.Text)
+    consequencia = db.Column(db.Text)
+    impacto = db.Column(db.Integer)  # 1-5
+    probabilidade = db.Column(db.Integer)  # 1-5
+    # Severidade (1-25), calculada pelo banco; NULL enquanto faltar impacto ou probabilidade
+    score = db.Column(db.Integer, db.Computed("impacto * probabilidade", persisted=True))
+    nivel_risco = db.Column(db.String(50))  # 1 - Muito Alto, 2 - Alto, 3 - Medio, 4 - Baixo, 5 - Muito Baixo
+    estrategia = db.Column(db.String(50))
+    prevencao = db.Column(db.Text)
+    contingencia = db.Column(db.Text)
+    acompanhamento = db.Column(db.Text)  # Texto anterior à linha do tempo (acompanhamentos.py); só leitura
+    status = db.Column(db.String(50))  # Concluido, Planejado, Iniciado, Parado
+    data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+    data_proxima_acao = db.Column(db.DateTime)
+    data_conclusao = db.Column(db.DateTime)
+    # data_proxima_acao já lembrada ao responsável (agendador.py)
+    alerta_acao_para = db.Column(db.DateTime)
+    # Versão do registro para edição concorrente (edicao.py): todo UPDATE do ORM confere e incrementa
+    versao = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": versao}
+
+    projeto = db.relationship("Projeto", backref=db.backref("riscos", lazy=True))
+    criado_por_user = db.relationship("User", foreign_keys=[criado_por_id])
+    responsavel_user = db.relationship("User", foreign_keys=[responsavel_id])
+
+
+class Perfil(db.Model):
+    __tablename__ = "perfis"
+
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(100), nullable=False)
+    # NULL = modelo global (Administrador/Membro), compartilhado por todos os projetos
+    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id"), nullable=True)
+    projeto = db.relationship("Projeto", backref=db.backref("perfis", lazy=True))
+    # Perfil do projeto que substitui o modelo global `modelo_id` só naquele projeto
+    modelo_id = db.Column(db.Integer, db.ForeignKey("perfis.id", ondelete="SET NULL"))
+    modelo = db.relationship("Perfil", remote_side=[id])
+    # Todas as permissões, inclusive as que vierem a ser criadas (Administrador)
+    acesso_total = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    
+    # Permissões
+    pode_criar_atividade = db.Column(db.Boolean, default=True)
+    pode_editar_atividade = db.Column(db.Boolean, default=True)
+    pode_excluir_atividade = db.Column(db.Boolean, default=False)
+    pode_concluir_qualquer_atividade = db.Column(db.Boolean, default=False)
+    pode_editar_projeto = db.Column(db.Boolean, default=False)
+    pode_gerenciar_membros = db.Column(db.Boolean, default=False)
+    
+    # Permissões de Lições Aprendidas
+    pode_criar_licao = db.Column(db.Boolean, default=False)
+    pode_editar_licao = db.Column(db.Boolean, default=False)
+    pode_excluir_licao = db.Column(db.Boolean, default=False)
+    
+    # Permissões de Solicitações de Mudança
+    pode_criar_mudanca = db.Column(db.Boolean, default=False)
+    pode_editar_mudanca = db.Column(db.Boolean, default=False)
+    pode_excluir_mudanca = db.Column(db.Boolean, default=False)
+    
+    # Permissões de Incidentes
+    pode_criar_incidente = db.Column(db.Boolean, default=False)
+    pode_editar_incidente = db.Column(db.Boolean, default=False)
+    pode_excluir_incidente = db.Column(db.Boolean, default=False)
+
+    # Permissões de Riscos
+    pode_criar_risco = db.Column(db.Boolean, default=False)
+    pode_editar_risco = db.Column(db.Boolean, default=False)
+    pode_excluir_risco = db.Column(db.Boolean, default=False)
+    
+    is_default = db.Column(db.Boolean, default=False)  # Para perfis padrão
+
+
+PERMISSOES = tuple(c.name for c in Perfil.__table__.columns if c.name.startswith("pode_"))
+
+# Modelos globais criados por permissoes.garantir_modelos()
+PERFIS_PADRAO = {
+    "Administrador": {"acesso_total": True, **{p: True for p in PERMISSOES}},
+    "Membro": {
+        "acesso_total": False,
+        **{p: False for p in PERMISSOES},
+        "pode_criar_atividade": True,
+        "pode_editar_atividade": True,
+        "pode_criar_licao": True,
+        "pode_editar_licao": True,
+        "pode_criar_mudanca": True,
+        "pode_editar_mudanca": True,
+        "pode_criar_incidente": True,
+        "pode_editar_incidente": True,
+        "pode_excluir_incidente": True,
+        "pode_criar_risco": True,
+        "pode_editar_risco": True,
+        "pode_excluir_risco": True,
+    },
+}
+
+
+class MembroPerfil(db.Model):
+    __tablename__ = "membro_perfis"
+
+    id = db.Column(db.Integer, primary_key=True)
+    projeto_membro_id = db.Column(db.Integer, db.ForeignKey("projeto_membros.id"), nullable=False)
+    perfil_id = db.Column(db.Integer, db.ForeignKey("perfis.id"), nullable=False)
+    
+    projeto_membro = db.relationship("ProjetoMembro", backref=db.backref("perfil_associacao", lazy=True))
+    perfil = db.relationship("Perfil", backref=db.backref("membros", lazy=True))
+
+
+class ItemBusca(db.Model):
+    """Texto pesquisável de um registro do projeto (índice da busca unificada, busca.py)"""
+
+    __tablename__ = "busca_itens"
+    __table_args__ = (db.UniqueConstraint("tipo", "registro_id", name="uq_busca_item_registro"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(20), nullable=False)  # atividade, incidente, risco, mudanca, licao
+    registro_id = db.Column(db.Integer, nullable=False)
+    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id", ondelete="CASCADE"), nullable=False, index=True)
+    titulo = db.Column(db.Text)
+    texto = db.Column(db.Text)
+
+
+class AssinaturaSimilaridade(db.Model):
+    """Assinatura MinHash da descrição de um incidente ou lição (similares.py)"""
+
+    __tablename__ = "assinaturas_similaridade"
+
+    tipo = db.Column(db.String(20), primary_key=True)  # incidente, licao
+    registro_id = db.Column(db.Integer, primary_key=True)
+    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id", ondelete="CASCADE"), nullable=False)
+    assinatura = db.Column(db.LargeBinary, nullable=False)
+
+
+class BucketSimilaridade(db.Model):
+    """Uma faixa (banda LSH) da assinatura; mesma chave = candidato a duplicado"""
+
+    __tablename__ = "buckets_similaridade"
+    __table_args__ = (db.Index("ix_bucket_similaridade_chave", "tipo", "projeto_id", "chave"),)
+
+    tipo = db.Column(db.String(20), primary_key=True)
+    registro_id = db.Column(db.Integer, primary_key=True)
+    banda = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id", ondelete="CASCADE"), nullable=False)
+    chave = db.Column(db.BigInteger, nullable=False)
+
+
+class Notificacao(db.Model):
+    """Evento aguardando o próximo resumo por e-mail do usuário (notificacoes.py)"""
+
+    __tablename__ = "notificacoes"
+    __table_args__ = (db.Index("ix_notificacoes_user_id", "user_id", "id"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id", ondelete="CASCADE"), nullable=False)
+    tipo = db.Column(db.String(30), nullable=False)  # atividade_liberada, incidente_atrasado, acao_de_risco
+    registro_id = db.Column(db.Integer, nullable=False)
+    texto = db.Column(db.String(200))
+    criada_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class Acompanhamento(db.Model):
+    """Entrada da linha do tempo de acompanhamento de um incidente ou risco (acompanhamentos.py)"""
+
+    __tablename__ = "acompanhamentos"
+    __table_args__ = (db.Index("ix_acompanhamentos_registro", "projeto_id", "entidade", "registro_id", "id"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id", ondelete="CASCADE"), nullable=False)
+    entidade = db.Column(db.String(20), nullable=False)  # incidente, risco
+    registro_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="SET NULL"))
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    texto = db.Column(db.Text, nullable=False)
+
+
+class TransicaoIncidente(db.Model):
+    """Mudança de status de um incidente (sla.py). Sem FK para o incidente: sobrevive à exclusão"""
+
+    __tablename__ = "incidente_transicoes"
+    __table_args__ = (db.Index("ix_incidente_transicoes_incidente_id", "incidente_id", "id"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id", ondelete="CASCADE"), nullable=False)
+    incidente_id = db.Column(db.Integer, nullable=False)
+    de = db.Column(db.String(50))  # None na criação
+    para = db.Column(db.String(50))
+    em = db.Column(db.DateTime, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="SET NULL"))
+    # Tempo no status `de` (None na criação)
+    duracao_segundos = db.Column(db.BigInteger)
+    # Só nas entradas em Concluído: da criação do incidente até aqui
+    resolucao_segundos = db.Column(db.BigInteger)
+
+
+class SlaIncidente(db.Model):
+    """Histograma por projeto de uma métrica de SLA dos incidentes (sla.py)"""
+
+    __tablename__ = "sla_incidentes"
+
+    projeto_id = db.Column(db.Integer, db.ForeignKey("projetos.id", ondelete="CASCADE"), primary_key=True)
+    metrica = db.Column(db.String(30), primary_key=True)  # resolucao, aguardando_externo
+    faixa = db.Column(db.Integer, primary_key=True)  # índice em sla.FAIXAS
+    quantidade = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    soma_segundos = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
+
+
+class TarefaAgendada(db.Model):
+    """Estado persistido de uma tarefa periódica (agendador.py)"""
+
+    __tablename__ = "tarefas_agendadas"
+
+    nome = db.Column(db.String(50), primary_key=True)
+    proxima_execucao = db.Column(db.DateTime)
+    ultima_execucao = db.Column(db.DateTime)
+    ultima_duracao_ms = db.Column(db.Integer)
+    ultimo_resultado = db.Column(db.String(10))  # ok, erro
+    ultimo_erro = db.Column(db.Text)
+    processados = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    execucoes = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    instancia = db.Column(db.String(100))
+
+
+# ------------------------------------------------------------------------------
+# CONSISTÊNCIA DO projeto_id DENORMALIZADO
+# ------------------------------------------------------------------------------
+def _mudou(target, atributo):
+    return sa_inspect(target).attrs[atributo].history.has_changes()
+
+
+@event.listens_for(Cenario, "before_insert")
+@event.listens_for(Cenario, "before_update")
+def _cenario_projeto_id(mapper, connection, target):
+    """Deriva projeto_id da fase quando não informado ou quando a fase muda"""
+    if target.fase_id is None:
+        return
+    if target.projeto_id is None or (target.id is not None and _mudou(target, "fase_id")):
+        target.projeto_id = connection.scalar(select(Fase.projeto_id).where(Fase.id == target.fase_id))
+
+
+@event.listens_for(Atividade, "before_insert")
+@event.listens_for(Atividade, "before_update")
+def _atividade_projeto_id(mapper, connection, target):
+    """Deriva projeto_id do cenário quando não informado ou quando o cenário muda"""
+    if target.cenario_id is None:
+        return
+    if target.projeto_id is None or (target.id is not None and _mudou(target, "cenario_id")):
+        target.projeto_id = connection.scalar(select(Cenario.projeto_id).where(Cenario.id == target.cenario_id))
+
+
+# ------------------------------------------------------------------------------
+# RESPONSÁVEIS: TEXTO -> users.id
+# ------------------------------------------------------------------------------
+# Colunas de texto continuam sendo a fonte do formulário (e guardam nomes
+# externos, sem conta no sistema); o *_id é derivado delas, na gravação ou
+# quando o usuário se cadastra depois, e é o que as consultas "atribuído a
+# mim" e as verificações de permissão usam.
+RESPONSAVEIS = {
+    Atividade: (("responsavel", "responsavel_id"),),
+    Incidente: (("responsavel", "responsavel_id"),),
+    LicaoAprendida: (("responsavel", "responsavel_id"),),
+    Risco: (("responsavel", "responsavel_id"), ("criado_por", "criado_por_id")),
+}
+
+
+def _sincronizar_responsaveis(mapper, connection, target):
+    """Resolve o username informado para o id do usuário"""
+    for coluna_texto, coluna_id in RESPONSAVEIS[type(target)]:
+        if target.id is None:
+            if getattr(target, coluna_id) is not None:
+                continue
+        elif not _mudou(target, coluna_texto) or _mudou(target, coluna_id):
+            continue
+        nome = (getattr(target, coluna_texto) or "").strip()
+        user_id = connection.scalar(select(User.id).where(User.username == nome)) if nome else None
+        setattr(target, coluna_id, user_id)
+
+
+for _modelo in RESPONSAVEIS:
+    event.listen(_modelo, "before_insert", _sincronizar_responsaveis)
+    event.listen(_modelo, "before_update", _sincronizar_responsaveis)
+
+
+@event.listens_for(User, "after_insert")
+def _vincular_responsaveis_do_usuario(mapper, connection, target):
+    """Quem foi atribuído pelo nome antes de se cadastrar passa a ter o *_id"""
+    for modelo, colunas in RESPONSAVEIS.items():
+        tabela = modelo.__table__
+        for coluna_texto, coluna_id in colunas:
+            connection.execute(
+                update(tabela)
+                .where(tabela.c[coluna_id].is_(None), func.trim(tabela.c[coluna_texto]) == target.username)
+                .values({coluna_id: target.id})
+            )
+
+
+# ------------------------------------------------------------------------------
+# VERSÃO DO FLUXO
+# ------------------------------------------------------------------------------
+MODELOS_DO_FLUXO = (Fase, Cenario, Atividade, DependenciaAtividade)
+
+
+def incrementar_versao_fluxo(conexao, projeto_ids):
+    projetos = Projeto.__table__
+    conexao.execute(
+        update(projetos)
+        .where(projetos.c.id.in_(sorted(projeto_ids)))
+        .values(versao_fluxo=projetos.c.versao_fluxo + 1)
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _versao_fluxo_apos_flush(session, flush_context):
+    """Alterações feitas pelo ORM; os DELETE/UPDATE em lote chamam incrementar_versao_fluxo"""
+    projeto_ids = {
+        obj.projeto_id
+        for obj in chain(session.new, session.dirty, session.deleted)
+        if isinstance(obj, MODELOS_DO_FLUXO)
+        and obj.projeto_id is not None
+        and (obj not in session.dirty or session.is_modified(obj, include_collections=False))
+    }
+    if projeto_ids:
+        incrementar_versao_fluxo(session.connection(), projeto_ids)
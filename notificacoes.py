@@ -0,0 +1,264 @@
+"""
+Notificações agregadas: um resumo por e-mail por usuário, em vez de um
+e-mail por evento.
+
+Os eventos (atividade liberada para o responsável, incidente atrasado, ação
+de risco próxima) viram linhas curtas em `notificacoes`, na mesma transação
+que os gerou:
+- liberações feitas pelo ORM: after_flush deste módulo;
+- liberações em lote (dependencias.liberar_desbloqueadas):
+  atividades_liberadas(), um INSERT ... SELECT;
+- avisos do agendador: registrar().
+
+enviar_resumos() (tarefa "resumo_diario" do agendador.py, que repete os
+lotes até acabar) monta os resumos de até LOTE_USUARIOS usuários, os de
+notificação mais antiga primeiro, com uma consulta agrupada por usuário,
+projeto e tipo, envia todos pela mesma sessão SMTP e apaga as notificações
+enviadas. Quem falhou fica para o próximo resumo, exceto endereços
+recusados em definitivo pelo servidor (5xx), cujas notificações são
+descartadas.
+
+Para testar com um servidor SMTP local (sem autenticação):
+    python -m aiosmtpd -n -l localhost:1025
+    SMTP_HOST=localhost SMTP_PORT=1025 SMTP_FROM=imsis@localhost python notificacoes.py
+
+Não faz commit: o chamador controla a transação (exceto a linha de comando).
+"""
+
+import logging
+import smtplib
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app, url_for
+from sqlalchemy import String, bindparam, cast, delete, event, func, insert, literal, select
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.functions import aggregate_strings
+
+import metrics
+from models import db, Atividade, Notificacao, Projeto, User
+
+logger = logging.getLogger("imsis.notificacoes")
+
+Tipo = namedtuple("Tipo", "titulo endpoint")
+
+# Ordem das seções no resumo
+TIPOS = {
+    "atividade_liberada": Tipo("Atividades liberadas para voce", "fluxo"),
+    "incidente_atrasado": Tipo("Incidentes atrasados", "incidentes"),
+    "acao_de_risco": Tipo("Acoes de risco proximas", "riscos"),
+}
+
+TAMANHO_TEXTO = 200
+LOTE_USUARIOS = 200
+ITENS_POR_SECAO = 10
+_SEPARADOR = "\n"
+
+
+def _texto(valor):
+    valor = " ".join((valor or "").split())
+    return valor if len(valor) <= TAMANHO_TEXTO else valor[:TAMANHO_TEXTO - 3] + "..."
+
+
+# ------------------------------------------------------------------------------
+# REGISTRO
+# ------------------------------------------------------------------------------
+def registrar(eventos, agora=None):
+    """Grava `eventos` [{user_id, projeto_id, tipo, registro_id, texto}] com um INSERT"""
+    if not eventos:
+        return
+    agora = agora or datetime.utcnow()
+    db.session.execute(
+        insert(Notificacao.__table__),
+        [{**evento, "texto": _texto(evento.get("texto")), "criada_em": agora} for evento in eventos],
+    )
+
+
+def atividades_liberadas(atividade_ids, agora=None):
+    """Notifica os responsáveis das atividades de `atividade_ids` (lista ou select) liberadas em lote"""
+    texto = func.substr(
+        literal("#") + cast(Atividade.numero_sequencial, String) + " " + func.replace(func.coalesce(Atividade.descricao, ""), "\n", " "),
+        1,
+        TAMANHO_TEXTO,
+    )
+    db.session.execute(
+        insert(Notificacao.__table__).from_select(
+            ["user_id", "projeto_id", "tipo", "registro_id", "texto", "criada_em"],
+            select(
+                Atividade.responsavel_id, Atividade.projeto_id, literal("atividade_liberada"),
+                Atividade.id, texto, literal(agora or datetime.utcnow()),
+            ).where(
+                Atividade.id.in_(atividade_ids),
+                Atividade.responsavel_id.isnot(None),
+                Atividade.projeto_id.isnot(None),
+            ),
+        )
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _liberacoes_apos_flush(session, flush_context):
+    eventos = []
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Atividade) or obj.data_liberacao is None or obj.data_conclusao is not None:
+            continue
+        if obj.responsavel_id is None or obj.projeto_id is None:
+            continue
+        historico = sa_inspect(obj).attrs.data_liberacao.history
+        if obj in session.new or (historico.added and not any(historico.deleted)):
+            eventos.append({
+                "user_id": obj.responsavel_id,
+                "projeto_id": obj.projeto_id,
+                "tipo": "atividade_liberada",
+                "registro_id": obj.id,
+                "texto": _texto(f"#{obj.numero_sequencial} {obj.descricao}"),
+                "criada_em": datetime.utcnow(),
+            })
+    if eventos:
+        session.connection().execute(insert(Notificacao.__table__), eventos)
+
+
+# ------------------------------------------------------------------------------
+# RESUMO
+# ------------------------------------------------------------------------------
+def _link(endpoint, **valores):
+    """URL absoluta para o e-mail (só com APP_BASE_URL; não há requisição para deduzir o host)"""
+    base_url = current_app.config.get("APP_BASE_URL")
+    if not base_url:
+        return None
+    with current_app.test_request_context(base_url=base_url):
+        return url_for(endpoint, _external=True, **valores)
+
+
+def resumos_pendentes(limite=LOTE_USUARIOS, ignorar=()):
+    """
+    {user_id: {"email", "username", "ate_id", "secoes": [(projeto, tipo, quantidade, textos, link)]}}
+    de até `limite` usuários (fora `ignorar`), os que esperam há mais tempo
+    primeiro, numa consulta agrupada. ate_id é a última notificação incluída
+    (as que chegarem depois ficam para o próximo resumo).
+    """
+    N = Notificacao
+    usuarios = select(N.user_id).group_by(N.user_id).order_by(func.min(N.id)).limit(limite)
+    if ignorar:
+        usuarios = usuarios.where(N.user_id.not_in(ignorar))
+    linhas = db.session.execute(
+        select(
+            N.user_id, User.email, User.username, N.projeto_id, Projeto.nome, N.tipo,
+            func.count(), func.max(N.id), aggregate_strings(N.texto, _SEPARADOR),
+        )
+        .join(User, User.id == N.user_id)
+        .join(Projeto, Projeto.id == N.projeto_id)
+        .where(N.user_id.in_(usuarios))
+        .group_by(N.user_id, User.email, User.username, N.projeto_id, Projeto.nome, N.tipo)
+        .order_by(N.user_id, Projeto.nome, N.projeto_id)
+    ).all()
+
+    resumos = {}
+    for user_id, email, username, projeto_id, projeto, tipo, quantidade, ate_id, textos in linhas:
+        resumo = resumos.setdefault(user_id, {"email": email, "username": username, "ate_id": 0, "secoes": []})
+        resumo["ate_id"] = max(resumo["ate_id"], ate_id)
+        endpoint = TIPOS[tipo].endpoint if tipo in TIPOS else None
+        link = _link(endpoint, projeto_id=projeto_id) if endpoint else None
+        resumo["secoes"].append((projeto, tipo, quantidade, (textos or "").split(_SEPARADOR), link))
+    return resumos
+
+
+def corpo_do_resumo(username, secoes):
+    ordem = list(TIPOS)
+    secoes = sorted(secoes, key=lambda s: (s[0], ordem.index(s[1]) if s[1] in TIPOS else len(ordem)))
+    corpo = [f"Ola {username},", "", "Resumo das novidades no IMSIS:"]
+    projeto_atual = None
+    for projeto, tipo, quantidade, textos, link in secoes:
+        if projeto != projeto_atual:
+            corpo.extend(["", f"Projeto {projeto}"])
+            projeto_atual = projeto
+        titulo = TIPOS[tipo].titulo if tipo in TIPOS else tipo
+        corpo.append(f"  {titulo} ({quantidade}):")
+        corpo.extend(f"    - {texto}" for texto in textos[:ITENS_POR_SECAO])
+        if quantidade > ITENS_POR_SECAO:
+            corpo.append(f"    ... e mais {quantidade - ITENS_POR_SECAO}")
+        if link:
+            corpo.append(f"    {link}")
+    return "\n".join(corpo) + "\n"
+
+
+def _recusa_definitiva(erro):
+    return isinstance(erro, smtplib.SMTPRecipientsRefused) and all(
+        codigo >= 500 for codigo, _ in erro.recipients.values()
+    )
+
+
+def enviar_resumos(agora=None, limite=LOTE_USUARIOS, ignorar=None):
+    """
+    Envia um lote de resumos pendentes numa única sessão SMTP. Devolve
+    quantos usuários receberam. Com `ignorar` (set), os usuários que falharam
+    são acrescentados a ele e ficam fora dos lotes seguintes da mesma execução.
+    """
+    from app import build_email, smtp_session
+
+    resumos = resumos_pendentes(limite, ignorar or ())
+    if not resumos:
+        return 0
+    data = (agora or datetime.utcnow()).strftime("%d/%m/%Y")
+
+    enviados, descartados = [], []
+    with smtp_session() as smtp:
+        for user_id, resumo in resumos.items():
+            mensagem = build_email(
+                resumo["email"], f"Resumo IMSIS - {data}", corpo_do_resumo(resumo["username"], resumo["secoes"])
+            )
+            metrics.MAIL_IN_FLIGHT.inc()
+            try:
+                smtp.send_message(mensagem)
+            except smtplib.SMTPServerDisconnected:
+                metrics.MAIL_FAILURES.inc()
+                logger.warning("Conexao SMTP perdida: resumos restantes ficam para a proxima execucao")
+                break
+            except smtplib.SMTPException as e:
+                metrics.MAIL_FAILURES.inc()
+                if _recusa_definitiva(e):
+                    logger.warning("Destinatario recusado: notificacoes descartadas", extra={"user_id": user_id})
+                    descartados.append({"b_user_id": user_id, "b_ate_id": resumo["ate_id"]})
+                else:
+                    logger.warning("Resumo nao enviado", extra={"user_id": user_id})
+                    if ignorar is not None:
+                        ignorar.add(user_id)
+                continue
+            finally:
+                metrics.MAIL_IN_FLIGHT.dec()
+            metrics.MAIL_SENT.inc()
+            enviados.append({"b_user_id": user_id, "b_ate_id": resumo["ate_id"]})
+
+    if enviados or descartados:
+        db.session.execute(
+            delete(Notificacao.__table__).where(
+                Notificacao.user_id == bindparam("b_user_id"), Notificacao.id <= bindparam("b_ate_id")
+            ),
+            enviados + descartados,
+        )
+    logger.info(
+        "Resumos enviados",
+        extra={
+            "enviados": len(enviados),
+            "descartados": len(descartados),
+            "pendentes": len(resumos) - len(enviados) - len(descartados),
+        },
+    )
+    return len(enviados)
+
+
+if __name__ == "__main__":
+    from app import create_app
+    from app_logging import configure_logging
+
+    configure_logging()
+    app = create_app({"BOOTSTRAP_DB": False})
+    with app.app_context():
+        falhas = set()
+        while True:
+            antes = len(falhas)
+            enviados = enviar_resumos(ignorar=falhas)
+            db.session.commit()
+            if not enviados and len(falhas) == antes:
+                break
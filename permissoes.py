@@ -0,0 +1,222 @@
+"""
+Perfis de acesso e resolução de permissões.
+
+Os perfis padrão (Administrador e Membro) são modelos globais, uma linha
+cada em `perfis` com projeto_id NULL, referenciados pelos membros de todos
+os projetos. Um projeto pode personalizar um modelo só para si: o perfil do
+projeto com modelo_id apontando para o modelo passa a ser o perfil dos
+membros daquele projeto (sobrescrever_modelo / restaurar_modelo). Perfis
+criados no projeto continuam sendo linhas do projeto.
+
+Resolver uma permissão é uma consulta pequena (membro -> perfil_id); a
+definição do perfil vem do cache do processo, no caso dos modelos globais
+(só mudam por migração), ou de uma leitura pela chave primária. O resultado
+fica memorizado em flask.g até o fim da requisição.
+
+As funções não fazem commit: o chamador controla a transação.
+"""
+
+import threading
+from collections import namedtuple
+
+from flask import g
+from sqlalchemy import and_, delete, func, select, true, update
+
+from models import db, MembroPerfil, Perfil, PERFIS_PADRAO, PERMISSOES, ProjetoMembro
+
+# Definição imutável de um perfil, segura para compartilhar entre requisições
+Definicao = namedtuple("Definicao", "id nome acesso_total permissoes")
+
+_modelos = {}  # url do banco -> {perfil_id: Definicao}
+_modelos_lock = threading.Lock()
+
+
+def _definicao(perfil):
+    return Definicao(
+        perfil.id,
+        perfil.nome,
+        bool(perfil.acesso_total),
+        frozenset(p for p in PERMISSOES if getattr(perfil, p)),
+    )
+
+
+def _chave_banco():
+    return str(db.engine.url)
+
+
+def modelos():
+    """{perfil_id: Definicao} dos modelos globais, lidos uma vez por processo"""
+    chave = _chave_banco()
+    with _modelos_lock:
+        if chave in _modelos:
+            return _modelos[chave]
+    definicoes = {p.id: _definicao(p) for p in Perfil.query.filter(Perfil.projeto_id.is_(None)).all()}
+    with _modelos_lock:
+        # Sem modelos ainda (migração não rodou): não guarda o vazio
+        if definicoes:
+            _modelos[chave] = definicoes
+    return definicoes
+
+
+def limpar_cache():
+    with _modelos_lock:
+        _modelos.pop(_chave_banco(), None)
+
+
+def modelo_id(nome):
+    """Id do modelo global `nome` (criado na hora se ainda não existir)"""
+    for definicao in modelos().values():
+        if definicao.nome == nome:
+            return definicao.id
+    return garantir_modelos().get(nome)
+
+
+def garantir_modelos():
+    """Cria os modelos globais que faltarem. Devolve {nome: perfil_id}"""
+    existentes = dict(
+        db.session.execute(
+            select(Perfil.nome, Perfil.id).where(Perfil.projeto_id.is_(None), Perfil.nome.in_(PERFIS_PADRAO))
+        ).all()
+    )
+    for nome, valores in PERFIS_PADRAO.items():
+        if nome not in existentes:
+            perfil = Perfil(nome=nome, projeto_id=None, is_default=True, **valores)
+            db.session.add(perfil)
+            db.session.flush()
+            existentes[nome] = perfil.id
+    limpar_cache()
+    return existentes
+
+
+# ------------------------------------------------------------------------------
+# RESOLUÇÃO
+# ------------------------------------------------------------------------------
+def perfil_do_membro(projeto_id, user_id):
+    """Definicao do perfil do usuário no projeto (None se não for membro ou não tiver perfil)"""
+    memo = g.setdefault("_perfis_resolvidos", {})
+    if (projeto_id, user_id) in memo:
+        return memo[projeto_id, user_id]
+
+    perfil_id = db.session.scalar(
+        select(MembroPerfil.perfil_id)
+        .join(ProjetoMembro, ProjetoMembro.id == MembroPerfil.projeto_membro_id)
+        .where(ProjetoMembro.projeto_id == projeto_id, ProjetoMembro.user_id == user_id)
+        .order_by(MembroPerfil.id)
+        .limit(1)
+    )
+    definicao = None
+    if perfil_id is not None:
+        definicao = modelos().get(perfil_id)
+        if definicao is None:
+            perfil = db.session.get(Perfil, perfil_id)
+            definicao = _definicao(perfil) if perfil else None
+    memo[projeto_id, user_id] = definicao
+    return definicao
+
+
+def tem_permissao(projeto_id, permissao, user_id):
+    definicao = perfil_do_membro(projeto_id, user_id)
+    if definicao is None:
+        return False
+    return definicao.acesso_total or permissao in definicao.permissoes
+
+
+# ------------------------------------------------------------------------------
+# PERFIS DE UM PROJETO
+# ------------------------------------------------------------------------------
+def perfis_do_projeto(projeto_id):
+    """
+    Perfis que podem ser atribuídos no projeto: cada modelo global (ou a
+    personalização dele no projeto) seguido dos perfis próprios do projeto.
+    """
+    do_projeto = Perfil.query.filter_by(projeto_id=projeto_id).order_by(Perfil.id).all()
+    personalizados = {p.modelo_id: p for p in do_projeto if p.modelo_id is not None}
+    globais = Perfil.query.filter(Perfil.projeto_id.is_(None)).order_by(Perfil.id).all()
+    return [personalizados.get(m.id, m) for m in globais] + [p for p in do_projeto if p.modelo_id is None]
+
+
+def perfil_disponivel(projeto_id, perfil_id):
+    """O perfil pode ser atribuído a membros do projeto?"""
+    return any(p.id == perfil_id for p in perfis_do_projeto(projeto_id))
+
+
+def perfil_padrao(projeto_id, nome="Membro"):
+    """Id do perfil padrão `nome` no projeto (personalizado, se houver)"""
+    modelo = modelo_id(nome)
+    personalizado = db.session.scalar(
+        select(Perfil.id).where(Perfil.projeto_id == projeto_id, Perfil.modelo_id == modelo)
+    )
+    return personalizado or modelo
+
+
+def _mover_membros(projeto_id, de_perfil_id, para_perfil_id):
+    membros_do_projeto = select(ProjetoMembro.id).where(ProjetoMembro.projeto_id == projeto_id)
+    db.session.execute(
+        update(MembroPerfil)
+        .where(MembroPerfil.perfil_id == de_perfil_id, MembroPerfil.projeto_membro_id.in_(membros_do_projeto))
+        .values(perfil_id=para_perfil_id),
+        execution_options={"synchronize_session": False},
+    )
+
+
+def sobrescrever_modelo(projeto_id, modelo, valores):
+    """Personaliza o modelo global `modelo` no projeto com `valores` ({permissao: bool})"""
+    personalizado = Perfil.query.filter_by(projeto_id=projeto_id, modelo_id=modelo.id).first()
+    if personalizado is None:
+        personalizado = Perfil(
+            nome=modelo.nome,
+            projeto_id=projeto_id,
+            modelo_id=modelo.id,
+            acesso_total=modelo.acesso_total,
+            is_default=False,
+        )
+        db.session.add(personalizado)
+    for permissao in PERMISSOES:
+        setattr(personalizado, permissao, bool(valores.get(permissao)))
+    db.session.flush()
+    _mover_membros(projeto_id, modelo.id, personalizado.id)
+    return personalizado
+
+
+def restaurar_modelo(personalizado):
+    """Volta os membros do projeto para o modelo global e remove a personalização"""
+    _mover_membros(personalizado.projeto_id, personalizado.id, personalizado.modelo_id)
+    db.session.delete(personalizado)
+
+
+# ------------------------------------------------------------------------------
+# MIGRAÇÃO
+# ------------------------------------------------------------------------------
+def migrar_para_modelos():
+    """
+    Bancos antigos têm um Administrador e um Membro por projeto. Os que são
+    iguais ao modelo (todo Administrador, que sempre teve acesso total) passam
+    a apontar para o modelo global e são removidos; os que foram alterados
+    viram personalização do projeto. Perfis próprios chamados "Administrador"
+    mantêm o acesso total que o nome dava. Devolve quantos perfis foram removidos.
+    """
+    ids = garantir_modelos()
+    P = Perfil.__table__
+    removidos = 0
+    for nome, valores in PERFIS_PADRAO.items():
+        padrao_do_projeto = and_(P.c.projeto_id.isnot(None), P.c.is_default.is_(True), P.c.nome == nome)
+        if valores["acesso_total"]:
+            igual_ao_modelo = true()
+        else:
+            igual_ao_modelo = and_(*(func.coalesce(P.c[p], False) == valores[p] for p in PERMISSOES))
+        iguais = select(P.c.id).where(padrao_do_projeto, igual_ao_modelo)
+
+        db.session.execute(
+            update(MembroPerfil).where(MembroPerfil.perfil_id.in_(iguais)).values(perfil_id=ids[nome]),
+            execution_options={"synchronize_session": False},
+        )
+        removidos += db.session.execute(delete(P).where(padrao_do_projeto, igual_ao_modelo)).rowcount
+        db.session.execute(
+            update(P).where(padrao_do_projeto).values(modelo_id=ids[nome], is_default=False)
+        )
+
+    db.session.execute(
+        update(P).where(P.c.projeto_id.isnot(None), P.c.nome == "Administrador").values(acesso_total=True)
+    )
+    limpar_cache()
+    return removidos
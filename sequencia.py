@@ -0,0 +1,139 @@
+"""
+Numeração (numero_sequencial) das atividades de um cenário.
+
+(cenario_id, numero_sequencial) é único (uq_atividade_cenario_seq, criada
+por app.migrar_sequencia_unica). No PostgreSQL a constraint é DEFERRABLE
+INITIALLY DEFERRED: é verificada só no commit, então uma permutação inteira
+cabe em um único UPDATE ... CASE. No SQLite é um índice único verificado
+linha a linha; lá os números passam antes por valores negativos.
+
+Toda renumeração trava a linha do cenário (FOR UPDATE no PostgreSQL), para
+que duas requisições simultâneas não disputem o mesmo número.
+As funções não fazem commit: o chamador controla a transação.
+"""
+
+from sqlalchemy import case, func, select, update
+
+from models import db, incrementar_versao_fluxo, Atividade, Cenario
+
+_BULK = {"synchronize_session": False}
+
+
+class SequenciaInvalida(ValueError):
+    """Lista de reordenação que não corresponde às atividades do cenário"""
+
+
+def _travar_cenario(cenario_id):
+    return db.session.scalar(select(Cenario.projeto_id).where(Cenario.id == cenario_id).with_for_update())
+
+
+def _aplicar_numeros(novos):
+    """Grava {atividade_id: numero} com um UPDATE por passo"""
+    if not novos:
+        return
+    numero = case(novos, value=Atividade.id)
+    ids = list(novos)
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(
+            update(Atividade).where(Atividade.id.in_(ids)).values(numero_sequencial=numero),
+            execution_options=_BULK,
+        )
+    else:
+        db.session.execute(
+            update(Atividade).where(Atividade.id.in_(ids)).values(numero_sequencial=-numero),
+            execution_options=_BULK,
+        )
+        db.session.execute(
+            update(Atividade).where(Atividade.id.in_(ids)).values(numero_sequencial=-Atividade.numero_sequencial),
+            execution_options=_BULK,
+        )
+    # Os objetos já carregados na sessão passam a refletir o banco
+    for obj in db.session.identity_map.values():
+        if isinstance(obj, Atividade) and obj.id in novos:
+            db.session.expire(obj, ["numero_sequencial"])
+
+
+def proximo_numero(cenario_id):
+    return (db.session.scalar(
+        select(func.max(Atividade.numero_sequencial)).where(Atividade.cenario_id == cenario_id)
+    ) or 0) + 1
+
+
+def abrir_espaco(cenario_id, numero, atividade_id=None):
+    """
+    Deixa `numero` livre no cenário empurrando em +1 a atividade que o ocupa e
+    as seguintes contíguas (a primeira lacuna absorve o deslocamento).
+
+    Com `atividade_id` (atividade do próprio cenário), ela é movida para
+    `numero` no mesmo passo, e a posição antiga dela também serve de lacuna.
+    """
+    if cenario_id is None:
+        # Fora de cenário não há unicidade a preservar
+        if atividade_id is not None:
+            _aplicar_numeros({atividade_id: numero})
+        return
+    projeto_id = _travar_cenario(cenario_id)
+    linhas = db.session.execute(
+        select(Atividade.id, Atividade.numero_sequencial)
+        .where(Atividade.cenario_id == cenario_id, Atividade.numero_sequencial >= numero)
+        .order_by(Atividade.numero_sequencial)
+    ).all()
+    if atividade_id is not None and (atividade_id, numero) in [tuple(linha) for linha in linhas]:
+        return
+    novos, esperado = {}, numero
+    for id_atual, atual in linhas:
+        if id_atual == atividade_id or atual != esperado:
+            break
+        novos[id_atual] = atual + 1
+        esperado += 1
+    if atividade_id is not None:
+        novos[atividade_id] = numero
+    if novos:
+        _aplicar_numeros(novos)
+        incrementar_versao_fluxo(db.session.connection(), [projeto_id])
+
+
+def reordenar(cenario_id, atividade_ids, inicio=1):
+    """
+    Renumera o cenário na ordem de `atividade_ids` (inicio, inicio+1, ...).
+    A lista precisa conter cada atividade do cenário exatamente uma vez.
+    Devolve {atividade_id: numero}.
+    """
+    projeto_id = _travar_cenario(cenario_id)
+    atuais = dict(db.session.execute(
+        select(Atividade.id, Atividade.numero_sequencial).where(Atividade.cenario_id == cenario_id)
+    ).all())
+    if len(set(atividade_ids)) != len(atividade_ids):
+        raise SequenciaInvalida("Atividade repetida na lista")
+    if set(atividade_ids) != set(atuais):
+        raise SequenciaInvalida("A lista precisa conter todas as atividades do cenário, e só elas")
+
+    novos = {atividade_id: inicio + i for i, atividade_id in enumerate(atividade_ids)}
+    alterados = {atividade_id: n for atividade_id, n in novos.items() if atuais[atividade_id] != n}
+    if alterados:
+        _aplicar_numeros(alterados)
+        incrementar_versao_fluxo(db.session.connection(), [projeto_id])
+    return novos
+
+
+def corrigir_duplicados():
+    """
+    Renumera (1..n, na ordem atual por numero_sequencial e id) os cenários que
+    têm números repetidos. Usado antes de criar a constraint em bancos antigos.
+    Devolve os ids dos cenários corrigidos.
+    """
+    cenario_ids = db.session.scalars(
+        select(Atividade.cenario_id)
+        .where(Atividade.cenario_id.isnot(None))
+        .group_by(Atividade.cenario_id, Atividade.numero_sequencial)
+        .having(func.count() > 1)
+        .distinct()
+    ).all()
+    for cenario_id in cenario_ids:
+        ordem = db.session.scalars(
+            select(Atividade.id)
+            .where(Atividade.cenario_id == cenario_id)
+            .order_by(Atividade.numero_sequencial, Atividade.id)
+        ).all()
+        reordenar(cenario_id, ordem)
+    return cenario_ids
@@ -0,0 +1,235 @@
+"""
+Detecção de quase-duplicados (incidentes e lições aprendidas) com MinHash/LSH.
+
+Cada registro guarda uma assinatura MinHash da descrição: o texto é
+normalizado (minúsculas, sem acentos), quebrado em shingles de caracteres e
+resumido no mínimo de cada uma de NUM_HASHES funções de hash (os 256 bytes
+de SHAKE-128 de cada shingle; mudar isso invalida as assinaturas gravadas).
+A fração de posições iguais entre duas assinaturas estima a similaridade de
+Jaccard dos textos.
+
+A assinatura é dividida em BANDAS faixas; cada faixa vira uma chave em
+buckets_similaridade. Só os registros que compartilham ao menos uma chave
+com o texto digitado são comparados (busca no índice, não na tabela toda).
+Com 16 faixas de 4 linhas, pares com similaridade >= ~0,5 quase sempre
+colidem e pares abaixo de ~0,3 raramente.
+
+Manutenção na mesma transação:
+- criar/editar/excluir pelo ORM: after_flush deste módulo;
+- INSERT ... SELECT (clonagem.py): indexar_pendentes();
+- bancos antigos: app.migrar_assinaturas_similaridade() no startup, ou
+    python similares.py
+
+Não faz commit: o chamador controla a transação.
+"""
+
+import hashlib
+import logging
+import re
+import struct
+import unicodedata
+
+from sqlalchemy import delete, event, func, insert, select
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import Session
+
+from models import db, AssinaturaSimilaridade, BucketSimilaridade, Incidente, LicaoAprendida
+
+logger = logging.getLogger("imsis.similares")
+
+# Modelo -> tipo gravado nas tabelas de assinatura
+TIPOS = {"incidente": Incidente, "licao": LicaoAprendida}
+_TIPO_DO_MODELO = {modelo: tipo for tipo, modelo in TIPOS.items()}
+
+TAMANHO_SHINGLE = 5
+NUM_HASHES = 64
+BANDAS = 16
+LINHAS_POR_BANDA = NUM_HASHES // BANDAS
+LIMIAR = 0.5
+MAX_SUGESTOES = 5
+MAX_CANDIDATOS = 100
+
+_FORMATO = f"<{NUM_HASHES}I"
+
+
+# ------------------------------------------------------------------------------
+# ASSINATURA
+# ------------------------------------------------------------------------------
+def normalizar(texto):
+    sem_acentos = unicodedata.normalize("NFKD", texto or "").encode("ascii", "ignore").decode()
+    return " ".join(re.findall(r"[a-z0-9]+", sem_acentos.lower()))
+
+
+def shingles(texto):
+    normalizado = normalizar(texto)
+    if len(normalizado) <= TAMANHO_SHINGLE:
+        return {normalizado} if normalizado else set()
+    return {normalizado[i:i + TAMANHO_SHINGLE] for i in range(len(normalizado) - TAMANHO_SHINGLE + 1)}
+
+
+def _hashes(shingle):
+    """NUM_HASHES hashes independentes de 32 bits do shingle (um digest SHAKE de tamanho variável)"""
+    return struct.unpack(_FORMATO, hashlib.shake_128(shingle.encode()).digest(4 * NUM_HASHES))
+
+
+def assinatura(texto):
+    """Tupla de NUM_HASHES inteiros de 32 bits (None para texto vazio)"""
+    linhas = [_hashes(s) for s in shingles(texto)]
+    if not linhas:
+        return None
+    # Mínimo de cada função de hash sobre todos os shingles
+    return tuple(map(min, zip(*linhas)))
+
+
+def _para_bytes(valores):
+    return struct.pack(_FORMATO, *valores)
+
+
+def _de_bytes(dados):
+    return struct.unpack(_FORMATO, dados)
+
+
+def chaves_lsh(valores):
+    """Uma chave de 64 bits (com sinal, cabe em BIGINT) por banda"""
+    chaves = []
+    for banda in range(BANDAS):
+        faixa = valores[banda * LINHAS_POR_BANDA:(banda + 1) * LINHAS_POR_BANDA]
+        digest = hashlib.blake2b(struct.pack(f"<H{LINHAS_POR_BANDA}I", banda, *faixa), digest_size=8).digest()
+        chaves.append(int.from_bytes(digest, "little", signed=True))
+    return chaves
+
+
+def similaridade(a, b):
+    """Estimativa de Jaccard entre duas assinaturas"""
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_HASHES
+
+
+# ------------------------------------------------------------------------------
+# ÍNDICE
+# ------------------------------------------------------------------------------
+def _remover(conexao, tipo, registro_ids):
+    A, B = AssinaturaSimilaridade.__table__, BucketSimilaridade.__table__
+    conexao.execute(delete(B).where(B.c.tipo == tipo, B.c.registro_id.in_(registro_ids)))
+    conexao.execute(delete(A).where(A.c.tipo == tipo, A.c.registro_id.in_(registro_ids)))
+
+
+def _gravar(conexao, tipo, registros):
+    """Regrava assinatura e buckets de `registros` [(id, projeto_id, texto)]"""
+    if not registros:
+        return
+    _remover(conexao, tipo, [registro_id for registro_id, _, _ in registros])
+    assinaturas, buckets = [], []
+    for registro_id, projeto_id, texto in registros:
+        valores = assinatura(texto)
+        if valores is None:
+            continue
+        assinaturas.append({
+            "tipo": tipo, "registro_id": registro_id, "projeto_id": projeto_id,
+            "assinatura": _para_bytes(valores),
+        })
+        buckets.extend(
+            {"tipo": tipo, "registro_id": registro_id, "projeto_id": projeto_id, "banda": banda, "chave": chave}
+            for banda, chave in enumerate(chaves_lsh(valores))
+        )
+    if assinaturas:
+        conexao.execute(insert(AssinaturaSimilaridade.__table__), assinaturas)
+        conexao.execute(insert(BucketSimilaridade.__table__), buckets)
+
+
+def indexar_pendentes(tipo, projeto_id=None, lote=500):
+    """Calcula as assinaturas que faltam (registros inseridos fora do ORM). Devolve quantas"""
+    modelo = TIPOS[tipo]
+    A = AssinaturaSimilaridade
+    indexadas = select(A.registro_id).where(A.tipo == tipo)
+    filtro = [modelo.id.not_in(indexadas)]
+    if projeto_id is not None:
+        filtro.append(modelo.projeto_id == projeto_id)
+    total, ultimo_id = 0, 0
+    while True:
+        registros = db.session.execute(
+            select(modelo.id, modelo.projeto_id, modelo.descricao)
+            .where(*filtro, modelo.id > ultimo_id)
+            .order_by(modelo.id)
+            .limit(lote)
+        ).all()
+        if not registros:
+            return total
+        _gravar(db.session.connection(), tipo, registros)
+        total += len(registros)
+        ultimo_id = registros[-1][0]
+
+
+@event.listens_for(Session, "after_flush")
+def _assinaturas_apos_flush(session, flush_context):
+    alterados, removidos = {}, {}
+    for obj in session.new:
+        tipo = _TIPO_DO_MODELO.get(type(obj))
+        if tipo:
+            alterados.setdefault(tipo, []).append((obj.id, obj.projeto_id, obj.descricao))
+    for obj in session.dirty:
+        tipo = _TIPO_DO_MODELO.get(type(obj))
+        if tipo and sa_inspect(obj).attrs.descricao.history.has_changes():
+            alterados.setdefault(tipo, []).append((obj.id, obj.projeto_id, obj.descricao))
+    for obj in session.deleted:
+        tipo = _TIPO_DO_MODELO.get(type(obj))
+        if tipo:
+            removidos.setdefault(tipo, []).append(obj.id)
+
+    conexao = session.connection() if alterados or removidos else None
+    for tipo, registros in alterados.items():
+        _gravar(conexao, tipo, registros)
+    for tipo, registro_ids in removidos.items():
+        _remover(conexao, tipo, registro_ids)
+
+
+# ------------------------------------------------------------------------------
+# CONSULTA
+# ------------------------------------------------------------------------------
+def sugerir(tipo, projeto_id, texto, ignorar_id=None):
+    """
+    Registros do projeto parecidos com `texto`, do mais para o menos parecido:
+    [(registro, similaridade)] com similaridade >= LIMIAR.
+    """
+    valores = assinatura(texto)
+    if valores is None:
+        return []
+    A, B = AssinaturaSimilaridade, BucketSimilaridade
+    filtro = [B.tipo == tipo, B.projeto_id == projeto_id, B.chave.in_(chaves_lsh(valores))]
+    if ignorar_id is not None:
+        filtro.append(B.registro_id != ignorar_id)
+    candidatos = db.session.scalars(
+        select(B.registro_id)
+        .where(*filtro)
+        .group_by(B.registro_id)
+        .order_by(func.count().desc(), B.registro_id.desc())
+        .limit(MAX_CANDIDATOS)
+    ).all()
+    if not candidatos:
+        return []
+
+    linhas = db.session.execute(
+        select(A.registro_id, A.assinatura).where(A.tipo == tipo, A.registro_id.in_(candidatos))
+    )
+    pontuados = sorted(
+        ((similaridade(valores, _de_bytes(dados)), registro_id) for registro_id, dados in linhas),
+        reverse=True,
+    )
+    pontuados = [(pontos, registro_id) for pontos, registro_id in pontuados if pontos >= LIMIAR][:MAX_SUGESTOES]
+    if not pontuados:
+        return []
+    modelo = TIPOS[tipo]
+    registros = {r.id: r for r in modelo.query.filter(modelo.id.in_([i for _, i in pontuados]))}
+    return [(registros[i], pontos) for pontos, i in pontuados if i in registros]
+
+
+if __name__ == "__main__":
+    from app import create_app
+    from app_logging import configure_logging
+
+    configure_logging()
+    app = create_app({"BOOTSTRAP_DB": False})
+    with app.app_context():
+        for tipo in TIPOS:
+            quantidade = indexar_pendentes(tipo)
+            db.session.commit()
+            logger.info("Assinaturas calculadas", extra={"tipo": tipo, "registros": quantidade})
@@ -0,0 +1,335 @@
+"""
+Histórico de status dos incidentes e indicadores de SLA por projeto.
+
+Cada mudança de status feita pelo ORM (criar/editar incidente) vira uma
+linha em incidente_transicoes com o tempo passado no status anterior; o
+incidente guarda em status_desde o início do status atual. Na mesma
+transação os indicadores do projeto são somados em sla_incidentes, um
+histograma por métrica com faixas fixas (FAIXAS):
+- resolucao: da criação até a entrada em Concluído. Reabrir o incidente
+  desconta a resolução anterior;
+- aguardando_externo: cada período em "Aguardando Externo", contado quando
+  o incidente sai do status.
+
+relatorio() lê só o histograma do projeto (média exata, p90 estimado pela
+faixa, como o histogram_quantile do Prometheus); o histórico não é
+relido. Excluir um incidente não apaga as transições nem desconta os
+indicadores.
+
+recalcular() refaz o histograma a partir das transições:
+    python sla.py [--projeto ID]
+"""
+
+import logging
+from bisect import bisect_left
+from datetime import datetime
+
+from sqlalchemy import BigInteger, case, cast, event, func, insert, literal, select, true, union_all
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, aliased
+
+from auditoria import usuario_atual
+from models import db, Incidente, SlaIncidente, TransicaoIncidente, User
+
+logger = logging.getLogger("imsis.sla")
+
+STATUS_CONCLUIDO = "Concluído"
+STATUS_AGUARDANDO_EXTERNO = "Aguardando Externo"
+METRICAS = ("resolucao", "aguardando_externo")
+
+# Limite superior (segundos) de cada faixa do histograma; a última faixa não tem limite
+FAIXAS = tuple(horas * 3600 for horas in (1, 4, 8, 24, 48, 72, 120, 168, 336, 720, 1440, 2160))
+QUANTIL = 0.9
+
+_INSERT = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def faixa(segundos):
+    """Índice da faixa de `segundos` (len(FAIXAS) = acima da última)"""
+    return bisect_left(FAIXAS, segundos)
+
+
+def _segundos(fim, inicio):
+    if fim is None or inicio is None:
+        return 0
+    return max(0, int((fim - inicio).total_seconds()))
+
+
+def _somar(deltas, projeto_id, metrica, segundos, sinal=1):
+    acumulado = deltas.setdefault((projeto_id, metrica, faixa(segundos)), [0, 0])
+    acumulado[0] += sinal
+    acumulado[1] += sinal * segundos
+
+
+def aplicar(conexao, deltas):
+    """Soma `deltas` ({(projeto_id, metrica, faixa): [quantidade, soma_segundos]}) no histograma"""
+    linhas = [
+        {"projeto_id": p, "metrica": m, "faixa": f, "quantidade": q, "soma_segundos": s}
+        for (p, m, f), (q, s) in sorted(deltas.items())
+        if q or s
+    ]
+    if not linhas:
+        return
+    tabela = SlaIncidente.__table__
+    comando = _INSERT[conexao.dialect.name](tabela)
+    # Ordem fixa das chaves evita deadlock entre transações
+    conexao.execute(
+        comando.on_conflict_do_update(
+            index_elements=[tabela.c.projeto_id, tabela.c.metrica, tabela.c.faixa],
+            set_={
+                "quantidade": tabela.c.quantidade + comando.excluded.quantidade,
+                "soma_segundos": tabela.c.soma_segundos + comando.excluded.soma_segundos,
+            },
+        ),
+        linhas,
+    )
+
+
+# ------------------------------------------------------------------------------
+# CAPTURA
+# ------------------------------------------------------------------------------
+@event.listens_for(Session, "before_flush")
+def _status_antes_do_flush(session, flush_context, instances):
+    # Recomeça a cada flush: um flush que falhou não deixa sobras
+    transicoes, deltas = [], {}
+    session.info["sla"] = (transicoes, deltas)
+    agora = None
+    for obj in session.dirty:
+        if not isinstance(obj, Incidente):
+            continue
+        historico = sa_inspect(obj).attrs.status.history
+        anterior = historico.deleted[0] if historico.deleted else None
+        if not historico.added or anterior == obj.status:
+            continue
+        agora = agora or datetime.utcnow()
+        desde = obj.status_desde or obj.data_criacao
+        duracao = _segundos(agora, desde)
+        resolucao = None
+        if anterior == STATUS_AGUARDANDO_EXTERNO:
+            _somar(deltas, obj.projeto_id, "aguardando_externo", duracao)
+        if anterior == STATUS_CONCLUIDO:
+            _somar(deltas, obj.projeto_id, "resolucao", _segundos(desde, obj.data_criacao), -1)
+        if obj.status == STATUS_CONCLUIDO:
+            resolucao = _segundos(agora, obj.data_criacao)
+            _somar(deltas, obj.projeto_id, "resolucao", resolucao)
+        transicoes.append({
+            "projeto_id": obj.projeto_id,
+            "incidente_id": obj.id,
+            "de": anterior,
+            "para": obj.status,
+            "em": agora,
+            "duracao_segundos": duracao,
+            "resolucao_segundos": resolucao,
+        })
+        obj.status_desde = agora
+
+
+@event.listens_for(Session, "after_flush")
+def _status_apos_flush(session, flush_context):
+    transicoes, deltas = session.info.pop("sla", ([], {}))
+    for obj in session.new:
+        if not isinstance(obj, Incidente):
+            continue
+        resolucao = None
+        if obj.status == STATUS_CONCLUIDO:
+            resolucao = _segundos(obj.status_desde, obj.data_criacao)
+            _somar(deltas, obj.projeto_id, "resolucao", resolucao)
+        transicoes.append({
+            "projeto_id": obj.projeto_id,
+            "incidente_id": obj.id,
+            "de": None,
+            "para": obj.status,
+            "em": obj.status_desde,
+            "duracao_segundos": None,
+            "resolucao_segundos": resolucao,
+        })
+    if not transicoes:
+        return
+    user_id = usuario_atual()
+    for transicao in transicoes:
+        transicao["user_id"] = user_id
+    conexao = session.connection()
+    conexao.execute(insert(TransicaoIncidente.__table__), transicoes)
+    aplicar(conexao, deltas)
+
+
+# ------------------------------------------------------------------------------
+# CONSULTA
+# ------------------------------------------------------------------------------
+def _quantil(contagens, q=QUANTIL):
+    total = sum(contagens)
+    if total <= 0:
+        return None
+    alvo = q * total
+    acumulado = 0
+    for i, quantidade in enumerate(contagens):
+        if quantidade > 0 and acumulado + quantidade >= alvo:
+            inicio = FAIXAS[i - 1] if i else 0
+            if i == len(FAIXAS):
+                return inicio
+            return inicio + (FAIXAS[i] - inicio) * (alvo - acumulado) / quantidade
+        acumulado += quantidade
+    return FAIXAS[-1]
+
+
+def _horas(segundos):
+    return None if segundos is None else round(segundos / 3600, 1)
+
+
+def relatorio(projeto_id):
+    """{metrica: {"quantidade", "media_horas", "p90_horas"}} + incidentes aguardando externo agora"""
+    S = SlaIncidente
+    histogramas = {metrica: [[0, 0] for _ in range(len(FAIXAS) + 1)] for metrica in METRICAS}
+    for metrica, indice, quantidade, soma in db.session.execute(
+        select(S.metrica, S.faixa, S.quantidade, S.soma_segundos).where(S.projeto_id == projeto_id)
+    ):
+        if metrica in histogramas and 0 <= indice <= len(FAIXAS):
+            histogramas[metrica][indice] = [quantidade, soma]
+
+    resultado = {}
+    for metrica, faixas in histogramas.items():
+        quantidade = sum(q for q, _ in faixas)
+        soma = sum(s for _, s in faixas)
+        resultado[metrica] = {
+            "quantidade": quantidade,
+            "media_horas": _horas(soma / quantidade) if quantidade > 0 else None,
+            "p90_horas": _horas(_quantil([q for q, _ in faixas])),
+        }
+    resultado["aguardando_externo_agora"] = db.session.scalar(
+        select(func.count()).select_from(Incidente).where(
+            Incidente.projeto_id == projeto_id, Incidente.status == STATUS_AGUARDANDO_EXTERNO
+        )
+    )
+    return resultado
+
+
+def transicoes(incidente_id, projeto_id):
+    """Mudanças de status do incidente, da mais antiga para a mais nova"""
+    T = TransicaoIncidente
+    linhas = db.session.execute(
+        select(T.de, T.para, T.em, T.duracao_segundos, User.username)
+        .outerjoin(User, User.id == T.user_id)
+        .where(T.incidente_id == incidente_id, T.projeto_id == projeto_id)
+        .order_by(T.id)
+    )
+    return [
+        {
+            "de": de,
+            "para": para,
+            "em": em.isoformat(timespec="seconds"),
+            "horas_no_status_anterior": _horas(duracao),
+            "usuario": username,
+        }
+        for de, para, em, duracao, username in linhas
+    ]
+
+
+# ------------------------------------------------------------------------------
+# CARGA INICIAL E REPARO
+# ------------------------------------------------------------------------------
+def _segundos_sql(fim, inicio):
+    if db.engine.dialect.name == "postgresql":
+        return cast(func.extract("epoch", fim - inicio), BigInteger)
+    return cast((func.julianday(fim) - func.julianday(inicio)) * 86400, BigInteger)
+
+
+def registrar_existentes():
+    """
+    Incidentes sem histórico (anteriores a ele ou inseridos em lote): uma
+    transição de criação com o status atual, desde a última modificação
+    quando status_desde está vazio (a resolução dos concluídos vai até
+    status_desde). Devolve quantos foram registrados.
+    """
+    I, T = Incidente.__table__, TransicaoIncidente.__table__
+    sem_transicao = ~select(T.c.id).where(T.c.incidente_id == I.c.id).exists()
+    if db.session.scalar(select(I.c.id).where(sem_transicao).limit(1)) is None:
+        return 0
+    db.session.execute(
+        I.update()
+        .where(I.c.status_desde.is_(None))
+        .values(
+            status_desde=func.coalesce(I.c.data_ultima_modificacao, I.c.data_criacao, func.now()),
+            data_ultima_modificacao=I.c.data_ultima_modificacao,
+        )
+    )
+    return db.session.execute(
+        insert(T).from_select(
+            ["projeto_id", "incidente_id", "de", "para", "em", "resolucao_segundos"],
+            select(
+                I.c.projeto_id, I.c.id, literal(None), I.c.status, I.c.status_desde,
+                case(
+                    (
+                        I.c.status == STATUS_CONCLUIDO,
+                        _segundos_sql(I.c.status_desde, func.coalesce(I.c.data_criacao, I.c.status_desde)),
+                    ),
+                ),
+            ).where(sem_transicao),
+        )
+    ).rowcount
+
+
+def _faixa_sql(valor):
+    return case(*((valor <= limite, indice) for indice, limite in enumerate(FAIXAS)), else_=len(FAIXAS))
+
+
+def recalcular(projeto_id=None):
+    """
+    Refaz o histograma (de um projeto ou de todos) a partir das transições.
+    Devolve quantas linhas estavam divergentes. Não faz commit.
+    """
+    T, S = TransicaoIncidente, SlaIncidente
+    outra = aliased(TransicaoIncidente)
+    ultima = select(func.max(outra.id)).where(outra.incidente_id == T.incidente_id).scalar_subquery()
+    filtro = [T.projeto_id == projeto_id] if projeto_id is not None else []
+    valores = union_all(
+        # Resolução vale se a última transição do incidente é a entrada em Concluído
+        select(T.projeto_id, literal("resolucao").label("metrica"), T.resolucao_segundos.label("segundos")).where(
+            T.resolucao_segundos.isnot(None), T.id == ultima, *filtro
+        ),
+        select(T.projeto_id, literal("aguardando_externo"), func.coalesce(T.duracao_segundos, 0)).where(
+            T.de == STATUS_AGUARDANDO_EXTERNO, *filtro
+        ),
+    ).subquery()
+    indice = _faixa_sql(valores.c.segundos)
+    novos = {
+        (p, m, f): (q, s)
+        for p, m, f, q, s in db.session.execute(
+            select(valores.c.projeto_id, valores.c.metrica, indice, func.count(), func.sum(valores.c.segundos))
+            .group_by(valores.c.projeto_id, valores.c.metrica, indice)
+        )
+    }
+    atuais = {
+        (p, m, f): (q, s)
+        for p, m, f, q, s in db.session.execute(
+            select(S.projeto_id, S.metrica, S.faixa, S.quantidade, S.soma_segundos).where(
+                S.projeto_id == projeto_id if projeto_id is not None else true()
+            )
+        )
+        if q or s
+    }
+    divergentes = sum(1 for chave in novos.keys() | atuais.keys() if novos.get(chave) != atuais.get(chave))
+    if divergentes:
+        tabela = S.__table__
+        db.session.execute(tabela.delete().where(tabela.c.projeto_id == projeto_id if projeto_id is not None else true()))
+        aplicar(db.session.connection(), {chave: list(valor) for chave, valor in novos.items()})
+        logger.warning("Indicadores de SLA divergentes corrigidos", extra={"projeto_id": projeto_id, "linhas": divergentes})
+    return divergentes
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from app import create_app
+    from app_logging import configure_logging
+
+    parser = argparse.ArgumentParser(description="Recalcula os indicadores de SLA dos incidentes")
+    parser.add_argument("--projeto", type=int, help="Apenas este projeto (padrão: todos)")
+    args = parser.parse_args()
+
+    configure_logging()
+    app = create_app({"BOOTSTRAP_DB": False})
+    with app.app_context():
+        divergentes = recalcular(args.projeto)
+        db.session.commit()
+        logger.info("Indicadores de SLA recalculados", extra={"divergentes": divergentes})
@@ -0,0 +1,72 @@
+// Busca no projeto (campo do menu lateral): incidentes, riscos, mudanças,
+// lições e atividades, agrupados por tipo. O trecho de cada resultado já vem
+// escapado do servidor, só com <mark> nos termos encontrados.
+const TITULOS_BUSCA = {
+    atividade: 'Atividades',
+    incidente: 'Incidentes',
+    risco: 'Riscos',
+    mudanca: 'Mudanças',
+    licao: 'Lições Aprendidas'
+};
+
+function iniciarBuscaProjeto(campo) {
+    const resultados = document.getElementById(campo.dataset.resultados);
+    let timer = null;
+    let seq = 0;
+
+    campo.addEventListener('input', () => {
+        clearTimeout(timer);
+        timer = setTimeout(buscar, 250);
+    });
+
+    campo.addEventListener('keydown', (e) => {
+        if (e.key === 'Escape') {
+            campo.value = '';
+            resultados.replaceChildren();
+        }
+    });
+
+    async function buscar() {
+        const termo = campo.value.trim();
+        const atual = ++seq;
+        if (!termo) {
+            resultados.replaceChildren();
+            return;
+        }
+        const resp = await fetch(`${campo.dataset.url}?q=${encodeURIComponent(termo)}`);
+        if (!resp.ok || atual !== seq) {
+            return;
+        }
+        const dados = await resp.json();
+        resultados.replaceChildren();
+        if (!dados.grupos.length) {
+            const vazio = document.createElement('div');
+            vazio.className = 'busca-projeto-vazio';
+            vazio.textContent = 'Nada encontrado.';
+            resultados.appendChild(vazio);
+            return;
+        }
+        dados.grupos.forEach(grupo => {
+            const titulo = document.createElement('div');
+            titulo.className = 'busca-projeto-grupo';
+            titulo.textContent = `${TITULOS_BUSCA[grupo.tipo] || grupo.tipo} (${grupo.total})`;
+            resultados.appendChild(titulo);
+            grupo.itens.forEach(item => {
+                const link = document.createElement('a');
+                link.className = 'busca-projeto-item';
+                link.href = item.url;
+                const nome = document.createElement('div');
+                nome.textContent = `#${item.registro_id} ${item.titulo || ''}`;
+                const trecho = document.createElement('div');
+                trecho.className = 'busca-projeto-trecho';
+                trecho.innerHTML = item.trecho;
+                link.append(nome, trecho);
+                resultados.appendChild(link);
+            });
+        });
+    }
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    document.querySelectorAll('.busca-projeto').forEach(iniciarBuscaProjeto);
+});
@@ -0,0 +1,91 @@
+"""
+Fixtures dos testes: a aplicação sobre um SQLite temporário (mesmo
+create_app da produção, com as migrações de startup) e um projeto com
+fase, cenário e um usuário logado criados pelas rotas.
+"""
+
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+_arquivo_db = tempfile.NamedTemporaryFile(prefix="imsis-testes-", suffix=".db", delete=False)
+_arquivo_db.close()
+os.environ["DATABASE_URL"] = f"sqlite:///{_arquivo_db.name}"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+_numeros = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def app():
+    import app as aplicacao
+
+    app = aplicacao.create_app({"LOAD_SECRETS": False, "TESTING": True})
+    yield app
+    os.unlink(_arquivo_db.name)
+
+
+@pytest.fixture
+def db(app):
+    from models import db
+
+    with app.app_context():
+        yield db
+        db.session.rollback()
+
+
+@pytest.fixture
+def projeto(app, db):
+    """Projeto criado pela rota (o criador é administrador), com uma fase e um cenário"""
+    from werkzeug.security import generate_password_hash
+
+    from models import Cenario, Fase, Projeto, User
+
+    n = next(_numeros)
+    usuario = User(
+        username=f"usuario{n}", email=f"usuario{n}@teste", password=generate_password_hash("senha"),
+        email_verified=True,
+    )
+    db.session.add(usuario)
+    db.session.commit()
+
+    cliente = app.test_client()
+    assert cliente.post("/login", data={"email": usuario.email, "password": "senha"}).status_code == 302
+    assert cliente.post("/projetos", data={"nome": f"Projeto {n}"}).status_code == 302
+    projeto = Projeto.query.filter_by(nome=f"Projeto {n}").one()
+
+    fase = Fase(nome="Fase", projeto_id=projeto.id)
+    db.session.add(fase)
+    db.session.flush()
+    cenario = Cenario(cenario="Cenário", fase_id=fase.id, projeto_id=projeto.id)
+    db.session.add(cenario)
+    db.session.commit()
+
+    projeto.cliente, projeto.usuario, projeto.fase, projeto.cenario = cliente, usuario, fase, cenario
+    return projeto
+
+
+@pytest.fixture
+def criar_atividades(db, projeto):
+    """criar_atividades("A", "B") -> atividades no cenário do projeto, na ordem"""
+    from models import Atividade
+
+    def criar(*descricoes):
+        atividades = [
+            Atividade(
+                numero_sequencial=i, descricao=descricao, responsavel=projeto.usuario.username,
+                cenario_id=projeto.cenario.id, projeto_id=projeto.id,
+            )
+            for i, descricao in enumerate(descricoes, 1)
+        ]
+        db.session.add_all(atividades)
+        db.session.commit()
+        return atividades
+
+    return criar
@@ -0,0 +1,37 @@
+import acompanhamentos
+import busca
+from models import Incidente
+
+
+def _ids_encontrados(projeto_id, texto):
+    grupos = busca.buscar_no_projeto(projeto_id, texto)
+    return [item["registro_id"] for item in grupos.get("incidente", {}).get("itens", [])]
+
+
+def test_nota_nova_entra_na_busca_do_projeto(db, projeto):
+    incidente = Incidente(projeto_id=projeto.id, descricao="Falha na carga", status="Criado")
+    db.session.add(incidente)
+    db.session.commit()
+    assert _ids_encontrados(projeto.id, "transportadora") == []
+
+    acompanhamentos.adicionar("incidente", incidente, "Aguardando retorno da transportadora", projeto.usuario.id)
+    db.session.commit()
+    assert _ids_encontrados(projeto.id, "transportadora") == [incidente.id]
+
+    # Editar o incidente refaz a linha do índice sem perder as notas
+    incidente.status = "Em andamento"
+    db.session.commit()
+    assert _ids_encontrados(projeto.id, "transportadora") == [incidente.id]
+
+
+def test_texto_antigo_migrado_continua_pesquisavel(db, projeto):
+    incidente = Incidente(projeto_id=projeto.id, descricao="Erro de integração", acompanhamento="reprocessar lote fiscal")
+    db.session.add(incidente)
+    db.session.commit()
+    assert _ids_encontrados(projeto.id, "reprocessar") == []
+
+    acompanhamentos.migrar_existentes()
+    busca.indexar_notas_pendentes()
+    db.session.commit()
+    assert _ids_encontrados(projeto.id, "reprocessar") == [incidente.id]
+    assert busca.indexar_notas_pendentes() == 0
@@ -0,0 +1,32 @@
+import auditoria
+import deletion
+import dependencias
+
+
+def test_exclusao_de_fase_fica_na_trilha_das_atividades(db, projeto, criar_atividades):
+    a, b = criar_atividades("Carga inicial", "Validação")
+    ids = [a.id, b.id]
+
+    deletion.excluir_fase(projeto.fase.id)
+    db.session.commit()
+    auditoria.descarregar()
+
+    for atividade_id, descricao in zip(ids, ("Carga inicial", "Validação")):
+        trilha = auditoria.historico("atividade", atividade_id, projeto.id)
+        assert trilha[0]["acao"] == "excluir"
+        assert trilha[0]["alteracoes"]["descricao"] == [descricao, None]
+
+
+def test_liberacao_pelo_grafo_fica_na_trilha(db, criar_atividades):
+    a, b = criar_atividades("A", "B")
+    dependencias.adicionar_dependencia(a, b)
+    db.session.commit()
+
+    dependencias.concluir(a)
+    db.session.commit()
+    auditoria.descarregar()
+
+    trilha = auditoria.historico("atividade", b.id)
+    assert trilha[0]["acao"] == "editar"
+    assert trilha[0]["alteracoes"]["data_liberacao"][0] is None
+    assert trilha[0]["alteracoes"]["data_liberacao"][1] is not None
@@ -0,0 +1,91 @@
+import dependencias
+
+
+def _grafo_a_b_para_c(db, criar_atividades):
+    a, b, c = criar_atividades("A", "B", "C")
+    dependencias.adicionar_dependencia(a, c)
+    dependencias.adicionar_dependencia(b, c)
+    db.session.commit()
+    return a, b, c
+
+
+def test_concluir_duas_vezes_nao_decrementa_de_novo(db, criar_atividades):
+    a, b, c = _grafo_a_b_para_c(db, criar_atividades)
+    assert c.predecessoras_pendentes == 2
+
+    dependencias.concluir(a)
+    db.session.commit()
+    assert dependencias.concluir(a) == []
+    db.session.commit()
+
+    db.session.refresh(c)
+    assert c.predecessoras_pendentes == 1
+    assert c.data_liberacao is None
+
+
+def test_rotas_recusam_atividade_ja_concluida(db, projeto, criar_atividades):
+    a, b, c = _grafo_a_b_para_c(db, criar_atividades)
+    rotas = (
+        (f"/concluir/{a.id}", {}),
+        (
+            f"/projetos/{projeto.id}/concluir_atividade",
+            {"atividade_id": a.id, "fase_id": projeto.fase.id, "cenario_id": projeto.cenario.id},
+        ),
+    )
+    for url, dados in rotas:
+        assert projeto.cliente.post(url, data=dados).status_code == 302
+
+    db.session.expire_all()
+    assert c.predecessoras_pendentes == 1
+    assert c.data_liberacao is None
+    assert b.data_conclusao is None
+
+
+def test_aresta_num_cenario_linear_so_muda_a_sucessora(db, criar_atividades):
+    b1, b2, b3, b4, b5 = criar_atividades("B1", "B2", "B3", "B4", "B5")
+    dependencias.liberar_iniciais(b1.cenario_id)
+    db.session.commit()
+    assert b1.data_liberacao is not None
+
+    dependencias.adicionar_dependencia(b2, b4)
+    db.session.commit()
+    db.session.expire_all()
+    assert [a.data_liberacao is not None for a in (b1, b2, b3, b4, b5)] == [True, False, False, False, False]
+
+    assert dependencias.concluir(b1) == [b2]
+    assert {a.id for a in dependencias.concluir(b2)} == {b3.id, b4.id}
+    assert dependencias.concluir(b3) == []
+    db.session.commit()
+    db.session.expire_all()
+    assert b5.data_liberacao is None
+    assert [a.id for a in dependencias.concluir(b4)] == [b5.id]
+
+
+def test_reordenar_move_o_ponto_de_liberacao(db, projeto, criar_atividades):
+    a1, a2, a3 = criar_atividades("A1", "A2", "A3")
+    dependencias.liberar_iniciais(projeto.cenario.id)
+    db.session.commit()
+
+    url = f"/projetos/{projeto.id}/cenarios/{projeto.cenario.id}/reordenar"
+    resposta = projeto.cliente.post(url, json={"atividade_ids": [a2.id, a3.id, a1.id]})
+    assert resposta.status_code == 200
+    db.session.expire_all()
+    assert a2.data_liberacao is not None
+    assert a1.data_liberacao is None and a3.data_liberacao is None
+
+    assert dependencias.concluir(a2) == [a3]
+    assert dependencias.concluir(a3) == [a1]
+    db.session.commit()
+
+
+def test_reordenar_aceita_lista_no_corpo(db, projeto, criar_atividades):
+    a1, a2 = criar_atividades("A1", "A2")
+    url = f"/projetos/{projeto.id}/cenarios/{projeto.cenario.id}/reordenar"
+
+    resposta = projeto.cliente.post(url, json=[a2.id, a1.id])
+    assert resposta.status_code == 200
+    db.session.expire_all()
+    assert (a2.numero_sequencial, a1.numero_sequencial) == (1, 2)
+
+    assert projeto.cliente.post(url, json="a1").status_code == 400
+    assert projeto.cliente.post(url, json={"atividade_ids": 3}).status_code == 400
@@ -0,0 +1,25 @@
+def test_metrics_fechado_sem_token(app, monkeypatch):
+    monkeypatch.delenv("METRICS_TOKEN", raising=False)
+    monkeypatch.delenv("METRICS_PUBLIC", raising=False)
+    assert app.test_client().get("/metrics").status_code == 404
+
+
+def test_metrics_com_token(app, monkeypatch):
+    monkeypatch.setenv("METRICS_TOKEN", "segredo")
+    cliente = app.test_client()
+    assert cliente.get("/metrics").status_code == 401
+    resposta = cliente.get("/metrics", headers={"Authorization": "Bearer segredo"})
+    assert resposta.status_code == 200
+    assert "imsis_http_requests_total" in resposta.get_data(as_text=True)
+
+
+def test_metrics_publico_so_com_flag(app, monkeypatch):
+    monkeypatch.delenv("METRICS_TOKEN", raising=False)
+    monkeypatch.setenv("METRICS_PUBLIC", "true")
+    assert app.test_client().get("/metrics").status_code == 200
+
+
+def test_metrics_header_nao_ascii_responde_401(app, monkeypatch):
+    monkeypatch.setenv("METRICS_TOKEN", "segredo")
+    resposta = app.test_client().get("/metrics", headers={"Authorization": "Bearer sẽgredo"})
+    assert resposta.status_code == 401
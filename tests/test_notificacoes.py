@@ -0,0 +1,63 @@
+import contextlib
+import smtplib
+from datetime import datetime
+
+import agendador
+import notificacoes
+from models import Notificacao, User
+
+
+def test_resumo_diario_envia_todos_os_lotes(app, db, projeto, monkeypatch):
+    import app as modulo_app
+
+    total = notificacoes.LOTE_USUARIOS + 5
+    usuarios = [User(username=f"lote{projeto.id}_{i}", email=f"lote{projeto.id}_{i}@teste", password="x") for i in range(total)]
+    recusado = User(username=f"recusado{projeto.id}", email=f"recusado{projeto.id}@teste", password="x")
+    ocupado = User(username=f"ocupado{projeto.id}", email=f"ocupado{projeto.id}@teste", password="x")
+    db.session.add_all([recusado, ocupado, *usuarios])
+    db.session.flush()
+    notificacoes.registrar([
+        {"user_id": u.id, "projeto_id": projeto.id, "tipo": "atividade_liberada", "registro_id": 1, "texto": "A"}
+        for u in (recusado, ocupado, *usuarios)
+    ])
+    db.session.commit()
+
+    recebidos = []
+
+    class Servidor:
+        def send_message(self, mensagem):
+            destino = mensagem["To"]
+            if destino == recusado.email:
+                raise smtplib.SMTPRecipientsRefused({destino: (550, b"mailbox unavailable")})
+            if destino == ocupado.email:
+                raise smtplib.SMTPRecipientsRefused({destino: (450, b"try again later")})
+            recebidos.append(destino)
+
+    monkeypatch.setattr(modulo_app, "smtp_session", lambda: contextlib.nullcontext(Servidor()))
+    monkeypatch.setitem(app.config, "SMTP_HOST", "localhost")
+    monkeypatch.setitem(app.config, "SMTP_FROM", "imsis@teste")
+
+    assert agendador.enviar_resumo_diario(datetime.utcnow()) == len(recebidos)
+    db.session.commit()
+
+    assert {u.email for u in usuarios} <= set(recebidos)
+    assert len(recebidos) == len(set(recebidos))
+    assert [n.user_id for n in Notificacao.query.all()] == [ocupado.id]
+
+
+def test_lote_comeca_por_quem_espera_ha_mais_tempo(db, projeto):
+    antigo, novo = (
+        User(username=f"{nome}{projeto.id}", email=f"{nome}{projeto.id}@teste", password="x")
+        for nome in ("antigo", "novo")
+    )
+    db.session.add_all([novo, antigo])
+    db.session.flush()
+    assert novo.id < antigo.id
+    db.session.query(Notificacao).delete()
+    for usuario in (antigo, novo):
+        notificacoes.registrar([
+            {"user_id": usuario.id, "projeto_id": projeto.id, "tipo": "atividade_liberada", "registro_id": 1, "texto": "A"}
+        ])
+
+    assert list(notificacoes.resumos_pendentes(limite=1)) == [antigo.id]
+    assert list(notificacoes.resumos_pendentes(limite=1, ignorar={antigo.id})) == [novo.id]
@@ -0,0 +1,57 @@
+import permissoes
+from models import MembroPerfil, Perfil, PERFIS_PADRAO, Projeto, ProjetoMembro, User
+
+
+def _membro_com_perfil(db, projeto, nome, perfil):
+    usuario = User(username=nome, email=f"{nome}@teste", password="x")
+    db.session.add(usuario)
+    db.session.flush()
+    membro = ProjetoMembro(projeto_id=projeto.id, user_id=usuario.id)
+    db.session.add(membro)
+    db.session.flush()
+    db.session.add(MembroPerfil(projeto_membro_id=membro.id, perfil_id=perfil.id))
+    return usuario
+
+
+def _perfil_antigo(db, projeto, nome, **alteracoes):
+    perfil = Perfil(nome=nome, projeto_id=projeto.id, is_default=True, **{**PERFIS_PADRAO[nome], **alteracoes})
+    db.session.add(perfil)
+    db.session.flush()
+    return perfil
+
+
+def test_migracao_mantem_membro_personalizado_e_remove_os_iguais(db, projeto):
+    outro = Projeto(nome=f"Outro {projeto.id}")
+    db.session.add(outro)
+    db.session.flush()
+
+    personalizado = _perfil_antigo(db, projeto, "Membro", pode_excluir_atividade=True)
+    admin_antigo = _perfil_antigo(db, projeto, "Administrador", acesso_total=False, pode_editar_projeto=False)
+    igual = _perfil_antigo(db, outro, "Membro")
+    ana = _membro_com_perfil(db, projeto, f"ana{projeto.id}", personalizado)
+    bia = _membro_com_perfil(db, projeto, f"bia{projeto.id}", admin_antigo)
+    caio = _membro_com_perfil(db, outro, f"caio{projeto.id}", igual)
+    ids_antigos = (personalizado.id, admin_antigo.id, igual.id)
+    db.session.commit()
+
+    assert permissoes.migrar_para_modelos() == 2
+    db.session.commit()
+    db.session.expire_all()
+
+    modelos = permissoes.garantir_modelos()
+    assert db.session.get(Perfil, ids_antigos[1]) is None and db.session.get(Perfil, ids_antigos[2]) is None
+    personalizado = db.session.get(Perfil, ids_antigos[0])
+    assert (personalizado.modelo_id, personalizado.is_default) == (modelos["Membro"], False)
+    assert permissoes.perfil_padrao(projeto.id) == personalizado.id
+
+    perfis = {
+        u.id: perfil_id
+        for u, perfil_id in db.session.query(User, MembroPerfil.perfil_id)
+        .join(ProjetoMembro, ProjetoMembro.user_id == User.id)
+        .join(MembroPerfil, MembroPerfil.projeto_membro_id == ProjetoMembro.id)
+        .filter(User.id.in_([ana.id, bia.id, caio.id]))
+    }
+    assert perfis == {ana.id: personalizado.id, bia.id: modelos["Administrador"], caio.id: modelos["Membro"]}
+    assert permissoes.tem_permissao(projeto.id, "pode_excluir_atividade", ana.id)
+    assert not permissoes.tem_permissao(outro.id, "pode_excluir_atividade", caio.id)
+    assert permissoes.tem_permissao(projeto.id, "pode_editar_projeto", bia.id)
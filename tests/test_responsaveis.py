@@ -0,0 +1,19 @@
+from models import Atividade, Risco, User
+
+
+def test_cadastro_vincula_atribuicoes_feitas_pelo_nome(app, db, projeto, criar_atividades):
+    nome = f"novato{projeto.id}"
+    atividade, = criar_atividades("A")
+    atividade.responsavel = nome
+    risco = Risco(projeto_id=projeto.id, risco="R", responsavel=nome, criado_por=f" {nome} ")
+    db.session.add(risco)
+    db.session.commit()
+    assert atividade.responsavel_id is None and risco.criado_por_id is None
+
+    resposta = app.test_client().post("/register", data={"email": f"{nome}@teste", "password": "senha"})
+    assert resposta.status_code == 302
+
+    novo = User.query.filter_by(username=nome).one()
+    db.session.expire_all()
+    assert db.session.get(Atividade, atividade.id).responsavel_id == novo.id
+    assert (risco.responsavel_id, risco.criado_por_id) == (novo.id, novo.id)